@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Keep the animation frames around between loop cycles.
+
+Rather than re-reading every PNG in the window and rebuilding the whole
+animation from scratch each time, the frames are decoded (and palette
+quantized, which is what the GIF needs anyway) exactly once and kept in
+memory keyed by their timestamp.  Each cycle only the new frames are
+decoded and the ones that aged out of the window are dropped; the GIF
+and MP4 are then written straight from what's in memory.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+import subprocess as subp
+from datetime import datetime as dt
+
+import numpy as np
+from PIL import Image
+
+
+class FrameBuffer():
+    """
+    Class to hold the decoded frames, in time order
+    """
+    def __init__(self, dtfmt="%Y%j%H%M%S%f", ncolors=256):
+        """
+        'dtfmt' is the format of the timestamp at the start of the
+        filenames (before the first '_'), and 'ncolors' is the size of
+        each frame's palette.
+        """
+        self.dtfmt = dtfmt
+        self.ncolors = ncolors
+
+        # Keyed by timestamp; each is a dict with the filename, its
+        #   modification time, and the palette indices and palette
+        self.frames = {}
+
+    def parseTimestamp(self, fname):
+        """
+        Pull the timestamp out of the filename; returns None if it can't
+        """
+        beach = os.path.basename(fname)
+        try:
+            ts = dt.strptime(beach.split("_")[0], self.dtfmt)
+        except ValueError as err:
+            print(str(err))
+            ts = None
+
+        return ts
+
+    def decode(self, fname):
+        """
+        Read in and palette quantize a single frame
+        """
+        img = Image.open(fname).convert("RGB")
+
+        # method=2 is the fast octree, which is plenty good for these
+        pimg = img.quantize(colors=self.ncolors, method=2)
+        pal = np.array(pimg.getpalette()[0:3*self.ncolors], dtype=np.uint8)
+        pal = pal.reshape(-1, 3)
+
+        return np.array(pimg, dtype=np.uint8), pal
+
+    def update(self, flist, now, maxage=4.):
+        """
+        Make the buffer match the files in 'flist' that are within
+        'maxage' hours of 'now'; only frames that are new (or whose file
+        changed since we last saw it) are actually decoded.
+
+        Returns the number of frames (added, removed).
+        """
+        maxage *= 60. * 60.
+
+        wanted = {}
+        for fname in flist:
+            ts = self.parseTimestamp(fname)
+            if ts is not None and (now - ts).total_seconds() < maxage:
+                wanted.update({ts: fname})
+
+        nremoved = 0
+        for ts in list(self.frames.keys()):
+            if ts not in wanted:
+                del self.frames[ts]
+                nremoved += 1
+
+        nadded = 0
+        for ts in sorted(wanted):
+            fname = wanted[ts]
+            try:
+                mtime = os.path.getmtime(fname)
+                frame = self.frames.get(ts)
+                if frame is not None and frame['fname'] == fname and \
+                   frame['mtime'] == mtime:
+                    continue
+
+                idx, pal = self.decode(fname)
+            except (OSError, ValueError) as err:
+                # Leave it out and it'll get tried again next time
+                print("Couldn't read frame %s!" % (fname))
+                print(str(err))
+                continue
+
+            self.frames.update({ts: {'fname': fname, 'mtime': mtime,
+                                     'idx': idx, 'pal': pal}})
+            nadded += 1
+
+        print("%d frames in the buffer; %d new, %d expired" %
+              (len(self.frames), nadded, nremoved))
+
+        return nadded, nremoved
+
+    def ordered(self):
+        """
+        Return the frames in time order, dropping any that aren't the
+        same size as the latest one (like after a map change) since the
+        animations need them all to match
+        """
+        frames = [self.frames[ts] for ts in sorted(self.frames)]
+        if frames == []:
+            return frames
+
+        shape = frames[-1]['idx'].shape
+        frames = [each for each in frames if each['idx'].shape == shape]
+
+        return frames
+
+    def writeGIF(self, outname, holdframes=13, duration=100):
+        """
+        Write the buffer out as a looping GIF; 'duration' is the time per
+        frame in ms, and the last frame is repeated 'holdframes' more times
+        so it doesn't loop around in an annoying way
+        """
+        frames = self.ordered()
+        if frames == []:
+            print("No frames to make a GIF out of!")
+            return
+
+        print("Starting GIF creation...")
+        images = []
+        for each in frames:
+            img = Image.fromarray(each['idx'], mode="P")
+            img.putpalette(each['pal'].ravel().tolist())
+            images.append(img)
+
+        images += [images[-1]]*holdframes
+
+        tname = "%s.%d.tmp" % (outname, os.getpid())
+        images[0].save(tname, format='GIF', save_all=True,
+                       append_images=images[1:], loop=0,
+                       duration=duration, optimize=False)
+        os.replace(tname, outname)
+        print("GIF saved as %s" % (outname))
+
+    def writeMP4(self, outname, holdframes=13, fps=10):
+        """
+        Write the buffer out as an H.264 MP4; the frames are piped into
+        a single ffmpeg process as raw RGB so nothing is re-read from disk
+        """
+        frames = self.ordered()
+        if frames == []:
+            print("No frames to make an MP4 out of!")
+            return
+
+        print("Starting MP4 creation...")
+        ny, nx = frames[-1]['idx'].shape
+
+        # Has to be even for yuv420p, so pad it if needed
+        vfopts = "format=yuv420p,pad=ceil(iw/2)*2:ceil(ih/2)*2"
+
+        tname = "%s.%d.tmp.mp4" % (outname, os.getpid())
+        ffmpegcall = ["ffmpeg", "-y", "-loglevel", "error",
+                      "-f", "rawvideo", "-pix_fmt", "rgb24",
+                      "-s", "%dx%d" % (nx, ny), "-r", str(fps),
+                      "-i", "-",
+                      "-c:v", "libx264",
+                      "-vf", vfopts,
+                      tname]
+
+        try:
+            proc = subp.Popen(ffmpegcall, stdin=subp.PIPE)
+        except OSError as err:
+            print("FFMPEG failed to start!")
+            print(str(err))
+            return
+
+        try:
+            for i, each in enumerate(frames + [frames[-1]]*holdframes):
+                # Only need to go back to RGB the one time per frame
+                if i < len(frames):
+                    rgb = each['pal'][each['idx']].tobytes()
+                proc.stdin.write(rgb)
+            proc.stdin.close()
+        except OSError as err:
+            # Usually a broken pipe, so ffmpeg will have said why
+            print(str(err))
+        retcode = proc.wait()
+
+        if retcode == 0:
+            os.replace(tname, outname)
+            print("MP4 saved as %s" % (outname))
+        else:
+            print("FFMPEG failed with return code %d!" % (retcode))
+            if os.path.exists(tname):
+                os.remove(tname)
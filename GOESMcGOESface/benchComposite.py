@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Benchmark the multi-band composites against resampling band by band.
+
+Uses fake data on grids about the size of our window of the 2 km ABI
+bands and our target grid, so it runs anywhere.  Compares:
+    - every band resampled from scratch (kd-tree and all)
+    - every band resampled on its own with the same neighbour info
+    - all of the bands stacked up and resampled at once (composites.py)
+and then how much the recipe math on top of that costs.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import time
+
+import numpy as np
+import pyresample as pr
+
+import composites as comps
+
+
+def makeGrids(srcShape=(400, 500), dstShape=(800, 800)):
+    """
+    Source and target grids covering roughly the same patch of Arizona
+    """
+    lon, lat = np.meshgrid(np.linspace(-113.5, -109.3, srcShape[1]),
+                           np.linspace(36.8, 32.7, srcShape[0]))
+    src = pr.geometry.SwathDefinition(lons=lon, lats=lat)
+
+    lon, lat = np.meshgrid(np.linspace(-113.4, -109.4, dstShape[1]),
+                           np.linspace(36.7, 32.8, dstShape[0]))
+    dst = pr.geometry.SwathDefinition(lons=lon, lats=lat)
+
+    return src, dst
+
+
+def fakeBands(nbands, shape):
+    """
+    Brightness temperature-ish data with a few holes in it
+    """
+    rng = np.random.RandomState(42)
+    data = 200. + 100.*rng.random_sample((nbands,) + shape)
+    mask = rng.random_sample((nbands,) + shape) < 0.01
+
+    return np.ma.masked_array(data.astype(np.float32), mask=mask)
+
+
+def timeit(func, nreps=5):
+    """
+    Best of 'nreps' runs of func(), in seconds
+    """
+    best = None
+    for _ in range(nreps):
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        if best is None or dt < best:
+            best = dt
+
+    return best
+
+
+if __name__ == "__main__":
+    nbandsList = [1, 2, 3, 4, 6, 8]
+    radius = 5000.
+
+    src, dst = makeGrids()
+    shape = dst.shape
+    print("Source grid %s, target grid %s" % (src.shape, shape))
+
+    t0 = time.perf_counter()
+    pCoeff = pr.kd_tree.get_neighbour_info(src, dst, radius, neighbours=1)
+    tkd = time.perf_counter() - t0
+    print("Neighbour info: %.1f ms (done once per grid)\n" % (tkd*1e3))
+
+    allbands = fakeBands(max(nbandsList), src.shape)
+
+    print("%6s %12s %12s %12s %12s" % ("bands", "scratch", "per-band",
+                                        "stacked", "recipe"))
+    for nbands in nbandsList:
+        stack = allbands[0:nbands]
+
+        def scratch():
+            for band in stack:
+                pr.kd_tree.resample_nearest(src, band, dst, radius)
+
+        def perBand():
+            for band in stack:
+                comps.resampleStack(band[None, :, :], pCoeff, shape)
+
+        def stacked():
+            return comps.resampleStack(stack, pCoeff, shape)
+
+        tscratch = timeit(scratch, nreps=1)
+        tper = timeit(perBand)
+        tstack = timeit(stacked)
+
+        # The recipe always makes 3 components, no matter how many bands
+        bands = stacked()
+        order = [7, 13, 15, 11, 14, 2, 5, 8][0:nbands]
+        trecipe = None
+        if nbands >= 3:
+            trecipe = timeit(lambda: comps.toRGBA(
+                comps.componentStack(bands, order, 'nightmicro')))
+
+        print("%6d %9.1f ms %9.1f ms %9.1f ms %12s" %
+              (nbands, tscratch*1e3, tper*1e3, tstack*1e3,
+               "%9.1f ms" % (trecipe*1e3) if trecipe is not None else "-"))
+
+    # Marginal cost of each band past the first, in the stacked case
+    #   compared to the one-off neighbour info
+    tone = timeit(lambda: comps.resampleStack(allbands[0:1], pCoeff, shape))
+    tall = timeit(lambda: comps.resampleStack(allbands, pCoeff, shape))
+    perExtra = (tall - tone)/(allbands.shape[0] - 1)
+    print("\nEach extra band: %.2f ms stacked, %.1f%% of the neighbour info"
+          % (perExtra*1e3, 100.*perExtra/tkd))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Make multi-band RGB composites (night microphysics, dust, ...) of GOES.
+
+Every band on the same ABI grid uses exactly the same neighbour info (see
+projCache), so rather than resampling each band on its own they're all
+stacked up and resampled in one go; the expensive part is figuring out
+which source pixel goes where, and that's only done once no matter how
+many bands there are.  Bands on a different grid (like the 0.5 km red
+band) just get their own stack.
+
+The recipes then turn the (bands, ny, nx) stack into the three color
+components (a band, or the difference of two), each scaled to its range
+and gamma corrected, all as whole-array operations.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+import pyresample as pr
+
+
+# Each component is ((band, band to subtract or None), min, max, gamma),
+#   in R, G, B order.  Ranges are from the CIRA/EUMETSAT quick guides and
+#   are in K, or reflectance for the visible bands
+recipes = {'nightmicro': {'title': "Nighttime Microphysics RGB",
+                          'components': [((15, 13), -6.7, 2.6, 1.),
+                                         ((13, 7), -3.1, 5.2, 1.),
+                                         ((13, None), 243.9, 292.6, 1.)]},
+           'dust': {'title': "Dust RGB",
+                    'components': [((15, 13), -6.7, 2.6, 1.),
+                                   ((14, 11), -0.5, 20., 2.5),
+                                   ((13, None), 261.2, 288.7, 1.)]},
+           'daycloudphase': {'title': "Day Cloud Phase Distinction RGB",
+                             'components': [((13, None), 280.7, 219.6, 1.),
+                                            ((2, None), 0., 0.78, 1.),
+                                            ((5, None), 0.01, 0.59, 1.)]}}
+
+
+def recipeBands(recipe):
+    """
+    Return the (sorted) list of ABI bands that 'recipe' needs
+    """
+    bands = set()
+    for (band1, band2), _, _, _ in recipes[recipe]['components']:
+        bands.add(band1)
+        if band2 is not None:
+            bands.add(band2)
+
+    return sorted(bands)
+
+
+def resampleStack(stack, pCoeff, shape):
+    """
+    Nearest neighbour resample all of the bands in 'stack' (a (bands, ny,
+    nx) masked array, all on the same grid) at once using the neighbour
+    info 'pCoeff' (see projCache), into a (bands, shape[0], shape[1])
+    float32 array with NaN wherever there's no data
+    """
+    # pyresample wants the bands last; filling with NaN rather than
+    #   carrying the mask along keeps it all plain float arrays
+    data = np.ma.filled(np.ma.asarray(stack, dtype=np.float32), np.nan)
+    data = np.moveaxis(data, 0, -1)
+
+    pData = pr.kd_tree.get_sample_from_neighbour_info('nn', shape, data,
+                                                      pCoeff[0],
+                                                      pCoeff[1],
+                                                      pCoeff[2],
+                                                      fill_value=np.nan)
+
+    return np.moveaxis(np.asarray(pData, dtype=np.float32), -1, 0)
+
+
+def componentStack(bands, order, recipe):
+    """
+    Turn the resampled 'bands' (a (bands, ny, nx) array whose bands are
+    listed in 'order') into the (3, ny, nx) R, G, B components of 'recipe'
+    scaled to 0 - 1; NaN wherever any of the inputs are
+    """
+    comps = recipes[recipe]['components']
+    first = [order.index(band1) for (band1, _), _, _, _ in comps]
+    second = [order.index(band2) if band2 is not None else -1
+              for (_, band2), _, _, _ in comps]
+
+    vals = bands[first]
+    sub = np.array(second) >= 0
+    if np.any(sub):
+        vals[sub] -= bands[np.array(second)[sub]]
+
+    # Everything as (3, 1, 1) so it broadcasts over the whole stack
+    lo = np.array([each[1] for each in comps], dtype=np.float32)[:, None, None]
+    hi = np.array([each[2] for each in comps], dtype=np.float32)[:, None, None]
+    gamma = np.array([each[3] for each in comps],
+                     dtype=np.float32)[:, None, None]
+
+    # Ranges can be backwards (colder is brighter), which this handles too
+    frac = np.clip((vals - lo)/(hi - lo), 0., 1.)
+    frac **= 1./gamma
+
+    return frac
+
+
+def toRGBA(frac):
+    """
+    Turn the (3, ny, nx) 0 - 1 components into a (ny, nx, 4) uint8 RGBA
+    array; pixels that are missing any component are transparent
+    """
+    good = np.all(np.isfinite(frac), axis=0)
+
+    rgba = np.zeros(frac.shape[1:] + (4,), dtype=np.uint8)
+    rgba[..., 0:3] = np.moveaxis(np.round(np.nan_to_num(frac)*255.), 0, -1)
+    rgba[..., 3] = np.where(good, 255, 0)
+
+    return rgba
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Keep the reprojected frames themselves, not just the PNGs of them.
+
+Each frame of data (on our target grid, before it's colorized) is stored
+in a fixed size, memory mapped ring buffer of (time, ny, nx) on disk, with
+a separate index of the timestamp in each slot.  New frames go into the
+oldest slot once it's full, so it never grows.  The values are stored as
+uint16 with a scale and offset (see cubeCoding) to keep it small, with
+the top code reserved for missing data.
+
+Anything that wants the actual numbers (animations, site stats, trends,
+re-rendering with a different colormap) can then just map it in instead
+of going back to the netCDF files.  Every possible code also maps to
+exactly one color, so re-rendering is a single table lookup per frame;
+see codeColors and plotGOES.rerenderCube.
+
+Only one process should write to it, but any number can read; a slot's
+data is always written before its timestamp so the index never points
+at a half written frame.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+import json
+import calendar
+from datetime import datetime as dt
+from datetime import timedelta as td
+
+import numpy as np
+
+
+# Code for missing/masked data; everything else is actual values
+badcode = 65535
+
+
+def cubeCoding(vmin, vmax):
+    """
+    (offset, scale) that covers the range vmin to vmax with plenty of
+    room on either side, for when the colormap range changes later
+    """
+    rnge = vmax - vmin
+    offset = vmin - rnge
+    scale = 3.*rnge/(badcode - 1)
+
+    return offset, scale
+
+
+def encode(data, offset, scale):
+    """
+    Turn the (masked) data array into uint16 codes; values outside of what
+    the coding covers are clipped to its ends
+    """
+    vals = np.ma.filled(np.ma.asarray(data, dtype=np.float32), np.nan)
+    bad = ~np.isfinite(vals)
+
+    codes = np.round((vals - offset)/scale)
+    codes = np.clip(np.where(bad, 0, codes), 0, badcode - 1)
+    codes = codes.astype(np.uint16)
+    codes[bad] = badcode
+
+    return codes
+
+
+def decode(codes, offset, scale):
+    """
+    Turn uint16 codes back into a masked float32 array
+    """
+    codes = np.asarray(codes)
+    vals = codes.astype(np.float32)*np.float32(scale) + np.float32(offset)
+
+    return np.ma.masked_where(codes == badcode, vals)
+
+
+def codeColors(lut, offset, scale):
+    """
+    Colors (as uint32 pixels) for every possible code, from the
+    mapLayers.ColorLUT 'lut'; index it with the codes to colorize a frame
+    """
+    allcodes = np.arange(badcode + 1, dtype=np.uint16)
+
+    return lut.lut32[lut.index(decode(allcodes, offset, scale))]
+
+
+def toUnix(ts):
+    """
+    UTC datetime to unix time, keeping the fractional seconds
+    """
+    return calendar.timegm(ts.utctimetuple()) + ts.microsecond/1e6
+
+
+def fromUnix(secs):
+    """
+    Unix time back to a UTC datetime
+    """
+    return dt(1970, 1, 1) + td(seconds=float(secs))
+
+
+class FrameCube():
+    """
+    Class to hold the memory mapped ring buffer of frames and its index
+    """
+    def __init__(self, cubedir, nslots=288, offset=0., scale=0.01):
+        """
+        Frames are kept in 'cubedir', 'nslots' of them at most.  If there's
+        already a cube there it's reused as long as it matches, otherwise
+        a new one is made (with the shape of the first frame) when the
+        first frame is put in.
+
+        See cubeCoding for 'offset' and 'scale'.
+        """
+        self.cubedir = cubedir
+        self.nslots = nslots
+        self.offset = offset
+        self.scale = scale
+
+        self.dataname = "%s/data.npy" % (cubedir)
+        self.timesname = "%s/times.npy" % (cubedir)
+        self.metaname = "%s/meta.json" % (cubedir)
+
+        self.data = None
+        self.times = None
+        self.info = {}
+
+        os.makedirs(cubedir, exist_ok=True)
+        self.load()
+
+    def load(self, mode='r+'):
+        """
+        Map in an existing cube if it matches what we want
+        """
+        try:
+            with open(self.metaname, 'r') as f:
+                meta = json.load(f)
+            data = np.lib.format.open_memmap(self.dataname, mode=mode)
+            times = np.lib.format.open_memmap(self.timesname, mode=mode)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as err:
+            print(str(err))
+            print("Cube in %s unreadable! It'll be remade." % (self.cubedir))
+            return False
+
+        matches = (meta['nslots'] == self.nslots and
+                   meta['offset'] == self.offset and
+                   meta['scale'] == self.scale and
+                   data.shape[0] == self.nslots and
+                   times.shape[0] == self.nslots)
+        if matches is False:
+            print("Cube in %s doesn't match; it'll be remade." %
+                  (self.cubedir))
+            return False
+
+        self.data = data
+        self.times = times
+        self.info = meta.get('info', {})
+
+        return True
+
+    def create(self, shape):
+        """
+        Make a brand new (empty) cube for frames of 'shape'
+        """
+        print("Making a new %d x %s cube in %s" % (self.nslots, shape,
+                                                   self.cubedir))
+        # Index goes first, and empty, so a crash part way through
+        #   can't leave a cube that looks like it has frames in it
+        times = np.lib.format.open_memmap(self.timesname, mode='w+',
+                                          dtype=np.float64,
+                                          shape=(self.nslots,))
+        times[:] = np.nan
+        times.flush()
+
+        data = np.lib.format.open_memmap(self.dataname, mode='w+',
+                                         dtype=np.uint16,
+                                         shape=(self.nslots,) + shape)
+
+        self.data = data
+        self.times = times
+        self.info = {}
+        self.saveMeta()
+
+    def saveMeta(self):
+        """
+        Write out the coding and the info for the titles
+        """
+        meta = {'nslots': self.nslots, 'offset': self.offset,
+                'scale': self.scale, 'info': self.info}
+
+        tname = "%s.%d.tmp" % (self.metaname, os.getpid())
+        with open(tname, 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tname, self.metaname)
+
+    def pickSlot(self, secs):
+        """
+        Slot for a frame at unix time 'secs'; the same one if we've
+        already got that time, else an empty one, else the oldest
+        """
+        same = np.flatnonzero(self.times == secs)
+        if same.size > 0:
+            return same[0]
+
+        empty = np.flatnonzero(np.isnan(self.times))
+        if empty.size > 0:
+            return empty[0]
+
+        return int(np.argmin(self.times))
+
+    def putCodes(self, ts, codes, info=None):
+        """
+        Store the (already encoded) frame 'codes' taken at (UTC datetime)
+        'ts'; 'info' is a dict of anything needed for its title
+        """
+        if self.data is None or self.data.shape[1:] != codes.shape:
+            self.create(codes.shape)
+
+        secs = toUnix(ts)
+        slot = self.pickSlot(secs)
+
+        # Mark the slot empty while it's being overwritten
+        self.times[slot] = np.nan
+        self.times.flush()
+        self.data[slot] = codes
+        self.data.flush()
+        self.times[slot] = secs
+        self.times.flush()
+
+        if info is not None and info != self.info:
+            self.info = info
+            self.saveMeta()
+
+        return slot
+
+    def put(self, ts, data, info=None):
+        """
+        Same as putCodes, but for the actual (masked) data
+        """
+        codes = encode(data, self.offset, self.scale)
+
+        return self.putCodes(ts, codes, info=info)
+
+    def index(self, since=None):
+        """
+        Return a time ordered list of (UTC datetime, slot) of the frames
+        in the cube; if 'since' (a datetime) is given, only ones after it
+        """
+        if self.times is None:
+            return []
+
+        times = np.array(self.times)
+        slots = np.flatnonzero(np.isfinite(times))
+        if since is not None:
+            slots = slots[times[slots] > toUnix(since)]
+        slots = slots[np.argsort(times[slots])]
+
+        return [(fromUnix(times[each]), int(each)) for each in slots]
+
+    def codes(self, slot):
+        """
+        The encoded frame in 'slot', straight from the map
+        """
+        return self.data[slot]
+
+    def get(self, slot):
+        """
+        The frame in 'slot' as a masked float32 array
+        """
+        return decode(self.data[slot], self.offset, self.scale)
+
+    def stack(self, since=None):
+        """
+        Return the times and a (time, ny, nx) masked float32 array of all
+        of the frames (after 'since' if it's given), oldest first
+        """
+        idx = self.index(since=since)
+        if idx == []:
+            return [], None
+
+        slots = [each[1] for each in idx]
+        frames = decode(self.data[slots], self.offset, self.scale)
+
+        return [each[0] for each in idx], frames
+
+    def expire(self, cutoff):
+        """
+        Forget about any frames from before (datetime) 'cutoff'; returns
+        how many there were
+        """
+        if self.times is None:
+            return 0
+
+        old = np.flatnonzero(self.times < toUnix(cutoff))
+        self.times[old] = np.nan
+        self.times.flush()
+
+        return old.size
@@ -15,15 +15,34 @@ Requires AWS credentials in the awsCreds.conf file.
 
 from __future__ import division, print_function, absolute_import
 
+import io
+import os
 import glob
+import time
 from os import mkdir
 from os.path import basename
+from datetime import datetime as dt
 from datetime import timedelta as td
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
 import botocore
+from botocore.config import Config as BotoConfig
+from boto3.s3.transfer import TransferConfig
 import numpy as np
 
+import listCache as lcache
+
+
+# AWS GOES bucket location/name
+#  https://registry.opendata.aws/noaa-goes/
+awsbucket = 'noaa-goes16'
+awszone = 'us-east-1'
+
+# Mesoscale sectors; the files are CMIPM1 or CMIPM2 depending on which of
+#   the two (movable!) sectors they're from, but both are under CMIPM
+mesoinst = "ABI-L2-CMIPM"
+
 
 def checkOutDir(outdir):
     """
@@ -43,27 +62,226 @@ def checkOutDir(outdir):
     return flist
 
 
-def GOESAWSgrab(aws_keyid, aws_secretkey, now, outdir,
-                timedelta=6, forceDown=False):
+def getS3Client(aws_keyid, aws_secretkey, awszone='us-east-1',
+                maxconns=10):
     """
-    AWS IAM user key
-    AWS IAM user secret key
-    Time query is relative to (usually datetime.datetime.utcnow)
-    Hours to query back from above
+    Make a single S3 client to share between all of the download threads.
+
+    'maxconns' is the size of the HTTP connection pool; it should be at
+    least as big as the number of threads that'll be using the client
+    otherwise they just end up waiting on each other for a connection.
+    """
+    bcfg = BotoConfig(max_pool_connections=maxconns,
+                      retries={'max_attempts': 5})
+
+    s3 = boto3.client('s3', awszone,
+                      aws_access_key_id=aws_keyid,
+                      aws_secret_access_key=aws_secretkey,
+                      config=bcfg)
+
+    return s3
+
+
+def fetchObject(s3, bucket, key, oname):
+    """
+    Download a single object to 'oname', via a temporary name in the
+    same directory so nothing ever sees a partially written file.
+
+    Returns a dict of stats about the transfer; 'ok' is True if it worked.
+    """
+    # We're already running a bunch of these in parallel, so don't let
+    #   boto3 spin up even more threads for each individual file
+    xcfg = TransferConfig(use_threads=False)
+
+    tname = "%s.part" % (oname)
+    stats = {'key': key, 'filename': oname, 'bytes': 0,
+             'seconds': 0., 'ok': False}
+
+    t0 = time.time()
+    try:
+        s3.download_file(bucket, key, tname, Config=xcfg)
+        os.replace(tname, oname)
+        stats['bytes'] = os.path.getsize(oname)
+        stats['ok'] = True
+        print("Downloaded: %s" % (oname))
+    except botocore.exceptions.ReadTimeoutError:
+        print("DOWNLOAD FAILURE! ReadTimeoutError")
+    except botocore.exceptions.ClientError as e:
+        print("DOWNLOAD FAILURE! %s" % (e.response['Error']['Code']))
+    except (OSError, botocore.exceptions.BotoCoreError) as err:
+        # Connection problems, and anything that went wrong part way
+        #   through the transfer (like the connection closing)
+        print("DOWNLOAD FAILURE! %s" % (str(err)))
+    stats['seconds'] = time.time() - t0
+
+    # Don't leave turds around if it failed part way through
+    if stats['ok'] is False:
+        try:
+            os.remove(tname)
+        except OSError:
+            pass
+
+    return stats
+
+
+def fetchBytes(s3, bucket, key):
+    """
+    Download a single object straight into memory, for when it's going to
+    be read right away and there's no need for it to go to disk first.
+
+    Returns a dict of stats about the transfer (see fetchObject) with the
+    contents of the object in 'data' if it worked.
+    """
+    xcfg = TransferConfig(use_threads=False)
+
+    stats = {'key': key, 'filename': None, 'bytes': 0,
+             'seconds': 0., 'ok': False, 'data': None}
+
+    t0 = time.time()
+    try:
+        buf = io.BytesIO()
+        s3.download_fileobj(bucket, key, buf, Config=xcfg)
+        stats['data'] = buf.getvalue()
+        stats['bytes'] = len(stats['data'])
+        stats['ok'] = True
+        print("Downloaded: %s (to memory)" % (basename(key)))
+    except botocore.exceptions.ReadTimeoutError:
+        print("DOWNLOAD FAILURE! ReadTimeoutError")
+    except botocore.exceptions.ClientError as e:
+        print("DOWNLOAD FAILURE! %s" % (e.response['Error']['Code']))
+    except (OSError, botocore.exceptions.BotoCoreError) as err:
+        # Connection problems, and anything that went wrong part way
+        #   through the transfer (like the connection closing)
+        print("DOWNLOAD FAILURE! %s" % (str(err)))
+    stats['seconds'] = time.time() - t0
+
+    return stats
+
+
+def writeRaw(data, oname):
+    """
+    Write the (already downloaded) contents of an object to 'oname', via a
+    temporary name so nothing ever sees a partially written file
+    """
+    tname = "%s.part" % (oname)
+    with open(tname, 'wb') as f:
+        f.write(data)
+    os.replace(tname, oname)
+
+
+def downloadObjects(s3, bucket, todo, nworkers=8):
+    """
+    Download all of the (key, outputfilename) pairs in 'todo' using
+    a pool of 'nworkers' threads that all share the same client 's3'.
+
+    Returns a list of per-object stats (see fetchObject).
+    """
+    if todo == []:
+        return []
+
+    print("Downloading %d files with %d threads..." % (len(todo), nworkers))
+    t0 = time.time()
+
+    allstats = []
+    with ThreadPoolExecutor(max_workers=nworkers) as pool:
+        futs = [pool.submit(fetchObject, s3, bucket, key, oname)
+                for key, oname in todo]
+        for fut in as_completed(futs):
+            allstats.append(fut.result())
+
+    # Put them back into the order they were requested in
+    order = {key: i for i, (key, _) in enumerate(todo)}
+    allstats.sort(key=lambda x: order[x['key']])
+
+    wall = time.time() - t0
+    nbytes = sum([each['bytes'] for each in allstats])
+    ngood = len([each for each in allstats if each['ok'] is True])
+    print("%d of %d files (%.1f MB) downloaded in %.1f s (%.2f MB/s)" %
+          (ngood, len(todo), nbytes/1e6, wall, nbytes/1e6/max(wall, 1e-3)))
+
+    return allstats
+
+
+def keyProduct(key):
     """
-    # AWS GOES bucket location/name
-    #  https://registry.opendata.aws/noaa-goes/
-    awsbucket = 'noaa-goes16'
-    awszone = 'us-east-1'
+    Return the (instrument/product, channel) of a GOES key or filename,
+    like ('ABI-L2-CMIPC', 13) for
+    OR_ABI-L2-CMIPC-M6C13_G16_s20192911201000_e..._c....nc
 
+    The mesoscale sector number is dropped, so both CMIPM1 and CMIPM2
+    files give 'ABI-L2-CMIPM' (see mesoinst) just like their prefix.
+    Products without a channel (the derived ones) get None.
+    """
+    # Bit of hackey magic. Sorry. Needed to ignore the "mode" part
+    #   but still check the channel
+    keyparts = basename(key).split("_")[1].rsplit("-", 1)
+    modechan = keyparts[1]
+    if "C" in modechan:
+        channel = int(modechan.split("C")[1])
+    else:
+        channel = None
+
+    return keyparts[0].rstrip("0123456789"), channel
+
+
+def rawSuffix(inst, channel):
+    """
+    What the raw files of 'inst' and 'channel' are saved as, after the
+    timestamp; mesoscale ones get an M so they're easy to tell apart
+    """
+    if inst == mesoinst:
+        suffix = "_MC%02d.nc" % (channel)
+    else:
+        suffix = "_C%02d.nc" % (channel)
+
+    return suffix
+
+
+def keyGroup(key):
+    """
+    Everything in a GOES key before the timestamp; keys in the same group
+    (scan mode, channel, satellite) always sort in time order
+    """
+    return key.split("_s")[0]
+
+
+def keyScanStart(key):
+    """
+    When the scan of a GOES key or filename started, like
+    datetime(2019, 10, 18, 12, 1, 0, 400000) for
+    OR_ABI-L2-CMIPC-M6C13_G16_s20192911201004_e..._c....nc
+
+    Every band of a scan has the same start time, but their end times
+    (which the raw files are named by) can be a little different.
+    """
+    stamp = basename(key).split("_s")[1].split("_")[0]
+
+    return dt.strptime(stamp, "%Y%j%H%M%S%f")
+
+
+def GOESAWSlist(s3, now, outdir, timedelta=6, forceDown=False,
+                listcache=None, inst="ABI-L2-CMIPC", channels=(13,)):
+    """
+    Figure out what needs downloading, without actually downloading it.
+
+    's3' is the client (see getS3Client) and the rest are the same as
+    for GOESAWSgrab.  Each hour of 'inst' is listed for all of its
+    'channels' at once.  If 'listcache' is given, it keeps track of each
+    scan mode and channel separately (see keyGroup) since they come
+    before the timestamp in the filename; once it's seen all of the ones
+    we want, each of those is listed on its own so only the new files
+    come back.
+
+    Returns a list of (key, output filename) to go get, a dict of the
+    prefix each key was listed under (for ListingCache.retry) and the
+    list of hourly prefixes that are still in the time window (for
+    ListingCache.prune).
+    """
     # ABI: Advanced Baseline Imager
     # L2: "Level 2" (processed) data
     # CMIPC are the "Cloud & Moisture Imagery CONUS" products
     #   these are derived products based on the "ABI-L1b-Rad*" data
     #   See also: https://www.ncdc.noaa.gov/data-access/satellite-data/goes-r-series-satellites
-    inst = "ABI-L2-CMIPC"
-    channel = 13
-
     # Check our output directory for files already downloaded
     donelist = checkOutDir(outdir)
 
@@ -74,13 +292,19 @@ def GOESAWSgrab(aws_keyid, aws_secretkey, now, outdir,
 
     # Construct the key prefixes between the oldest and the newest
     querybins = []
+    hourbins = []
+
+    # Seconds after the end of an hour to keep looking in that hour's
+    #   prefix, to account for the latency of the data showing up on AWS
+    lategrace = 900.
 
     # timedelta MUST be an int...
     timedelta = np.int(np.round(timedelta, decimals=0))
 
     for i in range(timedelta, -1, -1):
         delta = td(hours=i)
-        qdt = (now - delta).timetuple()
+        qdtime = now - delta
+        qdt = qdtime.timetuple()
 
         # Include the year so it works on 1/1 UT
         qyear = qdt.tm_year
@@ -88,70 +312,67 @@ def GOESAWSgrab(aws_keyid, aws_secretkey, now, outdir,
         qhour = qdt.tm_hour
 
         ckey = "%s/%04d/%03d/%02d/" % (inst, qyear, qday, qhour)
-        querybins.append(ckey)
+        hourbins.append(ckey)
+
+        # Once the hour is over (plus a bit), nothing new will show up
+        hstart = qdtime.replace(minute=0, second=0, microsecond=0)
+        closed = now > (hstart + td(hours=1, seconds=lategrace))
+
+        querybins.append((ckey, closed))
     # print(querybins)
 
-    s3 = boto3.resource('s3', awszone,
-                        aws_access_key_id=aws_keyid,
-                        aws_secret_access_key=aws_secretkey)
+    def wantedGroup(key):
+        kinst, channel = keyProduct(key)
+        if kinst == inst and channel in channels:
+            return keyGroup(key)
+        return None
 
-    try:
-        buck = s3.Bucket(awsbucket)
-    except botocore.exceptions.ClientError as e:
-        # NOTE: Is this the correct exception?  No clue.
-        if e.response['Error']['Code'] == "404":
-            print("The object does not exist.")
-        else:
-            raise
-
-    matches = []
-    for qt in querybins:
+    # There are two mesoscale sectors, and both are always listed
+    ngroups = len(channels)
+    if inst == mesoinst:
+        ngroups *= 2
+
+    # Collect everything that we'll need to go get
+    todo = []
+    keyprefix = {}
+    for qt, closed in querybins:
         print("Querying:", qt)
         try:
-            todaydata = buck.objects.filter(Prefix=qt)
-
+            todaydata = lcache.listPrefix(s3, awsbucket, qt,
+                                          listcache=listcache,
+                                          closed=closed, full=forceDown,
+                                          groupkey=wantedGroup,
+                                          ngroups=ngroups)
             for objs in todaydata:
                 # Current filename
-                ckey = basename(objs.key)
+                ckey = basename(objs['Key'])
 
                 # print("Found %s" % (ckey))
 
-                # Specific filename to search for. Do it in two parts,
-                #   one here to select the instrument/product and another
-                #   to select the desired channel
-                # Backup of original query:
-                # fkey = "OR_%s-M3C%02d_G16" % (inst, channel)
-                fkey = "OR_%s-M" % (inst)
-                chankey = "C%02d" % (channel)
-
-                # Bit of hackey magic. Sorry. Needed to ignore the "mode"
-                #   parameter but still check the channel
-                keyparts = ckey.split("_")[1].split("-")[3]
-
-                # Now only select ones that match our product and our channel
-                if ckey.startswith(fkey) and keyparts.endswith(chankey):
+                # Only select ones that match our product and channels;
+                #   for the mesoscale sectors that's both of them, since
+                #   which one (if any) is over us can change at any time
+                kinst, channel = keyProduct(ckey)
+                if kinst != inst:
+                    continue
+                if channel in channels:
                     # Construct the output filename to save it as
                     oname = ckey.split("_")[4][1:]
-                    oname = "%s/%s_C%02d.nc" % (outdir, oname, channel)
+                    oname = "%s/%s%s" % (outdir, oname,
+                                         rawSuffix(inst, channel))
 
                     # Just basename it so we can quickly check to see if
                     #   we already downloaded this file; if so, skip it.
                     boname = basename(oname)
                     if boname not in donelist:
-                        matches.append(objs)
-                        try:
-                            buck.download_file(objs.key, oname)
-                            print("Downloaded: %s" % (oname))
-                        except botocore.exceptions.ReadTimeoutError:
-                            print("DOWNLOAD FAILURE! ReadTimeoutError")
-                        except ConnectionError:
-                            print("DOWNLOAD FAILURE!")
-                            print("ConnectionError or subclass of it.")
+                        todo.append((objs['Key'], oname))
+                        keyprefix.update({objs['Key']: qt})
                     else:
                         print(oname, "already downloaded!")
                         if forceDown is True:
                             print("Download forced.")
-                            buck.download_file(objs.key, oname)
+                            todo.append((objs['Key'], oname))
+                            keyprefix.update({objs['Key']: qt})
 
         except botocore.exceptions.ClientError as e:
             if e.response['Error']['Code'] == "404":
@@ -161,4 +382,50 @@ def GOESAWSgrab(aws_keyid, aws_secretkey, now, outdir,
         except botocore.exceptions.EndpointConnectionError:
             print("QUERY FAILURE! EndpointConnectionError")
 
+    return todo, keyprefix, hourbins
+
+
+def GOESAWSgrab(aws_keyid, aws_secretkey, now, outdir,
+                timedelta=6, forceDown=False, nworkers=8, s3=None,
+                listcache=None, inst="ABI-L2-CMIPC", channels=(13,)):
+    """
+    AWS IAM user key
+    AWS IAM user secret key
+    Time query is relative to (usually datetime.datetime.utcnow)
+    Hours to query back from above
+
+    'nworkers' is the number of simultaneous downloads, and 's3' is an
+    optional already existing client (from getS3Client, or a stand-in
+    for testing) to use instead of making a new one.
+
+    'listcache' is an optional listCache.ListingCache that keeps track of
+    what we've already seen, so only new objects are listed; see
+    GOESAWSlist for the details.
+
+    Returns a list of per-object stats for everything that was downloaded.
+    """
+    if s3 is None:
+        s3 = getS3Client(aws_keyid, aws_secretkey, awszone=awszone,
+                         maxconns=nworkers)
+
+    todo, keyprefix, hourbins = GOESAWSlist(s3, now, outdir,
+                                            timedelta=timedelta,
+                                            forceDown=forceDown,
+                                            listcache=listcache,
+                                            inst=inst, channels=channels)
+
+    # ... and then actually go get it all at once
+    matches = downloadObjects(s3, awsbucket, todo, nworkers=nworkers)
+
+    if listcache is not None:
+        # Make sure anything that failed is tried again next time
+        for each in matches:
+            if each['ok'] is False:
+                listcache.retry(keyprefix[each['key']], each['key'])
+
+        # Forget about anything that's fallen out of our time window
+        listcache.prune(hourbins)
+        listcache.save()
+        print("%d listing queries made so far" % (listcache.nqueries))
+
     return matches
@@ -13,72 +13,30 @@
 
 from __future__ import division, print_function, absolute_import
 
+import io
 import os
-import time
-import glob
-import subprocess as subp
+import queue
+import calendar
+import threading
 import configparser as conf
-from shutil import copyfile
 from datetime import datetime as dt
+from datetime import timedelta as td
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-import imageio
-import imageio.core.util
 from ligmos.utils import logs
 
+import animator as anim
+import fileManifest as fman
+import listCache as lcache
+import pipeline as ppln
+import publisher as pub
 import goes16_aws as gaws
 import plotGOES as pgoes
-
-
-def movingPictures(inlist, outname, now, videoage=6., dtfmt="%Y%j%H%M%S%f"):
-    """
-    processing is determined by the file extension; it only knows about
-    'gif' and 'mp4' at present!
-
-    'videoage' is in hours
-    """
-    maxage = videoage * 60. * 60.
-    images = []
-    fnames = []
-    for filename in inlist:
-        diff = getFilenameAgeDiff(filename, now, dtfmt=dtfmt)
-        if diff < maxage:
-            images.append(imageio.imread(filename))
-            fnames.append(filename)
-
-    print("%d files found within %d h of now for the moving pictures" %
-          (len(images), videoage))
-
-    # Buffer the last few frames to make it not loop in an annoying way
-    images += [images[-1]]*13
-    fnames += [fnames[-1]]*13
-
-    if outname.lower().endswith("mp4"):
-        print("Starting MP4 creation...")
-        try:
-            # NEED this because imageio is a bit silly at the moment, and
-            #   macro_block_size will destroy our logger.  Once
-            #   https://github.com/imageio/imageio/issues/376 is closed
-            #   this can be revisited.
-            # As of 20181128, imageio FFMPEG is pretty useless for this.
-            # imageio.mimwrite(outname, images, quality=7)
-
-            # 0.1 sec frame time ==
-            vfopts = "fps=10,format=yuv420p,pad=ceil(iw/2)*2:ceil(ih/2)*2"
-            ffmpegcall = ["ffmpeg", "-y", "-pattern_type", "glob",
-                          "-i", os.path.dirname(fnames[0]) + "/*.png",
-                          "-c:v", "libx264",
-                          "-vf", vfopts,
-                          outname]
-            subp.check_call(ffmpegcall)
-            print("MP4 saved as %s" % (outname))
-        except subp.CalledProcessError as err:
-            print("FFMPEG failed!")
-            print(err.output)
-    elif outname.lower().endswith("gif"):
-        print("Starting GIF creation...")
-        imageio.mimwrite(outname, images, loop=0, duration=0.100,
-                         palettesize=256)
-        print("GIF saved as %s" % (outname))
+import rangeReader as rrange
+import siteSampler as ssamp
+import frameCube as fcube
+import composites as comps
 
 
 def parseConfFile(filename):
@@ -101,84 +59,163 @@ def parseConfFile(filename):
     return config
 
 
-def getFilenameAgeDiff(fname, now, dtfmt="%Y%j%H%M%S%f"):
+def parseProducts(filename):
     """
-    NOTE: HERE 'maxage' is already in seconds! Convert before calling.
+    Read the product definitions (see products.conf); returns a dict of
+    section name -> dict of its settings, for just the enabled ones
     """
-    # Need to basename it to get just the actual filename and not the path
-    beach = os.path.basename(fname)
     try:
-        dts = dt.strptime(beach.split("_")[0], dtfmt)
-        diff = (now - dts).total_seconds()
-    except Exception as err:
-        # TODO: Catch the right datetime conversion error!
+        config = conf.ConfigParser()
+        config.read_file(open(filename, 'r'))
+    except IOError as err:
         print(str(err))
-        # Make it "current" to not delete it
-        diff = 0
-
-    return diff
-
-
-def clearOldFiles(inloc, fmask, now, maxage=24., dtfmt="%Y%j%H%M%S%f"):
-    """
-    'maxage' is in hours
-    """
-    maxage *= 60. * 60.
-    flist = sorted(glob.glob(inloc + fmask))
-
-    remaining = []
-    for each in flist:
-        diff = getFilenameAgeDiff(each, now, dtfmt=dtfmt)
-        if diff > maxage:
-            print("Deleting %s since it's too old (%.3f hr)" %
-                  (each, diff/60./60.))
-            try:
-                os.remove(each)
-            except OSError as err:
-                # At least see what the issue was
-                print(str(err))
+        return {}
+
+    products = {}
+    for name in config.sections():
+        pconf = config[name]
+        if pconf.getboolean('enabled', fallback=True) is False:
+            print("Product %s is disabled; skipping it" % (name))
+            continue
+
+        # RGB composites are made from several channels of each scan
+        recipe = pconf.get('recipe', fallback=None)
+        if recipe is not None:
+            if recipe not in comps.recipes:
+                print("Product %s has unknown recipe %s; skipping it" %
+                      (name, recipe))
+                continue
+            channel = None
+            channels = comps.recipeBands(recipe)
+            mesoscale = False
         else:
-            remaining.append(each)
-
-    return remaining
-
-
-def main(outdir, creds, sleep=150., keephours=24., vidhours=4.,
-         forceDown=False, forceRegen=False):
+            channel = pconf.getint('channel')
+            channels = [channel]
+            mesoscale = pconf.getboolean('mesoscale', fallback=False)
+
+        prod = {'subdir': pconf.get('subdir', fallback=name),
+                'inst': pconf.get('inst', fallback="ABI-L2-CMIPC"),
+                'channel': channel,
+                'recipe': recipe,
+                'channels': channels,
+                'mesoscale': mesoscale,
+                'cmap': pconf.get('cmap', fallback='goesir'),
+                'vmin': pconf.getfloat('vmin', fallback=160.),
+                'vmax': pconf.getfloat('vmax', fallback=330.),
+                'slotfmt': pconf.get('slotfmt',
+                                     fallback=name + "_latest_%03d.png"),
+                'latestname': pconf.get('latestname',
+                                        fallback=name + "_latest.png"),
+                'gifname': pconf.get('gifname',
+                                     fallback=name + "_latest.gif"),
+                'jsonname': pconf.get('jsonname',
+                                      fallback=name + "_latest.json")}
+        products.update({name: prod})
+
+    print("Making the following products: %s" % (' '.join(products)))
+
+    return products
+
+
+def main(outdir, creds, productconf="./products.conf", sleep=30.,
+         keephours=24., vidhours=4., forceDown=False, forceRegen=False,
+         nworkers=1, ndownloads=4, keepRaws=True, fetcher='memory',
+         maxLatency=300., dbconf=None, sampleRadii=(5., 25.),
+         keepCube=True):
     """
     'outdir' is the *base* directory for outputs, stuff will be put into
     subdirectories inside of it.
 
+    'productconf' defines the products (channel, colormap, etc.) to make;
+    see products.conf.  Each one gets its own subdirectory of plots and
+    published frames/animation.  Everything
+    else is shared between them: each hour of the bucket is listed once
+    for all of them, each file is downloaded once no matter how many
+    products are made from it, and the projection and map layer caches
+    are keyed on the grids rather than the product so they're only made
+    once per grid.
+
+    Products with a 'recipe' are RGB composites (see composites.py) of
+    several channels of the same scan rather than one colormapped
+    channel.  Their bands are downloaded once like everything else, and
+    held onto until the rest of that scan's bands come through.  The
+    bands are matched up by when the scan started, since their end
+    times (and so their raw filenames) aren't always the same.
+
+    'sleep' is the time (seconds) between looks at the bucket for new
+    files; everything else happens as soon as there's something to do.
+
     'keephours' is the number of hours of data to keep on hand. Old stuff
     is deleted to keep things managable
 
+    'nworkers' is the number of processes to use for making the plots,
+    and 'ndownloads' the number of simultaneous downloads
+
+    New files are downloaded straight into memory and plotted from there;
+    'keepRaws' also writes them to disk (off to the side, so it doesn't
+    hold anything up) which is needed to ever plot them again.
+
+    'fetcher' is either 'memory', which does the above, or 'ranged' which
+    doesn't download anything up front and instead has the render workers
+    read just the parts of each file that they need right from S3 (see
+    rangeReader.py).  There's nothing to write to disk in that case, so
+    'keepRaws' doesn't do anything.
+
+    Products with 'mesoscale' set also use the 1-minute mesoscale sector
+    imagery, but only when one of the two sectors covers our whole map;
+    that's checked for every file from its projection info, since the
+    sectors get moved around to follow the weather.  Those frames just
+    go in along with the CONUS ones, so the product switches over to
+    1-minute frames whenever a sector is over us and back when it's not.
+
+    'maxLatency' is how long (seconds) a frame can take from when the data
+    were taken to when it's published; if it's consistently longer than
+    that the pipeline has fallen behind real time and says so (see
+    pipeline.LatencyMonitor).
+
+    If 'dbconf' is given, it's the configuration file for the influx
+    database that the stats of each frame around each of our sites (within
+    'sampleRadii' km) are written to; see siteSampler.py.
+
+    'keepCube' also keeps the reprojected data of the last 'keephours' of
+    frames of each product in outputs/cubes/<name>/ (see frameCube.py), so
+    it can be re-rendered or analyzed without the raw files.  Products
+    with 'mesoscale' set get room for 1-minute frames, so theirs is ~5x
+    bigger (~1.3 MB per frame on our grid).
+
     'vidhours' is the number of hours of data to make into a GIF (or MP4).
     6 hours equates to about 72 images in the video
 
-    Tailored for a single channel/band of output ONLY. To have multiple bands
-    outputting to a single directory this NEEDS some restructuring!!!
+    Runs as a pipeline (see pipeline.py) of list -> download -> render ->
+    publish stages until it gets a SIGTERM or SIGINT.
     """
     aws_keyid = creds['s3_RO']['aws_access_key_id']
     aws_secretkey = creds['s3_RO']['aws_secret_access_key']
 
     dout = outdir + "/raws/"
-    pout = outdir + "/pngs/"
-    lout = outdir + "/nows/"
+    cout = outdir + "/cache/"
     cfiles = "./shapefiles/cb_2018_us_county_5m/"
 
+    products = parseProducts(productconf)
+    if products == {}:
+        print("No products to make!")
+        return
+
     # in degrees; for spatially filtering map shapefiles
     mapcenter = [-111.4223, 34.7443]
     filterRadius = 7.
 
-    # Filename to copy the last/latest image into for easier web integration
-    #   Ok to just hardcopy these since they'll be staticly named
-    latestname = '%s/g16aws_latest.png' % (lout)
-    vid1 = "%s/g16aws_latest.gif" % (lout)
-    vid2 = "%s/g16aws_latest.mp4" % (lout)
-
     # Need this for parsing the filename into a dt obj
     dtfmt = "%Y%j%H%M%S%f"
 
+    # Number of frames to publish under static names
+    nstaticfiles = 48
+
+    # NOTE: I'm literally adding a 'fudge' factor here because the initial
+    #   AWS/data query has a resolution of 1 hour, so there can sometimes
+    #   be fighting of downloading/deleting/redownloading/deleting ...
+    fudge = 1.
+
     # Prepare some things for plotting so we don't have to do it
     #   forever in the main loop body
     rclasses = ["Interstate", "Federal"]
@@ -190,7 +227,8 @@ def main(outdir, creds, sleep=150., keephours=24., vidhours=4.,
 
     # roads will be a dict with keys of rclasses and values of geometries
     roads = pgoes.parseRoads(rclasses,
-                             center=mapcenter, centerRad=filterRadius)
+                             center=mapcenter, centerRad=filterRadius,
+                             cachedir=cout)
     for rkey in rclasses:
         print("%s: %d found within %d degrees of center" % (rkey,
                                                             len(roads[rkey]),
@@ -198,99 +236,582 @@ def main(outdir, creds, sleep=150., keephours=24., vidhours=4.,
 
     print("Parsing county data...")
     counties = pgoes.parseCounties(cfiles + "cb_2018_us_county_5m.shp",
-                                   center=mapcenter, centerRad=filterRadius)
+                                   center=mapcenter, centerRad=filterRadius,
+                                   cachedir=cout)
     print("%d counties found within %d degrees of center" % (len(counties),
                                                              filterRadius))
 
-    # Construct/grab the color map.
-    #   Purposefully leaving this hardcoded here for now, because it's
-    #   so easy to make a god damn mess of the colormap if you don't know
-    #   what you're doing.
-    vmin, vmax = 160, 330
-    gcmap = pgoes.getCmap(vmin=vmin, vmax=vmax)
+    # Where the numbers go, if anywhere
+    database, dbtable = None, None
+    if dbconf is not None:
+        database, dbtable = ssamp.connectDatabase(dbconf)
+    if database is None:
+        sampleRadii = None
+
+    # Everything that's kept separately for each product
+    setups, manifests, framebufs, louts, cubes = {}, {}, {}, {}, {}
+
+    # The raws of every band of each composite, so they're all expired
+    #   (the first band's are in its main manifest)
+    bandManifests = {}
+
+    # Which products come from each (instrument, channel), and which
+    #   channels we need from each instrument
+    byChannel = {}
+    wanted = {}
+
+    for name, prod in products.items():
+        pout = "%s/pngs/%s/" % (outdir, prod['subdir'])
+        lout = "%s/nows/%s/" % (outdir, prod['subdir'])
+        os.makedirs(pout, exist_ok=True)
+        os.makedirs(lout, exist_ok=True)
+        louts.update({name: lout})
+
+        # Keeps track of the raw files and their plots so we don't have to
+        #   keep looking through the directories to figure it out.  The
+        #   raw files are shared, so each only looks at its own channel
+        #   (and the mesoscale sectors too, if it wants them)
+        mname = "%smanifest_goes_%s.sqlite" % (cout, name)
+
+        # Decoded frames for the GIF/MP4, kept around so only the new ones
+        #   ever need to be read in
+        framebufs.update({name: anim.FrameBuffer(dtfmt=dtfmt)})
+
+        if prod['recipe'] is not None:
+            # Frames are filed under the first of their bands; nothing's
+            #   colormapped so there's no cube either
+            setups.update({name: pgoes.compositeSetup(prod['recipe'],
+                                                      roads=roads,
+                                                      counties=counties,
+                                                      cachedir=cout)})
+            rawext = gaws.rawSuffix(prod['inst'], prod['channels'][0])
+            manifests.update({name: fman.FileManifest(mname, dout, pout,
+                                                      dtfmt=dtfmt,
+                                                      rawext=rawext)})
+            bands = {prod['channels'][0]: manifests[name]}
+            for channel in prod['channels'][1:]:
+                bname = "%smanifest_goes_%s_C%02d.sqlite" % (cout, name,
+                                                             channel)
+                rawext = gaws.rawSuffix(prod['inst'], channel)
+                bands.update({channel: fman.FileManifest(bname, dout, pout,
+                                                         dtfmt=dtfmt,
+                                                         rawext=rawext)})
+            bandManifests.update({name: bands})
+
+            for channel in prod['channels']:
+                byChannel.setdefault((prod['inst'], channel),
+                                     []).append(name)
+                wanted.setdefault(prod['inst'], set()).add(channel)
+            continue
+
+        # Construct/grab the color map.  See getCmap before changing the
+        #   'goesir' one; it's easy to make a god damn mess of it if you
+        #   don't know what you're doing.
+        vmin, vmax = prod['vmin'], prod['vmax']
+        gcmap = pgoes.getProductCmap(prod['cmap'], vmin=vmin, vmax=vmax)
+
+        # The reprojected data, for anything that wants more than the PNG
+        cubeCoding = None
+        if keepCube is True:
+            offset, scale = fcube.cubeCoding(vmin, vmax)
+            perhour = 60 if prod['mesoscale'] is True else 12
+            cube = fcube.FrameCube("%s/cubes/%s/" % (outdir, name),
+                                   nslots=int(round(keephours*perhour)),
+                                   offset=offset, scale=scale)
+            cubes.update({name: cube})
+            cubeCoding = (offset, scale)
+
+        # Everything the render processes need; the projection coordinates
+        #   and static map layers are cached in 'cout' so they're reused
+        setups.update({name: pgoes.renderSetup(roads=roads,
+                                               counties=counties,
+                                               cmap=gcmap,
+                                               irange=[vmin, vmax],
+                                               cachedir=cout,
+                                               renderer='lut',
+                                               sampleRadii=sampleRadii,
+                                               cubeCoding=cubeCoding)})
+
+        rawext = gaws.rawSuffix(prod['inst'], prod['channel'])
+        if prod['mesoscale'] is True:
+            rawext = "C%02d.nc" % (prod['channel'])
+        manifests.update({name: fman.FileManifest(mname, dout, pout,
+                                                  dtfmt=dtfmt,
+                                                  rawext=rawext)})
+
+        insts = [prod['inst']]
+        if prod['mesoscale'] is True:
+            insts.append(gaws.mesoinst)
+        for inst in insts:
+            byChannel.setdefault((inst, prod['channel']), []).append(name)
+            wanted.setdefault(inst, set()).add(prod['channel'])
+
+    # Keeps track of what we've already seen in the bucket, so we only
+    #   ever list the new stuff
+    listcache = lcache.ListingCache(cout + "listing_goes.json")
+
+    s3 = gaws.getS3Client(aws_keyid, aws_secretkey, maxconns=ndownloads)
+
+    # Failed downloads are handed back to the listing thread this way,
+    #   since it's the only one that touches the listing cache
+    retries = queue.Queue()
+
+    # How long everything takes to get through, from listing to publishing
+    monitor = ppln.LatencyMonitor(maxLatency=maxLatency)
+
+    def listNew():
+        """
+        Source: what's new in the bucket, as (key, filename, prefix)
+        """
+        while True:
+            try:
+                prefix, key = retries.get_nowait()
+            except queue.Empty:
+                break
+            listcache.retry(prefix, key)
+
+        items = []
+        allbins = []
+        for inst, channels in wanted.items():
+            todo, keyprefix, hourbins = gaws.GOESAWSlist(s3, dt.utcnow(),
+                                                         dout,
+                                                         timedelta=keephours,
+                                                         forceDown=forceDown,
+                                                         listcache=listcache,
+                                                         inst=inst,
+                                                         channels=channels)
+            items += [(key, oname, keyprefix[key]) for key, oname in todo]
+            allbins += hourbins
+
+        for _, oname, _ in items:
+            monitor.seen(os.path.basename(oname))
+
+        # Forget about anything that's fallen out of our time window
+        listcache.prune(allbins)
+        listcache.save()
+
+        return items
+
+    def retryLater(item):
+        retries.put((item[2], item[0]))
+
+    def retryRender(item):
+        """
+        Hand back the listing item(s) of a render item that never got
+        rendered; if its raws were only ever in memory (or never fetched
+        at all) that's the only way it'll be done
+        """
+        sources = item[5]
+        if not isinstance(sources, list):
+            sources = [sources]
+        for each in sources:
+            if each is not None:
+                retryLater(each)
+
+    # Ranged reads only happen once a frame is rendering, so that's where
+    #   their network trouble shows up; each (product, key) gets a few
+    #   goes before it's given up on, in case it's the file that's bad
+    rangedTries = {}
+    maxRangedTries = 3
+
+    # Raw files are written out by their own thread, off to the side.
+    #   Only so many can be waiting (same as the pipeline's queues), so
+    #   if the disk can't keep up the downloads wait for it rather than
+    #   piling up in memory
+    archiver = ThreadPoolExecutor(max_workers=1)
+    archiving = threading.BoundedSemaphore(2*nworkers)
+
+    def archive(data, oname):
+        try:
+            gaws.writeRaw(data, oname)
+        except OSError as err:
+            print(str(err))
+            print("WHOOPSIE! WRITE OF %s FAILED" % (oname))
+        finally:
+            archiving.release()
+
+    def archiveLater(data, oname):
+        archiving.acquire()
+        archiver.submit(archive, data, oname)
+
+    def sectorCovers(key, data):
+        """
+        True if the (mesoscale) sector of 'key' covers our map; only its
+        projection info is read, from 'data' if we have it already
+        """
+        if data is not None:
+            fobj = io.BytesIO(data)
+        else:
+            fobj = rrange.openS3(s3, gaws.awsbucket, key)
 
-    print("Starting infinite loop...")
-    while True:
-        # 'keephours' is time (in hours!) to search for new files relative
-        #   to the present.
-        #   If they exist, they'll be skipped unless forceDown is True
-        when = dt.utcnow()
-        print("Looking for files!")
-        ffiles = gaws.GOESAWSgrab(aws_keyid, aws_secretkey, when, dout,
-                                  timedelta=keephours, forceDown=forceDown)
-
-        print("Found the following files:")
-        for f in ffiles:
-            print(os.path.basename(f.key))
-
-        print("Making the plots...")
-        # TODO: Return the projection coordinates (and a timestamp of them)
-        #   so they can be reused between loop cycles.
-        nplots = pgoes.makePlots(dout, pout, cmap=gcmap,
-                                 roads=roads, counties=counties,
-                                 forceRegen=forceRegen, irange=[vmin, vmax])
-        print("%03d plots done!" % (nplots))
-
-        # ... Do what the function says! Return a list of current files
-        #   which will then be used as the input for the GIF/video
-        #
-        # NOTE: I'm literally adding a 'fudge' factor here because the initial
-        #   AWS/data query has a resolution of 1 hour, so there can sometimes
-        #   be fighting of downloading/deleting/redownloading/deleting ...
-        fudge = 1.
-        # BUT only do anything if we actually made a new file!
-        if nplots > 0:
-            cpng = clearOldFiles(pout, "*.png", when,
-                                 maxage=keephours+fudge, dtfmt=dtfmt)
-            craw = clearOldFiles(dout, "*.nc", when,
-                                 maxage=keephours+fudge, dtfmt=dtfmt)
-
-            print("%d, %d raw and png files remain within %.1f + %.1f hours" %
-                  (len(cpng), len(craw), keephours, fudge))
-
-            print("Copying the latest/last files to an accessible spot...")
-            # Since they're good filenames we can just sort and take the last
-            #   if there are actually any current ones left of course
-            nstaticfiles = 48
-            if cpng != []:
-                if len(cpng) < nstaticfiles:
-                    lindex = len(cpng)
-                else:
-                    lindex = nstaticfiles
-
-                # It's easier to do this via reverse list indicies
-                icount = 0
-                for findex in range(-1*lindex, 0, 1):
-                    try:
-                        lname = "%s/goes_latest_%03d.png" % (lout, icount)
-                        icount += 1
-                        copyfile(cpng[findex], lname)
-                    except Exception as err:
-                        # TODO: Figure out the proper/specific exception
-                        print(str(err))
-                        print("WHOOPSIE! COPY FAILED")
-
-                # Put the very last file in the last file slot
-                latest = cpng[-1]
-                try:
-                    copyfile(latest, latestname)
-                    print("Latest file copy done!")
-                except Exception as err:
-                    # TODO: Figure out the proper/specific exception to catch
-                    print(str(err))
-                    print("WHOOPSIE! COPY FAILED")
-
-            # Make the movies!
-            print("Making movies...")
-            movingPictures(cpng, vid1, when, videoage=vidhours, dtfmt=dtfmt)
-
-            # 20181210 RTH: Disabling the MP4 output for now because I hates it
-            # movingPictures(cpng, vid2, when, videoage=vidhours, dtfmt=dtfmt)
+        try:
+            dat = rrange.H5Dataset(fobj)
+            try:
+                covers = pgoes.sectorCovers(dat, mapcenter[1], mapcenter[0])
+            finally:
+                dat.close()
+        except (OSError, KeyError, ValueError) as err:
+            print(str(err))
+            print("Couldn't tell where %s is; skipping it" % (key))
+            covers = False
+
+        return covers
+
+    # Bands of each scan for the RGB composites, until they've all shown
+    #   up; keyed by (product, scan start).  Only so many unfinished scans
+    #   are kept for each, in case one of their bands never makes it
+    scans = {}
+    scanLock = threading.Lock()
+    maxScans = 12
+
+    # Raws of the scans that were given up on, as (channel, filename) for
+    #   each product, so they still get expired
+    strays = {}
+
+    def collectBand(name, channel, oname, data, remote, item):
+        """
+        Hang on to one band of a scan for the composite product 'name';
+        returns the render item for the scan once all of its bands are
+        in, or None until then
+        """
+        channels = products[name]['channels']
+        scan = gaws.keyScanStart(item[0])
+        with scanLock:
+            got = scans.setdefault((name, scan), {})
+            got.update({channel: (oname, data, remote, item)})
+            if len(got) < len(channels):
+                waiting = sorted(each for each in scans if each[0] == name)
+                for old in waiting[:-maxScans]:
+                    print("%s: gave up waiting for all of scan %s" % old)
+                    strays.setdefault(name, []).extend(
+                        (each, part[0]) for each, part in scans[old].items())
+                    del scans[old]
+                return None
+            del scans[(name, scan)]
+
+        parts = [got[each] for each in channels]
+        onames = [each[0] for each in parts]
+        remotes = None
+        if parts[0][2] is not None:
+            remotes = [each[2] for each in parts]
+
+        return (name, onames, manifests[name].pngPath(onames[0]),
+                [each[1] for each in parts], remotes,
+                [each[3] for each in parts])
+
+    def download(item):
+        """
+        Stage: (key, filename, prefix) -> [(product, raw filename, png
+        filename, contents of the raw file, (bucket, key) for a ranged
+        read, the listing item)] for each product that's made from it.
+        The composites get lists of each of those (but the product and png
+        filename) once the last of their bands comes through.
+        """
+        key, oname, prefix = item
+        pkey = gaws.keyProduct(key)
+        names = byChannel.get(pkey, [])
+
+        if fetcher == 'ranged':
+            # Nothing to do here; the render worker reads what it needs
+            data = None
+            remote = (gaws.awsbucket, key)
         else:
-            print("No new files downloaded so skipping all actions.")
+            stats = gaws.fetchBytes(s3, gaws.awsbucket, key)
+            if stats['ok'] is False:
+                retryLater(item)
+                return None
+
+            print("%s  %.2f MB in %.2f s" % (os.path.basename(key),
+                                             stats['bytes']/1e6,
+                                             stats['seconds']))
+
+            data = stats['data']
+            remote = None
+
+        if pkey[0] == gaws.mesoinst and not sectorCovers(key, data):
+            print("%s isn't over us; skipping it" % (os.path.basename(key)))
+            return None
+
+        if keepRaws is True and data is not None:
+            archiveLater(data, oname)
+
+        out = []
+        for name in names:
+            if products[name]['recipe'] is None:
+                out.append((name, oname, manifests[name].pngPath(oname),
+                            data, remote, item))
+            else:
+                scan = collectBand(name, pkey[1], oname, data, remote, item)
+                if scan is not None:
+                    out.append(scan)
+
+        return out
+
+    # The workers each get the setups once, rather than with every frame
+    pool = ProcessPoolExecutor(max_workers=nworkers,
+                               initializer=pgoes.initRenderWorker,
+                               initargs=(setups,))
+
+    def render(item):
+        """
+        Stage: (product, raw filename, png filename, contents, remote,
+        listing item) -> render results dict; see download for the
+        composites
+        """
+        name, raw, png, data, remote, source = item
+
+        # Composites are filed under the first of their bands
+        if isinstance(raw, list):
+            first, sources = raw[0], source
+        else:
+            first, sources = raw, [source]
+
+        try:
+            res = pool.submit(pgoes.renderProductWorker, name, raw, png,
+                              memory=data, remote=remote).result()
+        except BrokenProcessPool as err:
+            res = {'input': first, 'output': png, 'ok': False,
+                   'error': str(err), 'seconds': 0.}
+        res['product'] = name
+        if isinstance(raw, list):
+            res['inputs'] = raw
+
+        # Nothing was fetched ahead of time, so nothing else will ever
+        #   try it again; it has to be listed again instead
+        if remote is not None and sources is not None:
+            tkey = (name, first)
+            if res['ok'] is True:
+                rangedTries.pop(tkey, None)
+            else:
+                ntries = rangedTries.get(tkey, 0) + 1
+                if ntries < maxRangedTries:
+                    rangedTries.update({tkey: ntries})
+                    for each in sources:
+                        retryLater(each)
+                else:
+                    print("Giving up on %s after %d tries" % (first,
+                                                               ntries))
+                    rangedTries.pop(tkey, None)
+
+        return res
+
+    def expireBands(name, results, when):
+        """
+        Record the raws of every band of the composite 'name' (including
+        any from scans that were given up on) and expire the old ones
+        """
+        bands = bandManifests[name]
+        channels = products[name]['channels']
+
+        byBand = {}
+        for res in results:
+            for channel, raw in zip(channels, res.get('inputs', [])):
+                byBand.setdefault(channel, []).append(raw)
+        with scanLock:
+            for channel, raw in strays.pop(name, []):
+                byBand.setdefault(channel, []).append(raw)
+
+        for channel, bmanifest in bands.items():
+            bmanifest.addRaws(byBand.get(channel, []))
+            if bmanifest is not manifests[name]:
+                bmanifest.expire(when, maxage=keephours+fudge)
+
+    def publishProduct(name, results, when):
+        """
+        Record how the frames of product 'name' went, then update its
+        part of the web side
+        """
+        prod = products[name]
+        manifest = manifests[name]
+        lout = louts[name]
+
+        ngood = 0
+        manifest.addRaws([res['input'] for res in results])
+        for res in results:
+            manifest.markRendered(res['input'], ok=res['ok'])
+            if res['ok'] is True:
+                ngood += 1
+            else:
+                print("FAILED to render %s: %s" % (res['input'],
+                                                   res['error']))
+        print("%s: %03d plots done!" % (name, ngood))
+
+        # The numbers go out first since they're the quickest to get to
+        #   anyone that's waiting on them; one write per frame
+        for res in results:
+            if res.get('samples') is not None:
+                ts = dt.strptime(manifest.parseTimestamp(res['input']),
+                                 fman.isofmt)
+                packets = ssamp.makePackets(res['samples'],
+                                            "goes16_%s" % (name), ts,
+                                            tags={'channel': "%02d" %
+                                                  (prod['channel'])})
+                ssamp.writePackets(database, dbtable, packets)
+
+        # Only this thread ever writes to the cubes; oldest first, so if
+        #   it's full it's the old ones that get replaced
+        if name in cubes:
+            cube = cubes[name]
+            for res in sorted(results, key=lambda x: x.get('tend') or dt.min):
+                if res.get('codes') is not None:
+                    cube.putCodes(res['tend'], res['codes'],
+                                  info=res['cubeinfo'])
+            cube.expire(when - td(hours=keephours+fudge))
+
+        # Only do anything if we actually made a new file!
+        if ngood == 0:
+            return
+
+        manifest.expire(when, maxage=keephours+fudge)
+        if name in bandManifests:
+            expireBands(name, results, when)
+        nraw, npng = manifest.counts()
+        print("%s: %d, %d raw and png files remain within %.1f + %.1f hours"
+              % (name, nraw, npng, keephours, fudge))
+
+        # Only the static names whose frame changed get swapped in, and
+        #   the JSON listing tells the web side what's what
+        print("Publishing the latest/last files to an accessible spot...")
+        pub.publishLatest(manifest.rendered(latest=nstaticfiles,
+                                            withts=True),
+                          lout, slotfmt=prod['slotfmt'],
+                          latestname=prod['latestname'],
+                          jsonname=prod['jsonname'],
+                          nstaticfiles=nstaticfiles)
+
+        # Timestamps in the filenames are the end of the scan
+        for res in results:
+            if res['ok'] is True:
+                ts = manifest.parseTimestamp(res['input'])
+                tobs = calendar.timegm(dt.strptime(ts,
+                                                   fman.isofmt).timetuple())
+                monitor.done(name, os.path.basename(res['input']), tobs)
+
+        # Make the movies!
+        print("Making movies...")
+        framebufs[name].update(manifest.rendered(), when, maxage=vidhours)
+        framebufs[name].writeGIF("%s/%s" % (lout, prod['gifname']))
+
+        # 20181210 RTH: Disabling the MP4 output for now because I hates it
+        # framebufs[name].writeMP4(...)
+
+    def publish(results):
+        """
+        Stage: publish each of the products that got new frames
+        """
+        when = dt.utcnow()
 
-        print("Sleeping for %03d seconds..." % (sleep))
-        time.sleep(sleep)
+        byProduct = {}
+        for res in results:
+            byProduct.setdefault(res['product'], []).append(res)
+
+        for name, presults in byProduct.items():
+            publishProduct(name, presults, when)
+
+        # How close we are to not keeping up with the mesoscale sectors
+        secs = [res['seconds'] for res in results if res['ok'] is True]
+        if secs != []:
+            mean = sum(secs)/len(secs)
+            print("Rendering takes %.2f s/frame; %d workers can do %.0f"
+                  " frames/minute" % (mean, nworkers,
+                                      60.*nworkers/max(mean, 1e-3)))
+        monitor.report()
+
+        return None
+
+    pipe = ppln.Pipeline(maxqueue=2*nworkers)
+    pipe.add(ppln.Source("list", listNew, interval=sleep,
+                         onDiscard=retryLater))
+    pipe.add(ppln.Stage("download", download, nthreads=ndownloads,
+                        onDiscard=retryLater, fanout=True))
+    pipe.add(ppln.Stage("render", render, nthreads=nworkers,
+                        onDiscard=retryRender))
+    pipe.add(ppln.Stage("publish", publish, batch=nstaticfiles,
+                        drain=True))
+
+    def rawScanStart(fname):
+        """
+        When the scan of raw file 'fname' started, or None if it can't
+        be read
+        """
+        try:
+            start = pgoes.scanStart(fname)
+        except (OSError, AttributeError, ValueError) as err:
+            print("Couldn't tell when %s was from: %s" % (fname, str(err)))
+            start = None
+
+        return start
+
+    # Anything that was downloaded but never plotted (like if we were
+    #   stopped part way through last time)
+    backlog = []
+    for name, manifest in manifests.items():
+        pending = manifest.pending(everything=forceRegen)
+        prod = products[name]
+        if prod['recipe'] is not None:
+            # Only the scans that have all of their bands on disk can be
+            #   redone; the neighbour info is made as the bands come in.
+            #   Like when they're downloaded, the bands are matched up by
+            #   the start of their scan, which is in each file
+            if pending != []:
+                bands = {}
+                for channel in prod['channels'][1:]:
+                    suffix = gaws.rawSuffix(prod['inst'], channel)
+                    for each in os.listdir(dout):
+                        if each.endswith(suffix):
+                            start = rawScanStart(dout + each)
+                            bands.update({(start, channel): dout + each})
+
+            for raw, png in pending:
+                start = rawScanStart(raw)
+                infiles = [raw] + [bands.get((start, each))
+                                   for each in prod['channels'][1:]]
+                if start is not None and None not in infiles:
+                    backlog.append((name, infiles, png, None, None, None))
+            continue
+
+        if pending != []:
+            # Do the (possibly) expensive projection stuff once, up front,
+            #   so the workers can all just load it from the cache instead
+            #   of all calculating it at the same time.  It's per grid, so
+            #   after the first product it's usually already there.  If the
+            #   file is bad the workers will just calculate it themselves
+            try:
+                pgoes.primeCache(pending[0][0], setups[name]['cLat'],
+                                 setups[name]['cLon'], cachedir=cout,
+                                 roads=roads, counties=counties,
+                                 renderer=setups[name]['renderer'])
+            except (OSError, KeyError) as err:
+                print("%s: couldn't prime the cache from %s: %s" %
+                      (name, pending[0][0], str(err)))
+        backlog += [(name, raw, png, None, None, None)
+                    for raw, png in pending]
+
+    print("Starting the pipeline...")
+    pipe.handleSignals()
+    pipe.start()
+    print("Feeding %d leftover frames..." % (len(backlog)))
+    pipe.feed("render", backlog)
+
+    # Now it's all up to the threads until we're told to stop
+    pipe.wait()
+    pool.shutdown()
+    archiver.shutdown()
+
+    # Bands of the composites that were still waiting on the rest of
+    #   their scan
+    for got in scans.values():
+        for each in got.values():
+            retryLater(each[3])
+
+    # Whatever wasn't downloaded will be listed again next time
+    while True:
+        try:
+            prefix, key = retries.get_nowait()
+        except queue.Empty:
+            break
+        listcache.retry(prefix, key)
+    listcache.save()
 
 
 if __name__ == "__main__":
@@ -298,6 +819,7 @@ if __name__ == "__main__":
     awsconf = "./awsCreds.conf"
     forceDownloads = False
     forceRegenPlot = False
+    nworkers = 4
     logname = './logs/goesmcgoesface.log'
 
     # Set up logging (using ligmos' quick 'n easy wrapper)
@@ -305,5 +827,6 @@ if __name__ == "__main__":
 
     creds = parseConfFile(awsconf)
 
-    main(outdir, creds, forceDown=forceDownloads, forceRegen=forceRegenPlot)
+    main(outdir, creds, forceDown=forceDownloads, forceRegen=forceRegenPlot,
+         nworkers=nworkers)
     print("Exiting!")
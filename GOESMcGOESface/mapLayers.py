@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Prerendered map layers, so each frame only has to draw its data.
+
+Everything that doesn't change between frames (coastlines, borders, roads,
+counties, observatory markers, backgrounds) is rasterized once per
+projection/extent/figure size/dpi into a pair of RGBA arrays and cached on
+disk.  Each frame is then just the data raster and the title bar,
+alpha-composited between those two cached layers.
+
+NOTE: The layers are composited in the same order matplotlib would've
+drawn them in: backgrounds, then the data, then the cartopy features
+(zorder 1.5, so they're always above images & meshes) and markers, then the
+title bar on top of everything.
+
+With a ColorLUT and the Pillow based title bar/PNG writer below, a frame
+can be made without ever touching a matplotlib figure; matplotlib is only
+needed to render the static layers the very first time.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+import hashlib
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import matplotlib.pyplot as plt
+import matplotlib.patches as mpatches
+import matplotlib.font_manager as mfonts
+
+
+# In-memory copy of anything we've already rendered or loaded
+_layerCache = {}
+
+# Names of the arrays that make up a set of layers on disk
+layerNames = ['under', 'over', 'axpos']
+
+# Fonts for the Pillow title bar, keyed by pixel size
+_fontCache = {}
+
+
+class MapLayers():
+    """
+    Class to hold the static layers for a particular map setup
+    """
+    def __init__(self, under, over, axpos):
+        """
+        'under' and 'over' are (ny, nx, 4) uint8 RGBA arrays of what goes
+        below and above the data.  'axpos' is the [left, bottom, width,
+        height] of the map axes, in figure fraction.
+        """
+        self.under = under
+        self.over = over
+        self.axpos = tuple(float(each) for each in axpos)
+
+        self.shape = under.shape[0:2]
+        self.figsize = None
+        self.dpi = None
+
+    def axesSlices(self):
+        """
+        Return the (row, column) slices of the frame that the map axes
+        covers, for dropping the data raster into the right spot
+        """
+        ny, nx = self.shape
+        left, bottom, width, height = self.axpos
+
+        c0 = int(np.round(left*nx))
+        c1 = int(np.round((left + width)*nx))
+        # Image rows start at the top, figure fractions at the bottom
+        r0 = int(np.round((1. - bottom - height)*ny))
+        r1 = int(np.round((1. - bottom)*ny))
+
+        return slice(r0, r1), slice(c0, c1)
+
+
+def layerKey(crs, extent, figsize, dpi, tag=''):
+    """
+    Hash the things that determine what the static layers look like
+    into a short key that's suitable for use as a directory name.
+
+    'tag' is anything else the caller wants to distinguish on, like
+    which roads or counties were drawn.
+    """
+    ext = ",".join(["%.6f" % (each) for each in extent])
+    sig = "%s|%s|%.2fx%.2f|%d|%s" % (crs.proj4_init, ext,
+                                    figsize[0], figsize[1], dpi, tag)
+    key = hashlib.sha1(sig.encode("utf-8")).hexdigest()
+
+    return key
+
+
+def featureTag(roads=None, counties=None):
+    """
+    Short description of the roads/counties that are drawn, for use as
+    (part of) the 'tag' in layerKey so the layers get re-rendered if
+    they ever change
+    """
+    if roads is None:
+        rtag = "none"
+    else:
+        rtag = ",".join(["%s:%d" % (rtype, len(roads[rtype]))
+                         for rtype in sorted(roads)])
+
+    if counties is None:
+        ctag = "none"
+    else:
+        ctag = "%d" % (len(counties))
+
+    return "roads=%s|counties=%s" % (rtag, ctag)
+
+
+def grabRGBA(fig):
+    """
+    Draw the figure and return a copy of the result as a uint8 RGBA array
+    """
+    fig.canvas.draw()
+    rgba = np.array(fig.canvas.buffer_rgba(), dtype=np.uint8)
+
+    return rgba
+
+
+def makeMapAxes(crs, extent, figsize, dpi, extentcrs=None):
+    """
+    Make a figure with a map axes set up exactly like the one used to
+    make the full plots
+    """
+    if extentcrs is None:
+        extentcrs = crs
+
+    # Figure creation
+    fig = plt.figure(figsize=figsize, dpi=dpi)
+
+    # Needed to remove any whitespace/padding around the map
+    plt.subplots_adjust(left=0., right=1., top=1., bottom=0.)
+
+    # Tell matplotlib we're using a map projection so cartopy
+    #   takes over and overloades Axes() with GeoAxes()
+    ax = plt.axes(projection=crs)
+    ax.set_extent(extent, crs=extentcrs)
+
+    return fig, ax
+
+
+def renderStaticLayers(crs, extent, figsize, dpi=100, drawFunc=None,
+                       extentcrs=None, figcolor='white', bgcolor='#262629'):
+    """
+    Actually render the static layers for a map of the given projection,
+    extent, figure size and dpi.  'drawFunc' is called with the map
+    axes as its only argument, and should add all of the static features.
+
+    'figcolor' is the color of the figure outside of the map axes, and
+    'bgcolor' the map background color where there's no data.
+    """
+    # First the stuff that goes under the data
+    fig, ax = makeMapAxes(crs, extent, figsize, dpi, extentcrs=extentcrs)
+    fig.patch.set_facecolor(figcolor)
+    ax.background_patch.set_facecolor(bgcolor)
+    ax.outline_patch.set_visible(False)
+    under = grabRGBA(fig)
+
+    # The axes position is only right after it's been drawn, since that's
+    #   when cartopy fixes the aspect ratio
+    axpos = ax.get_position().bounds
+    plt.close(fig)
+
+    # Now the stuff that goes over the data, on a transparent background
+    fig, ax = makeMapAxes(crs, extent, figsize, dpi, extentcrs=extentcrs)
+    fig.patch.set_alpha(0.)
+    ax.background_patch.set_visible(False)
+    if drawFunc is not None:
+        drawFunc(ax)
+    over = grabRGBA(fig)
+    plt.close(fig)
+
+    return MapLayers(under, over, axpos)
+
+
+def saveLayers(cachedir, key, layers):
+    """
+    Store the layers in their own directory, named 'layers_key'
+    """
+    kdir = "%s/layers_%s/" % (cachedir, key)
+    os.makedirs(kdir, exist_ok=True)
+
+    for name in layerNames:
+        fname = "%s/%s.npy" % (kdir, name)
+        tname = "%s.%d.tmp" % (fname, os.getpid())
+        with open(tname, 'wb') as f:
+            np.save(f, np.asarray(getattr(layers, name)))
+        os.replace(tname, fname)
+
+    print("Map layers saved to %s" % (kdir))
+
+
+def loadLayers(cachedir, key):
+    """
+    Load the layers back in; returns None if any of them are missing
+    """
+    kdir = "%s/layers_%s/" % (cachedir, key)
+
+    arrs = []
+    for name in layerNames:
+        fname = "%s/%s.npy" % (kdir, name)
+        try:
+            arrs.append(np.load(fname))
+        except (OSError, ValueError) as err:
+            if os.path.exists(fname):
+                print(str(err))
+            return None
+
+    return MapLayers(*arrs)
+
+
+def getStaticLayers(crs, extent, figsize, dpi=100, drawFunc=None,
+                    extentcrs=None, figcolor='white', bgcolor='#262629',
+                    cachedir=None, tag=''):
+    """
+    Return the MapLayers for the given setup, checking in memory first,
+    then on disk (if 'cachedir' is given), and only rendering them
+    if they really can't be found.  See renderStaticLayers for the rest.
+    """
+    key = layerKey(crs, extent, figsize, dpi,
+                   tag="%s|%s|%s" % (tag, figcolor, bgcolor))
+
+    try:
+        return _layerCache[key]
+    except KeyError:
+        pass
+
+    layers = None
+    if cachedir is not None:
+        layers = loadLayers(cachedir, key)
+
+    if layers is None:
+        print("Rendering static map layers...")
+        layers = renderStaticLayers(crs, extent, figsize, dpi=dpi,
+                                    drawFunc=drawFunc, extentcrs=extentcrs,
+                                    figcolor=figcolor, bgcolor=bgcolor)
+        if cachedir is not None:
+            saveLayers(cachedir, key, layers)
+
+    layers.figsize = figsize
+    layers.dpi = dpi
+    _layerCache.update({key: layers})
+
+    return layers
+
+
+def renderTitleBar(layers, line1, line2):
+    """
+    Render just the black informational bar at the top of the map,
+    on an otherwise transparent frame the same size as the layers
+    """
+    fig = plt.figure(figsize=layers.figsize, dpi=layers.dpi)
+    fig.patch.set_alpha(0.)
+
+    # A plain axes in the same spot as the map axes is all that's needed
+    #   since everything is positioned in axes fractions
+    ax = fig.add_axes(layers.axpos)
+    ax.set_axis_off()
+
+    # Black background for top label text
+    #   NOTE: Z order is important! Text should be higher than trect
+    trect = mpatches.Rectangle((0.0, 0.955), width=1.0, height=0.045,
+                               edgecolor=None, facecolor='black',
+                               fill=True, alpha=1.0, zorder=100,
+                               transform=ax.transAxes)
+    ax.add_patch(trect)
+
+    # Line 1
+    ax.annotate(line1, (0.5, 0.985), xycoords='axes fraction',
+                fontfamily='monospace',
+                horizontalalignment='center',
+                verticalalignment='center',
+                color='white', fontweight='bold', zorder=200)
+    # Line 2
+    ax.annotate(line2, (0.5, 0.965), xycoords='axes fraction',
+                fontfamily='monospace',
+                horizontalalignment='center',
+                verticalalignment='center',
+                color='white', fontweight='bold', zorder=200)
+
+    title = grabRGBA(fig)
+    plt.close(fig)
+
+    return title
+
+
+class ColorLUT():
+    """
+    Class to hold a matplotlib colormap + normalization baked down into a
+    plain uint8 RGBA lookup table, so colorizing a frame is just one
+    vectorized index instead of a trip through matplotlib.
+
+    The table is laid out as [under, colors..., over, bad].
+    """
+    def __init__(self, cmap, vmin=None, vmax=None, norm=None):
+        """
+        Give either 'vmin' and 'vmax' (for a linear normalization) or
+        'norm'; a BoundaryNorm (like from from_levels_and_colors) keeps its
+        exact level boundaries, so values right on the edges are binned
+        exactly the same way matplotlib would.
+        """
+        if norm is None:
+            norm = plt.Normalize(vmin=vmin, vmax=vmax)
+
+        boundaries = getattr(norm, 'boundaries', None)
+        if boundaries is not None:
+            self.boundaries = np.asarray(boundaries, dtype=np.float64)
+            self.vmin = self.boundaries[0]
+            self.vmax = self.boundaries[-1]
+
+            # One color per level, using the middle of each level
+            centers = 0.5*(self.boundaries[1:] + self.boundaries[:-1])
+            colors = cmap(norm(centers), bytes=True)
+        else:
+            self.boundaries = None
+            self.vmin = norm.vmin
+            self.vmax = norm.vmax
+
+            # Exactly the colors that are in the map itself, so there's
+            #   no additional quantization
+            colors = cmap((np.arange(cmap.N) + 0.5)/cmap.N, bytes=True)
+
+        under, over = cmap(np.array([-1., 2.]), bytes=True)
+        bad = cmap(np.ma.masked_all((1,)), bytes=True)[0]
+
+        self.ncolors = len(colors)
+        self.lut = np.vstack([under[None, :], colors,
+                              over[None, :], bad[None, :]]).astype(np.uint8)
+
+        # Same thing, but one uint32 per color so lookups move whole pixels
+        self.lut32 = self.lut.view(np.uint32)[:, 0]
+
+    def index(self, data):
+        """
+        Return the LUT indices for the (masked) data array; masked or
+        non-finite values get the 'bad' entry
+        """
+        vals = np.ma.getdata(data)
+        bad = np.ma.getmaskarray(data) | ~np.isfinite(vals)
+
+        if self.boundaries is not None:
+            # Below the first boundary is 0 (under), at or above the
+            #   last one is ncolors + 1 (over)
+            idx = np.searchsorted(self.boundaries, vals, side='right')
+        else:
+            scl = (vals - self.vmin)*(self.ncolors/(self.vmax - self.vmin))
+            idx = np.floor(scl)
+            # vmax itself is the last color, not over
+            idx[scl == self.ncolors] = self.ncolors - 1
+            idx = np.clip(idx + 1, 0, self.ncolors + 1)
+
+        idx = np.where(bad, self.ncolors + 2, idx).astype(np.uint16)
+
+        return idx
+
+    def apply(self, data):
+        """
+        Colorize the data array into a (ny, nx, 4) uint8 RGBA array
+        """
+        return self.lookup(self.index(data))
+
+    def lookup(self, idx):
+        """
+        Colorize an array of LUT indices (from index()) into RGBA
+        """
+        pix = self.lut32[idx]
+
+        return pix.view(np.uint8).reshape(idx.shape + (4,))
+
+
+def colorize(data, cmap, vmin, vmax):
+    """
+    Turn the (masked) data array into a uint8 RGBA array using the
+    given matplotlib colormap; masked pixels come out transparent
+    """
+    norm = plt.Normalize(vmin=vmin, vmax=vmax)
+    rgba = cmap(norm(data), bytes=True)
+
+    return rgba
+
+
+def fitToAxes(rgba, layers):
+    """
+    Nearest neighbour resample the (ny, nx, 4) data raster to exactly fill
+    the map axes region of the frame, like imshow(interpolation='none')
+    """
+    rslice, cslice = layers.axesSlices()
+    ony = rslice.stop - rslice.start
+    onx = cslice.stop - cslice.start
+
+    iny, inx = rgba.shape[0:2]
+    ridx = ((np.arange(ony) + 0.5)*iny/ony).astype(np.intp)
+    cidx = ((np.arange(onx) + 0.5)*inx/onx).astype(np.intp)
+
+    return rgba[ridx[:, None], cidx[None, :]]
+
+
+def asPixels(rgba):
+    """
+    View a C-contiguous (ny, nx, 4) uint8 RGBA array as (ny, nx) uint32,
+    so whole pixels can be moved around at once
+    """
+    rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+
+    return rgba.view(np.uint32)[..., 0]
+
+
+def alphaOver(frame, src, where=None):
+    """
+    Alpha-composite the RGBA array 'src' over the (opaque, C-contiguous)
+    RGBA array 'frame', in place.  'where' is the (row, column) slices of
+    'frame' that 'src' covers; if None it's the whole thing.
+    """
+    if where is None:
+        where = (slice(None), slice(None))
+
+    alpha = src[..., 3]
+
+    # Opaque pixels are just copied, and transparent ones skipped entirely;
+    #   only the (usually few) antialiased edges need the actual math
+    opaque = alpha == 255
+    np.copyto(asPixels(frame)[where], asPixels(src), where=opaque)
+
+    rows, cols = np.nonzero((alpha != 0) & ~opaque)
+    if rows.size > 0:
+        dst = frame[where]
+        pa = alpha[rows, cols, None].astype(np.float32)/255.
+        blend = src[rows, cols, 0:3]*pa + dst[rows, cols, 0:3]*(1. - pa)
+        dst[rows, cols, 0:3] = np.round(blend).astype(np.uint8)
+
+    return frame
+
+
+def compositeFrame(layers, data=None, title=None, dataInAxes=True):
+    """
+    Stack up the layers into a final RGB frame.
+
+    'data' is the colorized RGBA data raster; if 'dataInAxes' is True it's
+    assumed to be the size of the map axes region (see fitToAxes),
+    otherwise it needs to be the size of the full frame already.
+    'title' is the RGBA output of renderTitleBar.
+    """
+    frame = layers.under.copy()
+
+    if data is not None:
+        if dataInAxes is True:
+            alphaOver(frame, data, where=layers.axesSlices())
+        else:
+            alphaOver(frame, data)
+
+    alphaOver(frame, layers.over)
+
+    if title is not None:
+        alphaOver(frame, title)
+
+    return np.ascontiguousarray(frame[..., 0:3])
+
+
+def saveFrame(frame, outpname):
+    """
+    Write out the final composited frame; it's written to a temporary
+    name and then moved into place since the published copies are
+    hard links to it
+    """
+    tname = "%s.%d.tmp" % (outpname, os.getpid())
+    plt.imsave(tname, frame, format='png')
+    os.replace(tname, outpname)
+    print("Saved as %s." % (outpname))
+
+
+def getTitleFont(dpi, size=10.):
+    """
+    Return the same bold monospace font that matplotlib uses for the
+    title bar, at 'size' points for the given dpi
+    """
+    pxsize = int(np.round(size*dpi/72.))
+
+    try:
+        font = _fontCache[pxsize]
+    except KeyError:
+        fprops = mfonts.FontProperties(family='monospace', weight='bold')
+        font = ImageFont.truetype(mfonts.findfont(fprops), size=pxsize)
+        _fontCache.update({pxsize: font})
+
+    return font
+
+
+def drawTitleBar(frame, layers, line1, line2):
+    """
+    Same as renderTitleBar, but drawn directly on the RGB frame with
+    Pillow rather than going through matplotlib.  Returns a PIL Image.
+    """
+    ny, nx = layers.shape
+    left, bottom, width, height = layers.axpos
+
+    # Axes fractions to image pixels; image rows start at the top
+    def toPix(xfrac, yfrac):
+        px = (left + xfrac*width)*nx
+        py = (1. - (bottom + yfrac*height))*ny
+        return px, py
+
+    img = Image.fromarray(frame)
+    dtxt = ImageDraw.Draw(img)
+
+    # Black background for top label text
+    x0, y0 = toPix(0.0, 1.0)
+    x1, y1 = toPix(1.0, 0.955)
+    dtxt.rectangle([int(np.round(x0)), int(np.round(y0)),
+                    int(np.round(x1)) - 1, int(np.round(y1)) - 1],
+                   fill=(0, 0, 0))
+
+    font = getTitleFont(layers.dpi)
+    for line, yfrac in [[line1, 0.985], [line2, 0.965]]:
+        dtxt.text(toPix(0.5, yfrac), line, fill=(255, 255, 255),
+                  font=font, anchor='mm')
+
+    return img
+
+
+def savePNG(img, outpname, compressLevel=1):
+    """
+    Write out the frame (a PIL Image or RGB array) with Pillow;
+    'compressLevel' is the zlib level, 0 (none, fastest) to 9 (smallest)
+    """
+    if isinstance(img, np.ndarray):
+        img = Image.fromarray(img)
+
+    tname = "%s.%d.tmp" % (outpname, os.getpid())
+    img.save(tname, format='PNG', compress_level=compressLevel)
+    os.replace(tname, outpname)
+    print("Saved as %s." % (outpname))
@@ -16,7 +16,10 @@ from __future__ import division, print_function, absolute_import
 import glob
 
 import os
+import time
+import signal
 from datetime import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 import pyresample as pr
@@ -29,19 +32,60 @@ from matplotlib.colors import ListedColormap
 
 import cartopy.crs as ccrs
 import cartopy.feature as cfeat
-from cartopy.feature import sgeom
 import cartopy.io.shapereader as cshape
 
+import projCache as pcache
+import geomCache as gcache
+import mapLayers as mlayers
+import composites as comps
+import siteSampler as ssamp
+import frameCube as fcube
+import rangeReader as rrange
 
-def readNC(filename):
+
+# Filled in by initRenderWorker() in each of the rendering processes
+_workerSetup = {}
+
+
+def readNC(filename, memory=None, remote=None):
     """
+    If 'memory' is given it's the actual contents of the file (as bytes),
+    and 'filename' is just used as its name.
+
+    If 'remote' is given it's the (bucket, key) of the file in S3, and
+    only the parts of it that are actually used are read; see rangeReader.
     """
-    print("Reading: %s" % (filename))
-    dat = Dataset(filename)
+    if remote is not None:
+        print("Reading: %s (ranged, from s3://%s/%s)" % (filename,
+                                                          remote[0],
+                                                          remote[1]))
+        fobj = rrange.openS3(rrange.getClient(), remote[0], remote[1])
+        dat = rrange.H5Dataset(fobj)
+    elif memory is not None:
+        print("Reading: %s (from memory)" % (filename))
+        dat = Dataset(filename, memory=memory)
+    else:
+        print("Reading: %s" % (filename))
+        dat = Dataset(filename)
 
     return dat
 
 
+def scanStart(infile):
+    """
+    When the scan that 'infile' is from started (see
+    goes16_aws.keyScanStart); only its header is read
+    """
+    dat = Dataset(infile)
+    try:
+        tstart = dt.strptime(dat.time_coverage_start,
+                             "%Y-%m-%dT%H:%M:%S.%fZ")
+    finally:
+        dat.close()
+
+    return tstart
+
+
 def G16_ABI_L2_ProjDef(nc):
     """
     """
@@ -98,79 +142,83 @@ def G16_ABI_L2_ProjDef(nc):
     return old_grid
 
 
-def crop_image(nc, data, clat, clon, pCoeff=None):
+def sectorCovers(nc, clat, clon, radius=200.):
+    """
+    True if the image in nc covers the whole of our map around clat, clon
+    (see projCache.targetBox); meant for the mesoscale sectors, which get
+    moved around to wherever the weather is
+    """
+    grid = G16_ABI_L2_ProjDef(nc)
+
+    lonMin, lonMax, latMin, latMax = pcache.targetBox(clat, clon,
+                                                      radius=radius)
+    lons = np.array([clon, lonMin, lonMin, lonMax, lonMax])
+    lats = np.array([clat, latMin, latMax, latMin, latMax])
+
+    # Anything off of the image comes back masked
+    cols, rows = grid.get_array_indices_from_lonlat(lons, lats)
+    inside = ~(np.ma.getmaskarray(cols) | np.ma.getmaskarray(rows))
+
+    return bool(np.all(inside))
+
+
+def readWindow(nc, window=None, varname='CMI', qualityMask=False):
+    """
+    Read just the rows/columns given by 'window' of 'varname' from nc;
+    'window' is (rowStart, rowEnd, colStart, colEnd) and if it's None the
+    whole thing is read.
+
+    If 'qualityMask' is True, the same window of the data quality flags
+    (DQF) is read too and anything not flagged as good (0) is masked.
+    """
+    if window is None:
+        data = nc[varname][:]
+    else:
+        data = nc[varname][window[0]:window[1], window[2]:window[3]]
+
+    if qualityMask is True:
+        if window is None:
+            dqf = nc['DQF'][:]
+        else:
+            dqf = nc['DQF'][window[0]:window[1], window[2]:window[3]]
+
+        # Anything that's masked in the DQF is suspect too, so treat it bad
+        dqf = np.ma.filled(dqf, 1)
+        data = np.ma.masked_where(dqf != 0, data)
+
+    return data
+
+
+def crop_image(nc, data, clat, clon, pCoeff=None, cachedir=None,
+               qualityMask=False):
+    """
+    If 'data' is None, only the rows/columns of CMI that are actually
+    needed for the output grid are read from nc; in that case any given
+    'pCoeff' is ignored since it needs to match up with that window.
+    """
     # Parse/grab the existing projection information
     old_grid = G16_ABI_L2_ProjDef(nc)
 
     # pr.plot.show_quicklook(old_grid, data, coast_res='10m')
 
-    # Output grid centered on clat, clon
-    # latWid = 3.5
-    # lonWid = 3.5
-    # lonMin = clon - lonWid
-    # lonMax = clon + lonWid
-    # latMin = clat - latWid
-    # latMax = clat + latWid
-
-    # Handpicked favorites; generates all of AZ centered on the DCT
-    # latWid = 3.5
-    # lonWid = 3.5
-    # lonMin = clon - lonWid
-    # lonMax = clon + lonWid - 1.0
-    # latMin = clat - latWid
-    # latMax = clat + latWid - 0.75
-
-    # Zoomed in portion around the DCT, showing an approximate radius
-    #   of 'desiredRadius' statute miles.
-    # To do this right it's easier to think in terms of nautical miles;
-    #   See https://github.com/LowellObservatory/Camelot/issues/5 for the math.
-
-    # In *statute miles* since they're easier to measure (from Google Maps)
-    desiredRadius = 200.
-
-    # Now it's in nautical miles so we just continue
-    dRnm = desiredRadius/1.1507794
-    latWid = dRnm/60.
-    lonWid = dRnm/(np.cos(np.deg2rad(clat))*60.)
-
-    # Small fudge factor to make the aspect a little closer to 1:1
-    latWid += 0.093
-
-    print(latWid, lonWid)
-
-    lonMin = clon - lonWid
-    lonMax = clon + lonWid
-    latMin = clat - latWid
-    latMax = clat + latWid
-
-    # Create a grid at at the specified resolution; original default was
-    #   0.005 degrees or 18 arcseconds resolution, though I don't remember why
-    gridRes = 18./60./60.
-    lats = np.arange(latMin, latMax, gridRes)
-    lons = np.arange(lonMin, lonMax, gridRes)
-    lons, lats = np.meshgrid(lons, lats)
-
-    swath_def = pr.geometry.SwathDefinition(lons=lons, lats=lats)
-
-    # LCC is Lambert conformal conic projection
-    area_def = swath_def.compute_optimal_bb_area({'proj': 'lcc',
-                                                  'lon_0': clon,
-                                                  'lat_0': clat,
-                                                  'lat_1': clat,
-                                                  'lat_2': clat})
-
-    # If we don't have projection coefficients already, calculate 'em!
-    if pCoeff is None:
-        # SC2000 FTW
-        print("Reticulating splines...")
-
-        # NOTE: On 20181120, when nprocs > 1 it never returned. Bug? Dunno.
-        # pCoeff: valid_input_index, valid_output_index,
-        #         index_array, distance_array
-        pCoeff = pr.kd_tree.get_neighbour_info(old_grid, area_def, 5000.,
-                                               neighbours=1, epsilon=0.,
-                                               nprocs=1)
-        # print('Old projection information: {}'.format(old_grid))
+    # Output grid centered on clat, clon.  It's only ever calculated once
+    #   per center/radius/resolution and then handed back from the registry
+    geom = pcache.getTargetGeometry(clat, clon)
+    area_def = geom.area_def
+
+    if data is None:
+        # Neighbour info that's been trimmed to only the part of the
+        #   ABI fixed grid that we actually use, so only read that part
+        pCoeff, window = pcache.getWindowedNeighbourInfo(old_grid, area_def,
+                                                         5000.,
+                                                         cachedir=cachedir)
+        data = readWindow(nc, window=window, qualityMask=qualityMask)
+    elif pCoeff is None:
+        # If we don't have projection coefficients already, grab 'em from
+        #   the cache; they'll only actually be recalculated if the source
+        #   or target grids have changed since the last time we saw them
+        pCoeff = pcache.getNeighbourInfo(old_grid, area_def, 5000.,
+                                         cachedir=cachedir)
     else:
         # NOTE: I'm not rechecking anything, I'm just assuming it's all good
         #   and reusing it.  It'll probably look messed up in some obvious
@@ -241,42 +289,21 @@ def add_map_features(ax, counties=None, roads=None):
     return ax
 
 
-def parseCounties(shpfile, center=None, centerRad=7.):
-    """
+def parseCounties(shpfile, center=None, centerRad=7., cachedir=None):
     """
+    Return the county geometries within 'centerRad' degrees of 'center'
+    (lon, lat), or all of them if 'center' is None.
 
-    counties = cshape.Reader(shpfile)
-
-    # If we have coordinates of the center of the map, spatially filter
-    #   the roads down to just those w/in 500 miles of the center
-    spatialFilter = False
-    if center is not None:
-        spatialFilter = True
-        mapCenterPt = sgeom.Point(center[0], center[1])
-
-    clist = []
-    # A dict is far easier to interact with so make one
-    for rec in counties.records():
-        if spatialFilter is True:
-            # Since the geometry coordinates are in lon/lat, the
-            #   corresponding 'dist' will be too; therefore we filter
-            #   based on a radius of N degrees from the center
-            # centerRad = 7 covers a big area so we'll roll with that
-            dist = rec.geometry.distance(mapCenterPt)
-            if dist <= centerRad:
-                store = True
-            else:
-                store = False
-        else:
-            store = True
-
-        if store is True:
-            clist.append(rec.geometry)
+    The lookups go through a spatial index, and if 'cachedir' is given the
+    results are cached there too; see geomCache.py.
+    """
+    clist = gcache.queryShapes(shpfile, center=center, radius=centerRad,
+                               cachedir=cachedir)
 
     return clist
 
 
-def parseRoads(rclasses, center=None, centerRad=7.):
+def parseRoads(rclasses, center=None, centerRad=7., cachedir=None):
     """
     See https://www.naturalearthdata.com/downloads/10m-cultural-vectors/roads/
     for field information; below is just a quick summary.
@@ -303,42 +330,13 @@ def parseRoads(rclasses, center=None, centerRad=7.):
                                category='cultural',
                                name='roads_north_america')
 
-    rdsrec = cshape.Reader(rds)
-
     # If we have coordinates of the center of the map, spatially filter
-    #   the roads down to just those w/in 500 miles of the center
-    spatialFilter = False
-    if center is not None:
-        spatialFilter = True
-        mapCenterPt = sgeom.Point(center[0], center[1])
-
-    rdict = {}
-    # A dict is far easier to interact with so make one
-    for rec in rdsrec.records():
-        for key in rclasses:
-            if rec.attributes['class'] == key:
-                # If it's a road class of type we want, test more or store
-                if spatialFilter is True:
-                    # Since the geometry coordinates are in lon/lat, the
-                    #   corresponding 'dist' will be too; therefore we filter
-                    #   based on a radius of N degrees from the center
-                    # centerRad = 7 covers a big area so we'll roll with that
-                    dist = rec.geometry.distance(mapCenterPt)
-                    if dist <= centerRad:
-                        store = True
-                    else:
-                        store = False
-                else:
-                    store = True
-
-                if store is True:
-                    try:
-                        rdict[key].append(rec.geometry)
-                    except KeyError:
-                        # This means the key hasn't been created yet so make it
-                        #   and then fill it with the value.
-                        #   It should then work fine the next time
-                        rdict.update({key: [rec.geometry]})
+    #   the roads down to just those w/in centerRad degrees of the center.
+    #   The lookups go through a spatial index, and if 'cachedir' is given
+    #   the results are cached there too; see geomCache.py.
+    rdict = gcache.queryShapes(rds, center=center, radius=centerRad,
+                               field='class', values=rclasses,
+                               cachedir=cachedir)
 
     return rdict
 
@@ -412,18 +410,147 @@ def getCmap(vmin=160, vmax=330, trans=None):
     return newcmp
 
 
+def getProductCmap(name, vmin=160, vmax=330):
+    """
+    Colormap for a product; 'goesir' is our own IR one (see getCmap),
+    otherwise it's the name of a matplotlib colormap
+    """
+    if name == 'goesir':
+        cmap = getCmap(vmin=vmin, vmax=vmax)
+    else:
+        cmap = cm.get_cmap(name, 256)
+
+    return cmap
+
+
 def makePlots(inloc, outloc, roads=None, counties=None,
-              cmap=None, irange=None, forceRegen=False):
+              cmap=None, irange=None, forceRegen=False, cachedir=None,
+              qualityMask=False, nworkers=1, renderer='mpl',
+              compressLevel=1, manifest=None, cube=None):
+    """
+    'cachedir' is where the reprojection coefficients (and prerendered
+    map layers) are stored between runs; if it's None they're only kept
+    in memory for this process.
+
+    'qualityMask' will mask out any pixels not flagged as good in the DQF.
+
+    'nworkers' > 1 renders the frames in that many separate processes;
+    they get the reprojection coefficients from 'cachedir' so it should
+    really be set in that case.
+
+    'renderer' is either 'mpl', which draws every frame from scratch in
+    matplotlib, or 'layers' which only colorizes the data and composites
+    it with the (cached) static map layers; see mapLayers.py.  'lut' is
+    the same as 'layers' but never touches matplotlib per frame; the
+    colormap is baked into a lookup table, the title bar is drawn with
+    Pillow and the PNG is written at zlib level 'compressLevel'.
+
+    'manifest' is an optional fileManifest.FileManifest; if it's given,
+    it decides what needs plotting (rather than looking in 'inloc' and
+    'outloc') and is told how each frame went.
+
+    'cube' is an optional frameCube.FrameCube; the reprojected data of
+    each frame is stored in it too (see rerenderCube).
+    """
 
     # Warning, you may explode
     #  https://matplotlib.org/api/pyplot_api.html#matplotlib.pyplot.switch_backend
     plt.switch_backend("Agg")
 
+    cubeCoding = None
+    if cube is not None:
+        cubeCoding = (cube.offset, cube.scale)
+
+    setup = renderSetup(roads=roads, counties=counties, cmap=cmap,
+                        irange=irange, cachedir=cachedir,
+                        qualityMask=qualityMask, renderer=renderer,
+                        compressLevel=compressLevel, cubeCoding=cubeCoding)
+
+    # Figure out what actually needs doing
+    if manifest is not None:
+        # It already knows what's been plotted, so no need to look
+        pending = manifest.pending(everything=forceRegen)
+    else:
+        flist = sorted(glob.glob(inloc + "*.nc"))
+        pending = []
+        for each in flist:
+            outpname = "%s/%s.png" % (outloc, os.path.basename(each))
+
+            # Logic to skip stuff already completed, or just redo everything
+            if forceRegen is True:
+                save = True
+            else:
+                # Check to see if we're already done with this image
+                found = os.path.isfile(outpname)
+
+                if found is True:
+                    save = False
+                    print("File %s exists! Skipping." % (outpname))
+                else:
+                    save = True
+
+            if save is True:
+                pending.append((each, outpname))
+
+    if nworkers > 1 and len(pending) > 1:
+        # Do the (possibly) expensive projection stuff once, up front, so
+        #   the workers can all just load it from the cache instead of
+        #   all calculating it at the same time
+        primeCache(pending[0][0], setup['cLat'], setup['cLon'],
+                   cachedir=cachedir, roads=setup['roads'],
+                   counties=counties, renderer=renderer)
+
+        print("Rendering %d frames with %d workers..." % (len(pending),
+                                                          nworkers))
+        results = []
+        with ProcessPoolExecutor(max_workers=nworkers,
+                                 initializer=initRenderWorker,
+                                 initargs=(setup,)) as pool:
+            futs = [pool.submit(renderWorker, each, outpname)
+                    for each, outpname in pending]
+            for fut in as_completed(futs):
+                results.append(fut.result())
+    else:
+        results = [renderOne(each, outpname, setup)
+                   for each, outpname in pending]
+
+    if manifest is not None:
+        for res in results:
+            manifest.markRendered(res['input'], ok=res['ok'])
+
+    if cube is not None:
+        # Oldest first, so if the cube's full it's the old ones that go
+        for res in sorted(results, key=lambda x: x['tend'] or dt.min):
+            if res['codes'] is not None:
+                cube.putCodes(res['tend'], res['codes'],
+                              info=res['cubeinfo'])
+
+    # i is the number-of-images processed counter
+    i = 0
+    for res in results:
+        if res['ok'] is True:
+            i += 1
+        else:
+            print("FAILED to render %s: %s" % (res['input'], res['error']))
+
+    return i
+
+
+def renderSetup(roads=None, counties=None, cmap=None, irange=None,
+                cachedir=None, qualityMask=False, renderer='mpl',
+                compressLevel=1, sampleRadii=None, cubeCoding=None):
+    """
+    Put together everything renderFrame needs (other than the filenames)
+    that's the same for every frame; see makePlots for what it all means.
+
+    If 'sampleRadii' (km) is given, the stats of the data within those
+    radii of each of our sites are handed back too; see siteSampler.
+    If 'cubeCoding' (offset, scale) is given, so is the reprojected data
+    encoded for a frameCube.FrameCube.
+    """
     cLat = 34.7443
     cLon = -111.4223
 
-    flist = sorted(glob.glob(inloc + "*.nc"))
-
     # Just a little helper for at least the roads. We won't do this
     #   for counties, though, since those datafiles are manually read
     if roads is None:
@@ -450,139 +577,506 @@ def makePlots(inloc, outloc, roads=None, counties=None,
         #   what you're doing.
         cmap = getCmap(vmin=vmin, vmax=vmax)
 
-    # i is the number-of-images processed counter
-    i = 0
-    for each in flist:
-        outpname = "%s/%s.png" % (outloc, os.path.basename(each))
+    lut = None
+    if renderer == 'lut':
+        lut = mlayers.ColorLUT(cmap, vmin=vmin, vmax=vmax)
 
-        # Logic to skip stuff already completed, or just redo everything
-        if forceRegen is True:
-            save = True
-        else:
-            # Check to see if we're already done with this image
-            found = os.path.isfile(outpname)
+    setup = {'cLat': cLat, 'cLon': cLon, 'cmap': cmap,
+             'vmin': vmin, 'vmax': vmax,
+             'roads': roads, 'counties': counties,
+             'cachedir': cachedir, 'qualityMask': qualityMask,
+             'renderer': renderer, 'lut': lut,
+             'compressLevel': compressLevel, 'sampleRadii': sampleRadii,
+             'cubeCoding': cubeCoding}
 
-            if found is True:
-                save = False
-                print("File %s exists! Skipping." % (outpname))
-            else:
-                save = True
+    return setup
 
-        if save is True:
-            dat = readNC(each)
 
-            # Pull out the channel/band and other identifiers
-            chan = dat.variables['band_id'][0]
-            plat = "%s (%s)" % (dat.orbital_slot, dat.platform_ID)
-            dprod = dat.title
+def compositeSetup(recipe, roads=None, counties=None, cachedir=None,
+                   qualityMask=False, compressLevel=1):
+    """
+    Same as renderSetup, but for renderComposite; the 'recipe' key is how
+    renderProductWorker tells the two apart
+    """
+    setup = {'recipe': recipe, 'cLat': 34.7443, 'cLon': -111.4223,
+             'roads': roads, 'counties': counties, 'cachedir': cachedir,
+             'qualityMask': qualityMask, 'compressLevel': compressLevel}
 
-            # Pull out the time stamp
-            tend = dt.strptime(dat.time_coverage_end,
-                               "%Y-%m-%dT%H:%M:%S.%fZ")
+    return setup
 
-            # If it's our first time through, we definitely need to recalculate
-            #   the projection/transformation stuff
-            if i == 0:
-                pCoeff = None
-            else:
-                # Check to see if we've rolled over in day, and if so,
-                #   force recalculation of the transformation/projection stuff
-                if tend.day != tprev.day:
-                    pCoeff = None
-
-            # Grab just the image data
-            img = dat['CMI'][:]
-
-            # This is the function that actually handles the reprojection
-            ogrid, ngrid, ndat, pCoeff = crop_image(dat, img, cLat, cLon,
-                                                    pCoeff=pCoeff)
-
-            print('Old projection information: {}'.format(ogrid))
-            print('NEW projection information: {}'.format(ngrid))
-
-            # Get the new projection/transformation info for the plot axes
-            crs = ngrid.to_cartopy_crs()
-
-            # Get the proper plot extents so we have no whitespace
-            print(crs.bounds)
-            prlon = (crs.x_limits[1] - crs.x_limits[0])
-            prlat = (crs.y_limits[1] - crs.y_limits[0])
-            # Ultimate image width/height
-            paspect = prlon/prlat
-
-            # !!! WARNING !!!
-            #   I hate this kludge, but it works if you let the aspect stretch
-            #   just a tiny bit. Necessary for the MP4 creation because the
-            #   compression algorithm needs an even number divisor
-            figsize = (7., np.round(7./paspect, decimals=2))
-
-            print(prlon, prlat, paspect)
-            print(figsize)
-
-            # Figure creation
-            fig = plt.figure(figsize=figsize, dpi=100)
-
-            # Needed to remove any whitespace/padding around the imshow()
-            plt.subplots_adjust(left=0., right=1., top=1., bottom=0.)
-
-            # Tell matplotlib we're using a map projection so cartopy
-            #   takes over and overloades Axes() with GeoAxes()
-            ax = plt.axes(projection=crs)
-
-            # This actually sets the background map color so it's darker
-            #   when there's no data or missing data.
-            ax.background_patch.set_facecolor('#262629')
-
-            # Some custom stuff
-            ax = add_map_features(ax, counties=counties, roads=roads)
-            ax = add_AZObs(ax)
-
-            plt.imshow(ndat, transform=crs, extent=crs.bounds, origin='upper',
-                       vmin=vmin, vmax=vmax, interpolation='none',
-                       cmap=cmap)
-            # plt.colorbar()
-
-            # Add the informational bar at the top, using info directly
-            #   from the original datafiles that we opened at the top
-            line1 = "%s  %s" % (plat, dprod)
-            line1 = line1.upper()
-
-            # We don't need microseconds shown on this plot
-            tendstr = tend.strftime("%Y-%m-%d  %H:%M:%SZ")
-            line2 = "Band %02d  %s" % (chan, tendstr)
-            line2 = line2.upper()
-
-            # Black background for top label text
-            #   NOTE: Z order is important! Text should be higher than trect
-            trect = mpatches.Rectangle((0.0, 0.955), width=1.0, height=0.045,
-                                       edgecolor=None, facecolor='black',
-                                       fill=True, alpha=1.0, zorder=100,
-                                       transform=ax.transAxes)
-            ax.add_patch(trect)
-
-            # Line 1
-            plt.annotate(line1, (0.5, 0.985), xycoords='axes fraction',
-                         fontfamily='monospace',
-                         horizontalalignment='center',
-                         verticalalignment='center',
-                         color='white', fontweight='bold', zorder=200)
-            # Line 2
-            plt.annotate(line2, (0.5, 0.965), xycoords='axes fraction',
-                         fontfamily='monospace',
-                         horizontalalignment='center',
-                         verticalalignment='center',
-                         color='white', fontweight='bold', zorder=200)
-
-            # Useful for testing getCmap changes
-            # plt.colorbar()
-
-            plt.savefig(outpname, dpi=100)
-            print("Saved as %s." % (outpname))
-            plt.close()
-
-            # Make sure to save the current timestamp for comparison the
-            #   next time through the loop!
-            tprev = tend
-            i += 1
 
-    return i
+def primeCache(infile, cLat, cLon, cachedir=None, roads=None,
+               counties=None, renderer='mpl'):
+    """
+    Make sure the (windowed) neighbour info for 'infile' is in the cache,
+    along with the static map layers if they're going to be used
+    """
+    dat = readNC(infile)
+    try:
+        ogrid = G16_ABI_L2_ProjDef(dat)
+        geom = pcache.getTargetGeometry(cLat, cLon)
+        pcache.getWindowedNeighbourInfo(ogrid, geom.area_def, 5000.,
+                                        cachedir=cachedir)
+    finally:
+        dat.close()
+
+    if renderer in ['layers', 'lut']:
+        getStaticLayers(geom.crs, roads=roads, counties=counties,
+                        cachedir=cachedir)
+
+
+def getFigsize(crs):
+    """
+    Figure size (inches) that matches the aspect ratio of the map
+    """
+    # Get the proper plot extents so we have no whitespace
+    prlon = (crs.x_limits[1] - crs.x_limits[0])
+    prlat = (crs.y_limits[1] - crs.y_limits[0])
+    # Ultimate image width/height
+    paspect = prlon/prlat
+
+    # !!! WARNING !!!
+    #   I hate this kludge, but it works if you let the aspect stretch
+    #   just a tiny bit. Necessary for the MP4 creation because the
+    #   compression algorithm needs an even number divisor
+    figsize = (7., np.round(7./paspect, decimals=2))
+
+    print(prlon, prlat, paspect)
+    print(figsize)
+
+    return figsize
+
+
+def getStaticLayers(crs, roads=None, counties=None, cachedir=None):
+    """
+    Grab the prerendered map features and markers for the GOES map
+    """
+    def drawStatic(ax):
+        add_map_features(ax, counties=counties, roads=roads)
+        add_AZObs(ax)
+
+    tag = mlayers.featureTag(roads=roads, counties=counties)
+    layers = mlayers.getStaticLayers(crs, crs.bounds, getFigsize(crs),
+                                     dpi=100, drawFunc=drawStatic,
+                                     figcolor='white', bgcolor='#262629',
+                                     cachedir=cachedir, tag=tag)
+
+    return layers
+
+
+def initRenderWorker(setup):
+    """
+    Runs once in each worker process, so the roads/counties/colormap are
+    only sent over once rather than along with every single frame
+    """
+    # Warning, you may explode
+    #  https://matplotlib.org/api/pyplot_api.html#matplotlib.pyplot.switch_backend
+    plt.switch_backend("Agg")
+
+    # Ctrl-C goes to the whole process group, but it's up to the parent
+    #   to decide how to shut down (see pipeline.py) so ignore it here
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    _workerSetup.update(setup)
+
+
+def renderWorker(infile, outpname, memory=None, remote=None):
+    """
+    What's actually run by the worker processes; see initRenderWorker
+    """
+    return renderOne(infile, outpname, _workerSetup, memory=memory,
+                     remote=remote)
+
+
+def renderProductWorker(product, infile, outpname, memory=None,
+                        remote=None):
+    """
+    Same as renderWorker, but for when the workers were each given a dict
+    of setups keyed by product name (see renderSetup) so one pool can
+    render all of the products.  For the RGB composites (see
+    compositeSetup) 'infile', 'memory' and 'remote' are lists, with one
+    entry per band.
+    """
+    setup = _workerSetup[product]
+    if 'recipe' in setup:
+        return renderCompositeOne(infile, outpname, setup, memories=memory,
+                                  remotes=remote)
+
+    return renderOne(infile, outpname, setup, memory=memory, remote=remote)
+
+
+def renderOne(infile, outpname, setup, memory=None, remote=None):
+    """
+    Render a single frame, catching and returning any errors rather than
+    letting them take out the whole loop.  'memory' or 'remote' say where
+    'infile' actually is if it's not on disk; see readNC.
+
+    Returns a dict of the results; 'ok' is True if it worked.
+    """
+    res = {'input': infile, 'output': outpname, 'ok': False,
+           'error': None, 'seconds': 0., 'samples': None, 'codes': None,
+           'tend': None, 'cubeinfo': None}
+
+    t0 = time.time()
+    try:
+        res.update(renderFrame(infile, outpname, memory=memory,
+                               remote=remote, **setup))
+        res['ok'] = True
+    except Exception as err:
+        # TODO: Figure out the proper/specific exceptions to catch;
+        #   for now it's better than losing the rest of the frames
+        res['error'] = str(err)
+        plt.close('all')
+    res['seconds'] = time.time() - t0
+
+    return res
+
+
+def renderCompositeOne(infiles, outpname, setup, memories=None,
+                       remotes=None):
+    """
+    Same as renderOne, but for an RGB composite made from 'infiles' (see
+    renderComposite); the first of them is the one the frame is filed
+    under, as its 'input'
+    """
+    res = {'input': infiles[0], 'output': outpname, 'ok': False,
+           'error': None, 'seconds': 0., 'samples': None, 'codes': None,
+           'tend': None, 'cubeinfo': None}
+
+    t0 = time.time()
+    try:
+        res['tend'] = renderComposite(infiles, outpname, memories=memories,
+                                      remotes=remotes, **setup)
+        res['ok'] = True
+    except Exception as err:
+        # Same as renderOne; better than losing the rest of the frames
+        res['error'] = str(err)
+        plt.close('all')
+    res['seconds'] = time.time() - t0
+
+    return res
+
+
+def renderFrame(infile, outpname, cLat=34.7443, cLon=-111.4223, cmap=None,
+                vmin=160, vmax=330, roads=None, counties=None,
+                cachedir=None, qualityMask=False, renderer='mpl', lut=None,
+                compressLevel=1, memory=None, remote=None,
+                sampleRadii=None, cubeCoding=None):
+    """
+    Actually read, reproject, and plot a single file; see makePlots
+    for the different renderers.  'lut' is the mapLayers.ColorLUT for
+    the 'lut' renderer, and will be made from 'cmap' if it's not given.
+    'memory' or 'remote' say where 'infile' actually is if it's not on
+    disk; see readNC.
+
+    Returns a dict with the site samples (see siteSampler) if
+    'sampleRadii' is given, and the frame's encoded data, time and title
+    info for the frameCube.FrameCube if 'cubeCoding' is given; they're
+    None otherwise.
+    """
+    dat = readNC(infile, memory=memory, remote=remote)
+
+    # Pull out the channel/band and other identifiers
+    chan = dat.variables['band_id'][0]
+    plat = "%s (%s)" % (dat.orbital_slot, dat.platform_ID)
+    dprod = dat.title
+
+    # Pull out the time stamp
+    tend = dt.strptime(dat.time_coverage_end, "%Y-%m-%dT%H:%M:%S.%fZ")
+
+    # The transformation stuff is cached and keyed on the actual
+    #   projection parameters, so it'll only be recalculated if
+    #   the ABI fixed grid (or our target grid) actually changes
+    pCoeff = None
+
+    # This is the function that actually handles the reprojection;
+    #   by not giving it any data it'll only read the part of
+    #   the image that it actually needs
+    ogrid, ngrid, ndat, pCoeff = crop_image(dat, None, cLat, cLon,
+                                            pCoeff=pCoeff,
+                                            cachedir=cachedir,
+                                            qualityMask=qualityMask)
+
+    # Everything we need has been pulled out now
+    dat.close()
+
+    print('Old projection information: {}'.format(ogrid))
+    print('NEW projection information: {}'.format(ngrid))
+
+    # Straight from the reprojected data, before it's ever colorized
+    samples = None
+    if sampleRadii is not None:
+        def targetCoords():
+            return pcache.getTargetGeometry(cLat, cLon).area_def.get_lonlats()
+
+        sampler = ssamp.getSampler(('goes', cLat, cLon), targetCoords,
+                                   radii=sampleRadii)
+        samples = sampler.sample(ndat)
+
+    # Get the new projection/transformation info for the plot axes;
+    #   comes straight from the registry so it's the same CRS object
+    #   that was made for the very first frame
+    crs = pcache.getTargetGeometry(cLat, cLon).crs
+
+    print(crs.bounds)
+
+    # Add the informational bar at the top, using info directly
+    #   from the original datafiles that we opened at the top
+    line1 = "%s  %s" % (plat, dprod)
+    line1 = line1.upper()
+
+    # We don't need microseconds shown on this plot
+    tendstr = tend.strftime("%Y-%m-%d  %H:%M:%SZ")
+    line2 = "Band %02d  %s" % (chan, tendstr)
+    line2 = line2.upper()
+
+    extras = {'samples': samples, 'codes': None, 'tend': tend,
+              'cubeinfo': None}
+    if cubeCoding is not None:
+        extras['codes'] = fcube.encode(ndat, cubeCoding[0], cubeCoding[1])
+        extras['cubeinfo'] = {'line1': line1, 'band': int(chan)}
+
+    if renderer == 'layers':
+        # Only the data and the title bar are drawn; the rest is cached
+        layers = getStaticLayers(crs, roads=roads, counties=counties,
+                                 cachedir=cachedir)
+        rgba = mlayers.colorize(ndat, cmap, vmin, vmax)
+        rgba = mlayers.fitToAxes(rgba, layers)
+        title = mlayers.renderTitleBar(layers, line1, line2)
+        frame = mlayers.compositeFrame(layers, data=rgba, title=title)
+        mlayers.saveFrame(frame, outpname)
+        return extras
+    elif renderer == 'lut':
+        # Same as above, but no matplotlib at all
+        layers = getStaticLayers(crs, roads=roads, counties=counties,
+                                 cachedir=cachedir)
+        if lut is None:
+            lut = mlayers.ColorLUT(cmap, vmin=vmin, vmax=vmax)
+
+        # Cheaper to fit the indices to the axes than the RGBA values
+        idx = mlayers.fitToAxes(lut.index(ndat), layers)
+        frame = mlayers.compositeFrame(layers, data=lut.lookup(idx))
+        img = mlayers.drawTitleBar(frame, layers, line1, line2)
+        mlayers.savePNG(img, outpname, compressLevel=compressLevel)
+        return extras
+
+    figsize = getFigsize(crs)
+
+    # Figure creation
+    fig = plt.figure(figsize=figsize, dpi=100)
+
+    # Needed to remove any whitespace/padding around the imshow()
+    plt.subplots_adjust(left=0., right=1., top=1., bottom=0.)
+
+    # Tell matplotlib we're using a map projection so cartopy
+    #   takes over and overloades Axes() with GeoAxes()
+    ax = plt.axes(projection=crs)
+
+    # This actually sets the background map color so it's darker
+    #   when there's no data or missing data.
+    ax.background_patch.set_facecolor('#262629')
+
+    # Some custom stuff
+    ax = add_map_features(ax, counties=counties, roads=roads)
+    ax = add_AZObs(ax)
+
+    plt.imshow(ndat, transform=crs, extent=crs.bounds, origin='upper',
+               vmin=vmin, vmax=vmax, interpolation='none',
+               cmap=cmap)
+    # plt.colorbar()
+
+    # Black background for top label text
+    #   NOTE: Z order is important! Text should be higher than trect
+    trect = mpatches.Rectangle((0.0, 0.955), width=1.0, height=0.045,
+                               edgecolor=None, facecolor='black',
+                               fill=True, alpha=1.0, zorder=100,
+                               transform=ax.transAxes)
+    ax.add_patch(trect)
+
+    # Line 1
+    plt.annotate(line1, (0.5, 0.985), xycoords='axes fraction',
+                 fontfamily='monospace',
+                 horizontalalignment='center',
+                 verticalalignment='center',
+                 color='white', fontweight='bold', zorder=200)
+    # Line 2
+    plt.annotate(line2, (0.5, 0.965), xycoords='axes fraction',
+                 fontfamily='monospace',
+                 horizontalalignment='center',
+                 verticalalignment='center',
+                 color='white', fontweight='bold', zorder=200)
+
+    # Useful for testing getCmap changes
+    # plt.colorbar()
+
+    # Swapped into place since the published copies are hard links to it
+    tname = "%s.%d.tmp" % (outpname, os.getpid())
+    plt.savefig(tname, dpi=100, format='png')
+    os.replace(tname, outpname)
+    print("Saved as %s." % (outpname))
+    plt.close()
+
+    return extras
+
+
+def rerenderCube(cube, outloc, cmap=None, irange=None, since=None,
+                 roads=None, counties=None, cachedir=None,
+                 cLat=34.7443, cLon=-111.4223, compressLevel=1):
+    """
+    Re-render every frame in the frameCube.FrameCube 'cube' (or only the
+    ones after the datetime 'since') into 'outloc', with a (possibly
+    different) colormap and range; no netCDF files or reprojection needed.
+
+    Same map as the 'lut' renderer, but the colormap is baked into a table
+    of every possible cube code so each frame is just one lookup.  Frames
+    are named by their time.  Returns how many were made.
+    """
+    plt.switch_backend("Agg")
+
+    if irange is None:
+        vmin, vmax = 160, 330
+    else:
+        vmin, vmax = irange[0], irange[1]
+
+    if cmap is None:
+        cmap = getCmap(vmin=vmin, vmax=vmax)
+
+    lut = mlayers.ColorLUT(cmap, vmin=vmin, vmax=vmax)
+    colors = fcube.codeColors(lut, cube.offset, cube.scale)
+
+    crs = pcache.getTargetGeometry(cLat, cLon).crs
+    layers = getStaticLayers(crs, roads=roads, counties=counties,
+                             cachedir=cachedir)
+
+    line1 = cube.info.get('line1', '')
+    band = cube.info.get('band', 0)
+
+    os.makedirs(outloc, exist_ok=True)
+
+    t0 = time.time()
+    idx = cube.index(since=since)
+    for tend, slot in idx:
+        # Straight from the map; only the pixels actually shown are read
+        codes = mlayers.fitToAxes(cube.codes(slot), layers)
+        pix = colors[codes]
+        rgba = pix.view(np.uint8).reshape(codes.shape + (4,))
+
+        frame = mlayers.compositeFrame(layers, data=rgba)
+        line2 = "Band %02d  %s" % (band, tend.strftime("%Y-%m-%d  %H:%M:%SZ"))
+        img = mlayers.drawTitleBar(frame, layers, line1, line2.upper())
+
+        outpname = "%s/%s.png" % (outloc, tend.strftime("%Y%m%d_%H%M%S"))
+        mlayers.savePNG(img, outpname, compressLevel=compressLevel)
+
+    dt0 = time.time() - t0
+    if len(idx) > 0:
+        print("Re-rendered %d frames in %.1f s (%.3f s/frame)" %
+              (len(idx), dt0, dt0/len(idx)))
+
+    return len(idx)
+
+
+def compositeBands(infiles, cLat=34.7443, cLon=-111.4223, cachedir=None,
+                   qualityMask=False, memories=None, remotes=None):
+    """
+    Read and resample all of the bands in 'infiles' (one file per band,
+    all from the same scan) onto our target grid.  Bands that are on the
+    same ABI grid share their neighbour info and are resampled together
+    in one go; see composites.py.
+
+    'memories' and 'remotes' are lists with the 'memory' and 'remote' (see
+    readNC) of each of 'infiles', for any that aren't on disk.
+
+    Returns the (bands, ny, nx) stack, the list of bands in the order
+    they're stacked, and the info for the title from the first file.
+    """
+    geom = pcache.getTargetGeometry(cLat, cLon)
+    area_def = geom.area_def
+
+    # Grouped by the neighbour info key, so it's one group per ABI grid
+    groups = {}
+    info = None
+    for i, infile in enumerate(infiles):
+        memory, remote = None, None
+        if memories is not None:
+            memory = memories[i]
+        if remotes is not None:
+            remote = remotes[i]
+
+        dat = readNC(infile, memory=memory, remote=remote)
+        try:
+            band = int(dat.variables['band_id'][0])
+            if info is None:
+                info = {'plat': "%s (%s)" % (dat.orbital_slot,
+                                             dat.platform_ID),
+                        'tend': dt.strptime(dat.time_coverage_end,
+                                            "%Y-%m-%dT%H:%M:%S.%fZ")}
+
+            ogrid = G16_ABI_L2_ProjDef(dat)
+            key = pcache.neighbourKey(ogrid, area_def, 5000.)
+            pCoeff, window = pcache.getWindowedNeighbourInfo(ogrid,
+                                                             area_def,
+                                                             5000.,
+                                                             cachedir=cachedir)
+            data = readWindow(dat, window=window, qualityMask=qualityMask)
+        finally:
+            dat.close()
+
+        groups.setdefault(key, {'pCoeff': pCoeff, 'bands': [], 'data': []})
+        groups[key]['bands'].append(band)
+        groups[key]['data'].append(data)
+
+    order = []
+    stacks = []
+    for key, grp in groups.items():
+        print("Resampling bands %s together" % (grp['bands']))
+        stacks.append(comps.resampleStack(np.ma.stack(grp['data']),
+                                          grp['pCoeff'], area_def.shape))
+        order += grp['bands']
+
+    return np.concatenate(stacks), order, info
+
+
+def renderComposite(infiles, outpname, recipe='nightmicro', cLat=34.7443,
+                    cLon=-111.4223, roads=None, counties=None,
+                    cachedir=None, qualityMask=False, compressLevel=1,
+                    memories=None, remotes=None):
+    """
+    Make the RGB composite 'recipe' (see composites.recipes) out of
+    'infiles', which are the files for each of the bands it needs from
+    the same scan, and write it out the same way as the 'lut' renderer.
+    See compositeBands for 'memories' and 'remotes'.
+
+    Returns the end time of the scan.
+    """
+    bands, order, info = compositeBands(infiles, cLat=cLat, cLon=cLon,
+                                        cachedir=cachedir,
+                                        qualityMask=qualityMask,
+                                        memories=memories, remotes=remotes)
+
+    missing = set(comps.recipeBands(recipe)) - set(order)
+    if missing != set():
+        raise ValueError("Bands %s are needed for %s" % (sorted(missing),
+                                                         recipe))
+
+    rgba = comps.toRGBA(comps.componentStack(bands, order, recipe))
+
+    line1 = "%s  %s" % (info['plat'], comps.recipes[recipe]['title'])
+    line1 = line1.upper()
+
+    tendstr = info['tend'].strftime("%Y-%m-%d  %H:%M:%SZ")
+    line2 = "Bands %s  %s" % ("/".join(["%02d" % (each) for each in
+                                        comps.recipeBands(recipe)]),
+                              tendstr)
+    line2 = line2.upper()
+
+    crs = pcache.getTargetGeometry(cLat, cLon).crs
+    layers = getStaticLayers(crs, roads=roads, counties=counties,
+                             cachedir=cachedir)
+
+    frame = mlayers.compositeFrame(layers,
+                                   data=mlayers.fitToAxes(rgba, layers))
+    img = mlayers.drawTitleBar(frame, layers, line1, line2)
+    mlayers.savePNG(img, outpname, compressLevel=compressLevel)
+
+    return info['tend']
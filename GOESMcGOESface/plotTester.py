@@ -21,6 +21,7 @@ import plotGOES as pg
 if __name__ == "__main__":
     inloc = "./inputs/"
     outloc = "./outputs/pngs/"
+    cout = "./outputs/cache/"
     cfiles = "./shapefiles/cb_2018_us_county_5m/"
     # in degrees
     mapcenter = [-111.4223, 34.7443]
@@ -30,14 +31,16 @@ if __name__ == "__main__":
     rclasses = ["Interstate", "Federal"]
 
     print("Reading road data...")
-    roads = pg.parseRoads(rclasses, center=mapcenter, centerRad=filterRadius)
+    roads = pg.parseRoads(rclasses, center=mapcenter, centerRad=filterRadius,
+                          cachedir=cout)
     for rkey in rclasses:
         print("%s: %d found within %d degrees of center" % (rkey,
                                                             len(roads[rkey]),
                                                             filterRadius))
 
     counties = pg.parseCounties(cfiles + "cb_2018_us_county_5m.shp",
-                                center=mapcenter, centerRad=filterRadius)
+                                center=mapcenter, centerRad=filterRadius,
+                                cachedir=cout)
     print("%d counties found within %d degrees of center" % (len(counties),
                                                              filterRadius))
     pg.makePlots(inloc, outloc, cmap=cmap,
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Cache the GOES-16 reprojection details so we don't have to redo them.
+
+The ABI fixed grid basically never changes, so the (expensive!) kd-tree
+neighbour search only needs to happen once per combination of source grid,
+target grid and radius of influence.  The results are stored on disk as
+plain .npy files so they can be memory mapped back in after a restart.
+
+The target grid itself is also only ever built once per center, radius
+and resolution; see getTargetGeometry().
+
+Since we only look at a small box out of the whole CONUS image, the
+neighbour info can also be trimmed down to the rows/columns of the ABI
+fixed grid that it actually touches; see getWindowedNeighbourInfo().
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+import hashlib
+
+import numpy as np
+import pyresample as pr
+
+
+# Names of the neighbour info arrays, in the order that
+#   pr.kd_tree.get_neighbour_info returns them.  The distance array isn't
+#   needed for nearest neighbour resampling so it's not stored at all.
+pCoeffNames = ['valid_input_index', 'valid_output_index', 'index_array']
+
+# In-memory copy of anything we've already computed or loaded, keyed by
+#   the hash from neighbourKey() so a long running process never even
+#   has to touch the disk after the first frame
+_memCache = {}
+
+# Registry of target grids that have already been built, keyed by the
+#   (center lat, center lon, radius, resolution) that made them
+_geomRegistry = {}
+
+
+class TargetGeometry():
+    """
+    Class to hold the output grid and the things derived from it that
+    every frame needs, so they're only calculated once
+    """
+    def __init__(self, area_def):
+        """
+        Usual init function; the cartopy CRS is made from 'area_def'
+        """
+        self.area_def = area_def
+
+        # Get the new projection/transformation info for the plot axes
+        self.crs = area_def.to_cartopy_crs()
+        self.bounds = self.crs.bounds
+
+
+def areaSignature(area):
+    """
+    Return a string that uniquely describes the given AreaDefinition;
+    any real change in the projection parameters, extents, or shape
+    will result in a different string.
+    """
+    extents = ",".join(["%.6f" % (each) for each in area.area_extent])
+    sig = "%s|%s|%dx%d" % (area.proj_str, extents,
+                           area.shape[0], area.shape[1])
+
+    return sig
+
+
+def targetBox(clat, clon, radius=200.):
+    """
+    Return the (lonMin, lonMax, latMin, latMax) of the box centered on
+    clat, clon that shows an approximate radius of 'radius' statute miles
+    """
+    # Zoomed in portion around the DCT, showing an approximate radius
+    #   of 'desiredRadius' statute miles.
+    # To do this right it's easier to think in terms of nautical miles;
+    #   See https://github.com/LowellObservatory/Camelot/issues/5 for the math.
+
+    # In *statute miles* since they're easier to measure (from Google Maps)
+    desiredRadius = radius
+
+    # Now it's in nautical miles so we just continue
+    dRnm = desiredRadius/1.1507794
+    latWid = dRnm/60.
+    lonWid = dRnm/(np.cos(np.deg2rad(clat))*60.)
+
+    # Small fudge factor to make the aspect a little closer to 1:1
+    latWid += 0.093
+
+    lonMin = clon - lonWid
+    lonMax = clon + lonWid
+    latMin = clat - latWid
+    latMax = clat + latWid
+
+    return lonMin, lonMax, latMin, latMax
+
+
+def makeTargetArea(clat, clon, radius=200., gridRes=18./60./60.):
+    """
+    Construct the LCC output grid centered on clat, clon that's big enough
+    to show an approximate radius of 'radius' statute miles.
+
+    This is the slow way that makes full lat/lon arrays at 'gridRes'
+    resolution, so it should only be called via getTargetGeometry()!
+    """
+    lonMin, lonMax, latMin, latMax = targetBox(clat, clon, radius=radius)
+    print(latMax - clat, lonMax - clon)
+
+    # Create a grid at at the specified resolution; original default was
+    #   0.005 degrees or 18 arcseconds resolution, though I don't remember why
+    lats = np.arange(latMin, latMax, gridRes)
+    lons = np.arange(lonMin, lonMax, gridRes)
+    lons, lats = np.meshgrid(lons, lats)
+
+    swath_def = pr.geometry.SwathDefinition(lons=lons, lats=lats)
+
+    # LCC is Lambert conformal conic projection
+    area_def = swath_def.compute_optimal_bb_area({'proj': 'lcc',
+                                                  'lon_0': clon,
+                                                  'lat_0': clat,
+                                                  'lat_1': clat,
+                                                  'lat_2': clat})
+
+    return area_def
+
+
+def getTargetGeometry(clat, clon, radius=200., gridRes=18./60./60.):
+    """
+    Return the TargetGeometry for the given center, radius (statute miles)
+    and resolution (degrees), building it only if it's never been seen.
+    The exact same object is handed back every time after that.
+    """
+    key = (clat, clon, radius, gridRes)
+
+    try:
+        geom = _geomRegistry[key]
+    except KeyError:
+        print("Constructing target grid...")
+        geom = TargetGeometry(makeTargetArea(clat, clon, radius=radius,
+                                             gridRes=gridRes))
+        _geomRegistry.update({key: geom})
+
+    return geom
+
+
+def neighbourKey(old_grid, area_def, radius):
+    """
+    Hash the source grid, target grid and radius of influence into a
+    short key that's suitable for use as a directory name.
+    """
+    sig = "%s||%s||%.3f" % (areaSignature(old_grid),
+                            areaSignature(area_def), radius)
+    key = hashlib.sha1(sig.encode("utf-8")).hexdigest()
+
+    return key
+
+
+def saveNeighbourInfo(cachedir, key, pCoeff, window=None):
+    """
+    Store the neighbour info arrays in their own directory, named 'key'.
+
+    Each one is written to a temporary name first and then renamed so
+    that another process can never see a partially written cache.
+    """
+    kdir = "%s/%s/" % (cachedir, key)
+    os.makedirs(kdir, exist_ok=True)
+
+    for i, name in enumerate(pCoeffNames):
+        fname = "%s/%s.npy" % (kdir, name)
+        tname = "%s.%d.tmp" % (fname, os.getpid())
+        # Need to use the file object here, otherwise np.save tacks on
+        #   an extra .npy to the temporary name
+        with open(tname, 'wb') as f:
+            np.save(f, np.asarray(pCoeff[i]))
+        os.replace(tname, fname)
+
+    # The window goes last, since its presence is what marks a windowed
+    #   set of neighbour info as complete
+    if window is not None:
+        fname = "%s/window.npy" % (kdir)
+        tname = "%s.%d.tmp" % (fname, os.getpid())
+        with open(tname, 'wb') as f:
+            np.save(f, np.asarray(window))
+        os.replace(tname, fname)
+
+    print("Neighbour info saved to %s" % (kdir))
+
+
+def loadNeighbourInfo(cachedir, key):
+    """
+    Memory map the neighbour info arrays back in; returns None if any of
+    them are missing or unreadable so they can just be recalculated.
+    """
+    kdir = "%s/%s/" % (cachedir, key)
+
+    pCoeff = []
+    for name in pCoeffNames:
+        fname = "%s/%s.npy" % (kdir, name)
+        try:
+            pCoeff.append(np.load(fname, mmap_mode='r'))
+        except (OSError, ValueError) as err:
+            # Missing entirely is the usual case, so be quiet about it
+            if os.path.exists(fname):
+                print(str(err))
+            return None
+
+    # Tack on a None where the distance array usually lives
+    pCoeff.append(None)
+
+    return tuple(pCoeff)
+
+
+def getNeighbourInfo(old_grid, area_def, radius, cachedir=None):
+    """
+    Return the neighbour info for the given source/target pair, in the
+    same order as pr.kd_tree.get_neighbour_info returns them.
+
+    Checks in memory first, then on disk (if 'cachedir' is given), and
+    only as a last resort actually does the kd-tree calculations.
+    """
+    key = neighbourKey(old_grid, area_def, radius)
+
+    try:
+        pCoeff = _memCache[key]
+        print("Reusing transformation coefficients!")
+        return pCoeff
+    except KeyError:
+        pass
+
+    pCoeff = None
+    if cachedir is not None:
+        pCoeff = loadNeighbourInfo(cachedir, key)
+        if pCoeff is not None:
+            print("Loaded transformation coefficients from %s/%s" %
+                  (cachedir, key))
+
+    if pCoeff is None:
+        # SC2000 FTW
+        print("Reticulating splines...")
+
+        # NOTE: On 20181120, when nprocs > 1 it never returned. Bug? Dunno.
+        # pCoeff: valid_input_index, valid_output_index,
+        #         index_array, distance_array
+        pCoeff = pr.kd_tree.get_neighbour_info(old_grid, area_def, radius,
+                                               neighbours=1, epsilon=0.,
+                                               nprocs=1)
+        if cachedir is not None:
+            saveNeighbourInfo(cachedir, key, pCoeff)
+
+    _memCache.update({key: pCoeff})
+
+    return pCoeff
+
+
+def windowNeighbourInfo(pCoeff, srcShape):
+    """
+    Figure out the smallest row/column window of the source grid (with
+    shape 'srcShape') that the neighbour info actually uses, and re-index
+    the neighbour info so it can be applied to just that window of data.
+
+    Returns the new neighbour info and the window as
+    (rowStart, rowEnd, colStart, colEnd), suitable for slicing directly.
+    If nothing at all is used, the window is None and the original
+    neighbour info is handed back untouched.
+    """
+    valid_input_index, valid_output_index, index_array = pCoeff[0:3]
+    nx = srcShape[1]
+
+    # Flat indices (into the full source grid) of every valid input pixel;
+    #   index_array points into this, and uses len(validSrc) to flag
+    #   output pixels that have no neighbour at all
+    validSrc = np.flatnonzero(valid_input_index)
+    nvalid = validSrc.size
+
+    hits = np.asarray(index_array)
+    hits = hits[hits < nvalid]
+    if hits.size == 0:
+        print("No source pixels used! Can't window the neighbour info.")
+        return pCoeff, None
+
+    # np.unique sorts too, which we rely on below
+    used = np.unique(validSrc[hits])
+    rows, cols = np.divmod(used, nx)
+
+    rowStart, rowEnd = rows.min(), rows.max() + 1
+    colStart, colEnd = cols.min(), cols.max() + 1
+    wny = rowEnd - rowStart
+    wnx = colEnd - colStart
+
+    # Only the pixels that are actually used are marked valid in the
+    #   window; they're in the same (row-major) order as in the full grid
+    #   so their new compressed index is just their rank
+    wflat = (rows - rowStart)*wnx + (cols - colStart)
+    new_input_index = np.zeros(wny*wnx, dtype=bool)
+    new_input_index[wflat] = True
+
+    # Lookup table from old compressed index to new compressed index,
+    #   with the "no neighbour" value mapping to the new "no neighbour" value
+    remap = np.full(nvalid + 1, used.size, dtype=np.int64)
+    remap[np.searchsorted(validSrc, used)] = np.arange(used.size)
+    new_index_array = remap[np.asarray(index_array)]
+
+    window = (int(rowStart), int(rowEnd), int(colStart), int(colEnd))
+    print("Source window: rows %d:%d, cols %d:%d (%d of %d pixels)" %
+          (rowStart, rowEnd, colStart, colEnd, wny*wnx,
+           valid_input_index.size))
+
+    newCoeff = (new_input_index, np.asarray(valid_output_index),
+                new_index_array, None)
+
+    return newCoeff, window
+
+
+def loadWindow(cachedir, key):
+    """
+    Load the window (see windowNeighbourInfo) stored alongside 'key'
+    """
+    fname = "%s/%s/window.npy" % (cachedir, key)
+    try:
+        window = tuple(int(each) for each in np.load(fname))
+    except (OSError, ValueError) as err:
+        if os.path.exists(fname):
+            print(str(err))
+        window = None
+
+    return window
+
+
+def getWindowedNeighbourInfo(old_grid, area_def, radius, cachedir=None):
+    """
+    Same as getNeighbourInfo, but the neighbour info is trimmed to only
+    the window of the source grid that's actually needed.
+
+    Returns (pCoeff, window); see windowNeighbourInfo for what the
+    window looks like.  The window is None if it couldn't be determined,
+    in which case pCoeff applies to the whole source grid.
+    """
+    key = "%s_win" % (neighbourKey(old_grid, area_def, radius))
+
+    try:
+        pCoeff, window = _memCache[key]
+        return pCoeff, window
+    except KeyError:
+        pass
+
+    pCoeff, window = None, None
+    if cachedir is not None:
+        window = loadWindow(cachedir, key)
+        if window is not None:
+            pCoeff = loadNeighbourInfo(cachedir, key)
+
+    if pCoeff is None:
+        fullCoeff = getNeighbourInfo(old_grid, area_def, radius,
+                                     cachedir=cachedir)
+        pCoeff, window = windowNeighbourInfo(fullCoeff, old_grid.shape)
+        if cachedir is not None and window is not None:
+            saveNeighbourInfo(cachedir, key, pCoeff, window=window)
+    else:
+        print("Loaded windowed transformation coefficients from %s/%s" %
+              (cachedir, key))
+
+    _memCache.update({key: (pCoeff, window)})
+
+    return pCoeff, window
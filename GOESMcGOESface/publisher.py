@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Publish the latest frames under static filenames for the web side.
+
+Each static name is a hard link to the actual plot, made in a staging
+directory and then moved into place with os.replace so anyone reading
+it always gets either the old frame or the new one, never half of one.
+Only the names whose frame actually changed are touched; that includes a
+frame that was re-rendered under the same name, since it's swapped in
+as a new file (see isCurrent).  If a hard link isn't possible (like
+across filesystems) it falls back to a copy, which still goes through
+the staging directory.
+
+A small JSON file listing the current frames and their timestamps is
+written alongside, the same way, for the front-end.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+import json
+from shutil import copyfile
+from datetime import datetime as dt
+
+
+def stageAndSwap(source, dest, stagedir):
+    """
+    Put 'source' at 'dest' atomically, via a hard link (or copy) made
+    in 'stagedir' which must be on the same filesystem as 'dest'
+    """
+    sname = "%s/%s.%d" % (stagedir, os.path.basename(dest), os.getpid())
+
+    # Leftovers from a previous crash would make os.link fail
+    if os.path.lexists(sname):
+        os.remove(sname)
+
+    try:
+        os.link(source, sname)
+    except OSError:
+        copyfile(source, sname)
+
+    os.replace(sname, dest)
+
+
+def isCurrent(source, dest):
+    """
+    True if 'dest' already has what's in 'source'; either it's a hard link
+    to it, or a copy that was made after it was last written
+    """
+    try:
+        sstat = os.stat(source)
+        dstat = os.stat(dest)
+    except OSError:
+        return False
+
+    if (sstat.st_dev, sstat.st_ino) == (dstat.st_dev, dstat.st_ino):
+        return True
+
+    return dstat.st_mtime >= sstat.st_mtime
+
+
+def loadState(jsonname):
+    """
+    Return the dict of static name -> source name from the last time,
+    or an empty one if it's not there
+    """
+    try:
+        with open(jsonname, 'r') as f:
+            info = json.load(f)
+        state = dict((each['file'], each['source'])
+                     for each in info['frames'])
+        state.update({info['latest']['file']: info['latest']['source']})
+    except FileNotFoundError:
+        state = {}
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        # Worst case everything just gets redone
+        print(str(err))
+        state = {}
+
+    return state
+
+
+def publishLatest(frames, lout, slotfmt, latestname, jsonname,
+                  nstaticfiles=48):
+    """
+    Publish the last 'nstaticfiles' of 'frames' (a time ordered list of
+    (png filename, timestamp string)) into 'lout' under the names
+    'slotfmt' % (0, 1, ...), oldest first, and the very last one under
+    'latestname' too.  'jsonname' is the JSON listing, also in 'lout'.
+
+    Returns the number of static names that were actually updated.
+    """
+    if frames == []:
+        print("Nothing to publish!")
+        return 0
+
+    stagedir = "%s/.staging/" % (lout)
+    os.makedirs(stagedir, exist_ok=True)
+
+    jsonpath = "%s/%s" % (lout, jsonname)
+    previous = loadState(jsonpath)
+
+    frames = frames[-1*nstaticfiles:]
+    slots = [(slotfmt % (i), each[0]) for i, each in enumerate(frames)]
+    slots.append((latestname, frames[-1][0]))
+
+    nchanged = 0
+    for sname, source in slots:
+        dest = "%s/%s" % (lout, sname)
+        bsource = os.path.basename(source)
+        if previous.get(sname) == bsource and isCurrent(source, dest):
+            continue
+
+        try:
+            stageAndSwap(source, dest, stagedir)
+            nchanged += 1
+        except OSError as err:
+            print(str(err))
+            print("WHOOPSIE! PUBLISH OF %s FAILED" % (sname))
+            # Make sure it's tried again next time
+            bsource = None
+
+        previous.update({sname: bsource})
+
+    info = {'updated': dt.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'latest': {'file': latestname,
+                       'source': previous.get(latestname),
+                       'timestamp': frames[-1][1]},
+            'frames': [{'file': sname, 'source': previous.get(sname),
+                        'timestamp': each[1]}
+                       for (sname, _), each in zip(slots, frames)]}
+
+    tname = "%s/%s.%d" % (stagedir, jsonname, os.getpid())
+    with open(tname, 'w') as f:
+        json.dump(info, f, indent=1)
+    os.replace(tname, jsonpath)
+
+    print("Published %d frames; %d static names updated" %
+          (len(frames), nchanged))
+
+    return nchanged
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Read just the parts of a GOES netCDF file that we need, right from S3.
+
+The CMIPC files are netCDF4, which is really just chunked HDF5 underneath,
+and we only ever use a small window of CMI (see projCache) along with the
+metadata.  So rather than downloading the whole thing, the object is
+wrapped in a file-like object that does HTTP range requests and handed
+to h5py, which only reads the superblock, the object headers, the chunk
+index and then the chunks that actually cover the window we ask for.
+
+Small reads (all of the metadata) go through a little block cache so
+they don't each turn into a request of their own; the big ones (the
+actual data chunks) are fetched exactly as asked for.
+
+H5Dataset then makes it look enough like a netCDF4.Dataset (masking,
+scaling and all) that the rest of plotGOES doesn't know the difference.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import io
+
+import numpy as np
+import h5py
+
+import boto3
+from botocore import UNSIGNED
+from botocore.config import Config as BotoConfig
+
+
+# Client for the public buckets, made once per process since the render
+#   workers each need their own
+_clients = {}
+
+
+class RangeFile(io.RawIOBase):
+    """
+    Class to make a remote object look like a (read only, seekable) file,
+    where every read turns into a byte range request
+    """
+    def __init__(self, fetch, size, blocksize=65536, name=None):
+        """
+        'fetch(start, end)' returns the bytes from 'start' up to (but not
+        including) 'end', and 'size' is the total size of the object.
+
+        Reads smaller than 'blocksize' are done a whole (aligned) block at
+        a time and kept around, since the HDF5 metadata is lots of little
+        reads that are usually right next to each other.
+        """
+        io.RawIOBase.__init__(self)
+
+        self.fetch = fetch
+        self.size = size
+        self.blocksize = blocksize
+        self.name = name
+
+        self.pos = 0
+        self.blocks = {}
+
+        # Stats, so we know how much this actually saved
+        self.nrequests = 0
+        self.nbytes = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        else:
+            raise ValueError("Invalid whence (%s)" % (whence))
+
+        return self.pos
+
+    def getRange(self, start, end):
+        """
+        Actually go and get the bytes from 'start' up to 'end'
+        """
+        data = self.fetch(start, end)
+        self.nrequests += 1
+        self.nbytes += len(data)
+
+        return data
+
+    def getBlock(self, i):
+        """
+        Return block 'i', only fetching it if we don't have it already
+        """
+        try:
+            block = self.blocks[i]
+        except KeyError:
+            start = i*self.blocksize
+            end = min(start + self.blocksize, self.size)
+            block = self.getRange(start, end)
+            self.blocks.update({i: block})
+
+        return block
+
+    def readinto(self, buf):
+        """
+        Read up to len(buf) bytes into buf from the current position
+        """
+        mv = memoryview(buf).cast('B')
+        start = self.pos
+        end = min(start + len(mv), self.size)
+        if end <= start:
+            return 0
+
+        nread = end - start
+        if nread >= self.blocksize:
+            mv[:nread] = self.getRange(start, end)
+        else:
+            first = start // self.blocksize
+            last = (end - 1) // self.blocksize
+            data = b"".join([self.getBlock(i)
+                             for i in range(first, last + 1)])
+            offset = start - first*self.blocksize
+            mv[:nread] = data[offset:offset + nread]
+
+        self.pos = end
+
+        return nread
+
+
+def getClient(awszone='us-east-1'):
+    """
+    Return an anonymous S3 client for the public (NOAA) buckets
+    """
+    try:
+        s3 = _clients[awszone]
+    except KeyError:
+        s3 = boto3.client('s3', awszone,
+                          config=BotoConfig(signature_version=UNSIGNED))
+        _clients.update({awszone: s3})
+
+    return s3
+
+
+def openS3(s3, bucket, key, blocksize=65536):
+    """
+    Return a RangeFile for s3://bucket/key using the client 's3'
+    """
+    size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+
+    def fetch(start, end):
+        rng = "bytes=%d-%d" % (start, end - 1)
+        resp = s3.get_object(Bucket=bucket, Key=key, Range=rng)
+        return resp['Body'].read()
+
+    return RangeFile(fetch, size, blocksize=blocksize, name=key)
+
+
+def attrValue(val):
+    """
+    HDF5 hands back netCDF attributes as 1 element arrays or bytes;
+    turn them into what netCDF4 would have given us
+    """
+    if isinstance(val, bytes):
+        val = val.decode('utf-8')
+    elif isinstance(val, np.ndarray):
+        if val.dtype.kind in ['S', 'O']:
+            val = [each.decode('utf-8') if isinstance(each, bytes) else each
+                   for each in val.ravel()]
+            if len(val) == 1:
+                val = val[0]
+        elif val.size == 1:
+            val = val.ravel()[0]
+
+    return val
+
+
+class H5Variable():
+    """
+    Class to make an h5py dataset act like a netCDF4 variable, applying
+    _Unsigned, _FillValue, valid_range and scale_factor/add_offset the
+    same way netCDF4 does by default
+    """
+    def __init__(self, dset):
+        """
+        Usual init function
+        """
+        self.dset = dset
+        self.shape = dset.shape
+        self.attrs = dict((k, attrValue(v)) for k, v in dset.attrs.items())
+
+    def __getattr__(self, name):
+        # Only called if it's not a real attribute, so it's a netCDF one
+        try:
+            return self.__dict__['attrs'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, idx):
+        raw = np.asarray(self.dset[idx])
+
+        if self.attrs.get('_Unsigned', 'false') == 'true':
+            raw = raw.view(raw.dtype.str.replace('i', 'u'))
+
+        mask = np.zeros(raw.shape, dtype=bool)
+        if '_FillValue' in self.attrs:
+            fill = np.array(self.attrs['_FillValue']).astype(raw.dtype)
+            mask |= (raw == fill)
+        if 'valid_range' in self.attrs:
+            vmin, vmax = np.array(self.attrs['valid_range'],
+                                  dtype=raw.dtype)
+            mask |= (raw < vmin) | (raw > vmax)
+
+        data = raw
+        if 'scale_factor' in self.attrs:
+            data = data*self.attrs['scale_factor']
+        if 'add_offset' in self.attrs:
+            data = data + self.attrs['add_offset']
+
+        return np.ma.masked_array(data, mask=mask)
+
+
+class H5Dataset():
+    """
+    Class to make an h5py file act enough like a netCDF4.Dataset for
+    plotGOES; only reading is supported
+    """
+    def __init__(self, fobj):
+        """
+        'fobj' is anything h5py will take; usually a RangeFile
+        """
+        self.fobj = fobj
+        self.h5 = h5py.File(fobj, 'r')
+
+        self.attrs = dict((k, attrValue(v)) for k, v in self.h5.attrs.items())
+        self.variables = dict((k, H5Variable(v))
+                              for k, v in self.h5.items()
+                              if isinstance(v, h5py.Dataset))
+
+    def __getattr__(self, name):
+        # Only called if it's not a real attribute, so it's a netCDF one
+        try:
+            return self.__dict__['attrs'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, name):
+        return self.variables[name]
+
+    def close(self):
+        self.h5.close()
+        if isinstance(self.fobj, RangeFile):
+            print("Read %.2f of %.2f MB in %d requests" %
+                  (self.fobj.nbytes/1e6, self.fobj.size/1e6,
+                   self.fobj.nrequests))
+        self.fobj.close()
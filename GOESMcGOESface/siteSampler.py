@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Boil the GOES/NEXRAD fields down to numbers around each of our sites.
+
+Mostly we just want to know whether there's cloud or rain near the DCT,
+Anderson Mesa or Mars Hill, and that shouldn't mean looking at a PNG.
+So, straight from the same grid that gets plotted (the resampled GOES
+data, or the radar gates), the stats within a few radii of each site are
+calculated and sent to InfluxDB for the dashboards and alerts.
+
+Which pixels/gates are within each radius of each site only depends on
+the grid, so it's figured out once (see getSampler) and after that each
+frame is just a gather and a handful of reductions.  The same code is
+used by both GOESMcGOESface and RadarLove.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import calendar
+
+import numpy as np
+
+from ligmos import utils, workers
+
+
+# Same places as add_AZObs, as (lon, lat)
+azSites = {'MarsHill': (-111.664444, 35.202778),
+           'DCT': (-111.4223, 34.7443),
+           'AndersonMesa': (-111.535833, 35.096944),
+           'KPNO': (-111.5967, 31.9583),
+           'LBT': (-109.889064, 32.701308),
+           'MMT': (-110.885, 31.6883)}
+
+# Samplers that have already been made, by whatever key identifies their
+#   grid, so each process only ever makes them once
+_samplers = {}
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    """
+    Great circle distance (km) between the point(s) lon1, lat1 and
+    lon2, lat2, all in degrees; works on arrays too
+    """
+    lon1, lat1, lon2, lat2 = [np.deg2rad(each) for each in
+                              [lon1, lat1, lon2, lat2]]
+
+    a = (np.sin((lat2 - lat1)/2.)**2 +
+         np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2.)**2)
+
+    return 2.*6371.*np.arcsin(np.sqrt(a))
+
+
+class SiteSampler():
+    """
+    Class to hold which grid points are within each radius of each site,
+    and calculate the stats over them for any field on that grid
+    """
+    def __init__(self, lons, lats, sites=None, radii=(5., 25.),
+                 percentiles=(10, 50, 90)):
+        """
+        'lons' and 'lats' are the coordinates of each point of the grid,
+        'sites' is a dict of name: (lon, lat) (azSites if it's None) and
+        'radii' are in km.  Sites with nothing within a radius are left
+        out for that radius.
+        """
+        if sites is None:
+            sites = azSites
+
+        self.shape = np.shape(lons)
+        self.percentiles = percentiles
+
+        lons = np.ravel(lons)
+        lats = np.ravel(lats)
+        good = np.isfinite(lons) & np.isfinite(lats)
+
+        # (site, radius, flat indices of the points within it)
+        self.groups = []
+        for site in sorted(sites):
+            slon, slat = sites[site]
+
+            # Cheap box cut first so the trig is only done near the site
+            dlat = max(radii)/111.
+            dlon = dlat/np.cos(np.deg2rad(slat))
+            near = (good & (np.abs(lats - slat) < dlat) &
+                    (np.abs(lons - slon) < dlon))
+            near = np.flatnonzero(near)
+            dist = haversine(slon, slat, lons[near], lats[near])
+
+            for radius in radii:
+                idx = near[dist <= radius]
+                if idx.size > 0:
+                    self.groups.append((site, radius, idx))
+                else:
+                    print("No points within %.1f km of %s!" % (radius,
+                                                               site))
+
+        # All of them in one array, so each frame is just one gather
+        if self.groups != []:
+            self.allidx = np.concatenate([each[2] for each in self.groups])
+        else:
+            self.allidx = np.zeros(0, dtype=np.intp)
+        bounds = np.cumsum([0] + [each[2].size for each in self.groups])
+        self.slices = [slice(bounds[i], bounds[i+1])
+                       for i in range(len(self.groups))]
+
+    def sample(self, data):
+        """
+        Return a list of dicts, one per site and radius, with the stats of
+        the (masked) 'data' array (which has to be on our grid) in them.
+        Masked/non-finite points are ignored, but counted in 'frac'.
+        """
+        if np.shape(data) != self.shape:
+            raise ValueError("Data shape %s doesn't match the sampler's %s"
+                             % (np.shape(data), self.shape))
+
+        vals = np.ma.filled(np.ma.asarray(data, dtype=np.float64), np.nan)
+        vals = vals.ravel()[self.allidx]
+
+        samples = []
+        for (site, radius, idx), sl in zip(self.groups, self.slices):
+            each = vals[sl]
+            each = each[np.isfinite(each)]
+
+            fields = {'n': int(each.size), 'frac': each.size/idx.size}
+            if each.size > 0:
+                fields.update({'mean': float(each.mean()),
+                               'min': float(each.min()),
+                               'max': float(each.max())})
+                pcts = np.percentile(each, self.percentiles)
+                for pct, pval in zip(self.percentiles, pcts):
+                    fields.update({'p%02d' % (pct): float(pval)})
+
+            samples.append({'site': site, 'radius': radius,
+                            'fields': fields})
+
+        return samples
+
+
+def getSampler(key, makeCoords, sites=None, radii=(5., 25.)):
+    """
+    Return the SiteSampler for the grid identified by 'key', only making
+    it if we haven't already; 'makeCoords()' returns the (lons, lats) of
+    the grid and is only called in that case
+    """
+    fullkey = (key, tuple(sorted((sites or azSites).items())), tuple(radii))
+
+    try:
+        sampler = _samplers[fullkey]
+    except KeyError:
+        # Radar grids change a little from volume to volume, so don't let
+        #   them pile up forever
+        if len(_samplers) >= 32:
+            _samplers.clear()
+
+        lons, lats = makeCoords()
+        sampler = SiteSampler(lons, lats, sites=sites, radii=radii)
+        _samplers.update({fullkey: sampler})
+
+    return sampler
+
+
+def makePackets(samples, meas, ts, tags=None):
+    """
+    Turn the output of SiteSampler.sample into influx packets for the
+    measurement 'meas'; 'ts' is the (UTC) datetime of the data, and
+    'tags' is anything else to tag them all with (like the product)
+    """
+    # Has to be an int, in milliseconds; see Indigestion
+    tsms = calendar.timegm(ts.utctimetuple())*1000 + ts.microsecond//1000
+
+    packets = []
+    for each in samples:
+        ptags = {'site': each['site'], 'radius': "%g" % (each['radius'])}
+        if tags is not None:
+            ptags.update(tags)
+
+        pkt = utils.packetizer.makeInfluxPacket(meas=[meas],
+                                                tags=ptags,
+                                                fields=each['fields'],
+                                                ts=tsms)
+        packets.append(pkt[0])
+
+    return packets
+
+
+def connectDatabase(dbconfFile):
+    """
+    Connect to the influx database in the 'databaseSetup' section of
+    'dbconfFile'; returns the connection and the table name, or
+    (None, None) if there's no database to write to
+    """
+    try:
+        # Same as Indigestion; ignores the 'enabled' key but it's simple
+        dbc = utils.confparsers.rawParser(dbconfFile)
+        dbs = workers.confUtils.assignConf(dbc['databaseSetup'],
+                                           utils.classes.baseTarget,
+                                           backfill=True)
+    except (IOError, KeyError) as err:
+        print(str(err))
+        print("No database to write samples to!")
+        return None, None
+
+    database = utils.database.influxobj(host=dbs.host, port=dbs.port,
+                                        user=dbs.user, pw=dbs.password,
+                                        tablename=dbs.tablename,
+                                        connect=True)
+
+    return database, dbs.tablename
+
+
+def writePackets(database, table, packets):
+    """
+    One batched write of all of 'packets' (from one frame)
+    """
+    if database is None or packets == []:
+        return
+
+    try:
+        database.singleCommit(packets, table=table, timeprec='ms')
+    except Exception as err:
+        # TODO: Figure out the proper/specific exceptions to catch;
+        #   losing a few samples is better than stopping the pipeline
+        print(str(err))
+        print("WHOOPSIE! WRITE OF %d SAMPLES FAILED" % (len(packets)))
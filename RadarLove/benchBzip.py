@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Benchmark decompressing NEXRAD volumes in threads against one by one.
+
+Makes a fake Archive II volume (bzip2 records of Message 31 radials with
+reflectivity-ish data, about the size and compression ratio of a real
+one) so it runs anywhere; give it the path of a real volume to use that
+instead.  Compares:
+    - decompressing all of the records one after the other
+    - the same in 2, 4 and 8 threads (level2.flattenVolume)
+    - reading just the lowest sweep (level2.readLevel2), both ways
+Threads only help if there are cores to spare, so it says how many.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+import sys
+import bz2
+import time
+import struct
+
+import numpy as np
+
+import level2
+
+
+def fakeRadial(az, elnum, elev, ngates, rng):
+    """
+    One Message 31 radial (CTM and message headers included) with just
+    the volume and reflectivity blocks in it
+    """
+    # Smooth-ish storms on top of noise, mostly below threshold
+    gates = np.arange(ngates)
+    refl = (20. + 25.*np.sin(gates/80. + az/20.)**8 +
+            rng.standard_normal(ngates))
+    raw = np.clip((refl + 32.)*2. + 2., 0, 255).astype(np.uint8)
+    raw[refl < 25.] = 0
+
+    vol = level2.volHeader.pack(b'R', b'VOL', 44, 1, 0, 34.574, -111.198,
+                                2260, 30, 0., 0., 0., 0., 0., 35)
+    vol += b'\x00'*2
+    ref = level2.momentHeader.pack(b'D', b'REF', 0, ngates, 2125, 250,
+                                   0, 0, 0, 8, 2., 66.) + raw.tobytes()
+
+    nblocks = 2
+    ptr1 = level2.msg31Header.size + 4*nblocks
+    ptr2 = ptr1 + len(vol)
+    body = level2.msg31Header.pack(b'FAKE', 0, 18034, 0, az, 0, 0, 0, 1, 1,
+                                   elnum, 1, elev, 0, 0, nblocks)
+    body += struct.pack('>2L', ptr1, ptr2) + vol + ref
+
+    size = (level2.msgHeader.size + len(body) + 1)//2
+    body += b'\x00'*(2*size - level2.msgHeader.size - len(body))
+    head = level2.msgHeader.pack(size, 0, 31, 0, 18034, 0, 1, 1)
+
+    return b'\x00'*level2.ctmSize + head + body
+
+
+def fakeVolume(ncuts=14, nrays=720, ngates=1832, perRecord=120):
+    """
+    A whole fake volume, as the bytes of an Archive II file
+    """
+    rng = np.random.RandomState(42)
+    vhead = b'AR2V0006.001' + struct.pack('>LL', 18034, 0) + b'FAKE'
+
+    out = [vhead]
+    for cut in range(ncuts):
+        elev = 0.5 + 1.5*cut
+        radials = [fakeRadial(0.5*i, cut + 1, elev, ngates, rng)
+                   for i in range(nrays)]
+        for i in range(0, nrays, perRecord):
+            comp = bz2.compress(b''.join(radials[i:i + perRecord]))
+            out.append(struct.pack('>l', len(comp)) + comp)
+
+    return b''.join(out)
+
+
+def timeit(func, nreps=3):
+    """
+    Best of 'nreps' runs of func(), in seconds
+    """
+    best = None
+    for _ in range(nreps):
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        if best is None or dt < best:
+            best = dt
+
+    return best
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            raw = f.read()
+        print("Using %s" % (sys.argv[1]))
+    else:
+        print("Making a fake volume...")
+        raw = fakeVolume()
+
+    flat = level2.flattenVolume(None, memory=raw, nthreads=1)
+    print("%.1f MB compressed, %.1f MB decompressed; %d cores" %
+          (len(raw)/1e6, len(flat)/1e6, os.cpu_count()))
+
+    # Everything has to come out exactly the same either way
+    for nthreads in [2, 4, 8]:
+        same = level2.flattenVolume(None, memory=raw, nthreads=nthreads)
+        if same != flat:
+            print("MISMATCH with %d threads!" % (nthreads))
+
+    tseq = timeit(lambda: level2.flattenVolume(None, memory=raw,
+                                               nthreads=1))
+    print("\n%18s %9.1f ms" % ("whole, sequential", tseq*1e3))
+    for nthreads in [2, 4, 8]:
+        tpar = timeit(lambda: level2.flattenVolume(None, memory=raw,
+                                                   nthreads=nthreads))
+        print("%18s %9.1f ms  (%.2fx)" % ("whole, %d threads" % (nthreads),
+                                          tpar*1e3, tseq/tpar))
+
+    tseq = timeit(lambda: level2.readLevel2(None, memory=raw, nthreads=1))
+    tpar = timeit(lambda: level2.readLevel2(None, memory=raw, nthreads=4))
+    print("\n%18s %9.1f ms" % ("sweep 0, seq.", tseq*1e3))
+    print("%18s %9.1f ms  (%.2fx)" % ("sweep 0, 4 threads", tpar*1e3,
+                                      tseq/tpar))
@@ -17,10 +17,11 @@ from __future__ import division, print_function, absolute_import
 
 import os
 import glob
-from shutil import copyfile
 import configparser as conf
 from datetime import datetime as dt
 
+import publisher as pub
+
 
 def parseConfFile(filename):
     """
@@ -86,36 +87,26 @@ def clearOldFiles(inloc, fmask, now, maxage=24., dtfmt="%Y%j%H%M%S%f"):
 
 def copyStaticFilenames(nstaticfiles, lout, staticname, cpng):
     """
-    """
-    latestname = '%s/%s_latest.png' % (lout, staticname)
+    Publish the last 'nstaticfiles' of 'cpng' as staticname_000.png, ...
+    and staticname_latest.png, with a staticname_latest.json listing.
 
-    if cpng != []:
-        if len(cpng) < nstaticfiles:
-            lindex = len(cpng)
+    'cpng' is either a list of filenames or of (filename, timestamp);
+    see publisher.publishLatest for the details.
+    """
+    frames = []
+    for each in cpng:
+        if isinstance(each, str):
+            frames.append((each, None))
         else:
-            lindex = nstaticfiles
+            frames.append(tuple(each))
 
-        # It's easier to do this via reverse list indicies
-        icount = 0
-        for findex in range(-1*lindex, 0, 1):
-            try:
-                lname = "%s/%s_%03d.png" % (lout, staticname, icount)
-                icount += 1
-                copyfile(cpng[findex], lname)
-            except Exception as err:
-                # TODO: Figure out the proper/specific exception
-                print(str(err))
-                print("WHOOPSIE! COPY FAILED")
-
-        # Put the very last file in the last file slot
-        latest = cpng[-1]
-        try:
-            copyfile(latest, latestname)
-            print("Latest file copy done!")
-        except Exception as err:
-            # TODO: Figure out the proper/specific exception to catch
-            print(str(err))
-            print("WHOOPSIE! COPY FAILED")
+    nchanged = pub.publishLatest(frames, lout,
+                                 slotfmt=staticname + "_%03d.png",
+                                 latestname=staticname + "_latest.png",
+                                 jsonname=staticname + "_latest.json",
+                                 nstaticfiles=nstaticfiles)
+
+    return nchanged
 
 
 def checkOutDir(outdir):
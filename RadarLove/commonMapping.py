@@ -17,9 +17,10 @@ import numpy as np
 
 import cartopy.crs as ccrs
 import cartopy.feature as cfeat
-from cartopy.feature import sgeom
 import cartopy.io.shapereader as cshape
 
+import geomCache as gcache
+
 
 def set_plot_extent(clat, clon, radius=200., fudge=0.053):
     # Output grid centered on clat, clon
@@ -114,49 +115,21 @@ def add_map_features(ax, counties=None, roads=None):
     return ax
 
 
-def checkGeomDistance(centerPt, rec, centerRad):
-    """
+def parseCounties(shpfile, center=None, centerRad=7., cachedir=None):
     """
-    # Since the geometry coordinates are in lon/lat, the
-    #   corresponding 'dist' will be too; therefore we filter
-    #   based on a radius of N degrees from the center
-    # centerRad == 7 covers a big area so we'll roll with that
-    dist = rec.geometry.distance(centerPt)
-    if dist <= centerRad:
-        store = True
-    else:
-        store = False
-
-    return store
+    Return the county geometries within 'centerRad' degrees of 'center'
+    (lon, lat), or all of them if 'center' is None.
 
-
-def parseCounties(shpfile, center=None, centerRad=7.):
-    """
+    The lookups go through a spatial index, and if 'cachedir' is given the
+    results are cached there too; see geomCache.py.
     """
-    counties = cshape.Reader(shpfile)
-
-    # If we have coordinates of the center of the map, enable
-    #   spatial filtering of the roads to within some radius of center
-    spatialFilter = False
-    if center is not None:
-        spatialFilter = True
-        mapCenterPt = sgeom.Point(center[0], center[1])
-
-    clist = []
-    # A dict is far easier to interact with so make one
-    for rec in counties.records():
-        if spatialFilter is True:
-            store = checkGeomDistance(mapCenterPt, rec, centerRad)
-        else:
-            store = True
-
-        if store is True:
-            clist.append(rec.geometry)
+    clist = gcache.queryShapes(shpfile, center=center, radius=centerRad,
+                               cachedir=cachedir)
 
     return clist
 
 
-def parseRoads(rclasses, center=None, centerRad=7.):
+def parseRoads(rclasses, center=None, centerRad=7., cachedir=None):
     """
     See https://www.naturalearthdata.com/downloads/10m-cultural-vectors/roads/
     for field information; below is just a quick summary.
@@ -183,33 +156,13 @@ def parseRoads(rclasses, center=None, centerRad=7.):
                                category='cultural',
                                name='roads_north_america')
 
-    rdsrec = cshape.Reader(rds)
-
     # If we have coordinates of the center of the map, spatially filter
-    #   the roads down to just those w/in 500 miles of the center
-    spatialFilter = False
-    if center is not None:
-        spatialFilter = True
-        mapCenterPt = sgeom.Point(center[0], center[1])
-
-    rdict = {}
-    # A dict is far easier to interact with so make one
-    for rec in rdsrec.records():
-        for key in rclasses:
-            if rec.attributes['class'] == key:
-                if spatialFilter is True:
-                    store = checkGeomDistance(mapCenterPt, rec, centerRad)
-                else:
-                    store = True
-
-                if store is True:
-                    try:
-                        rdict[key].append(rec.geometry)
-                    except KeyError:
-                        # This means the key hasn't been created yet so make it
-                        #   and then fill it with the value.
-                        #   It should then work fine the next time
-                        rdict.update({key: [rec.geometry]})
+    #   the roads down to just those w/in centerRad degrees of the center.
+    #   The lookups go through a spatial index, and if 'cachedir' is given
+    #   the results are cached there too; see geomCache.py.
+    rdict = gcache.queryShapes(rds, center=center, radius=centerRad,
+                               field='class', values=rclasses,
+                               cachedir=cachedir)
 
     return rdict
 
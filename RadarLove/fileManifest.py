@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Keep track of the raw files, their timestamps and their plots.
+
+Rather than globbing the raw and PNG directories and parsing every
+filename every single cycle, each raw file is recorded (once!) in a small
+SQLite database along with its timestamp, the name of its PNG and whether
+that's been rendered yet.  Retention, what still needs plotting and the
+latest N frames are then all just indexed queries.
+
+If the database goes missing it's rebuilt from what's in the directories,
+and that same check is done once at startup so anything that happened
+while we weren't running gets picked up too.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+import sqlite3
+from datetime import datetime as dt
+from datetime import timedelta as td
+
+
+# Timestamps are stored as fixed width strings so they sort properly
+isofmt = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+class FileManifest():
+    """
+    Class to hold the connection to the manifest and query it
+    """
+    def __init__(self, dbfile, rawdir, pngdir, dtfmt="%Y%j%H%M%S%f",
+                 splitchar="_", rawext=None, pngext=".png"):
+        """
+        The timestamp of each raw file is parsed from its basename using
+        'dtfmt'; if 'splitchar' is given, only the part of the basename
+        before the first 'splitchar' is used.
+
+        'rawext' limits the raw files to those ending in it (like '.nc'),
+        and the PNG for a raw file is its basename + 'pngext'.
+
+        The connection can be used from a thread other than the one that
+        made it (like the publish stage of the pipeline) but only by one
+        thread at a time.
+        """
+        self.dbfile = dbfile
+        self.rawdir = rawdir
+        self.pngdir = pngdir
+        self.dtfmt = dtfmt
+        self.splitchar = splitchar
+        self.rawext = rawext
+        self.pngext = pngext
+
+        os.makedirs(os.path.dirname(os.path.abspath(dbfile)), exist_ok=True)
+
+        self.db = None
+        try:
+            self.connect()
+        except sqlite3.DatabaseError as err:
+            # It's only an index of what's on disk, so just start over
+            print(str(err))
+            print("Manifest unreadable! Rebuilding it.")
+            if self.db is not None:
+                self.db.close()
+            os.remove(dbfile)
+            self.connect()
+
+        self.sync()
+
+    def connect(self):
+        """
+        Open the database, making the table and indices if needed
+        """
+        self.db = sqlite3.connect(self.dbfile, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS frames ("
+                        "raw TEXT PRIMARY KEY, "
+                        "ts TEXT NOT NULL, "
+                        "png TEXT NOT NULL, "
+                        "status TEXT NOT NULL DEFAULT 'pending')")
+        self.db.execute("CREATE INDEX IF NOT EXISTS frames_ts "
+                        "ON frames (ts)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS frames_status "
+                        "ON frames (status, ts)")
+        self.db.commit()
+
+    def parseTimestamp(self, fname):
+        """
+        Pull the timestamp out of the filename as an 'isofmt' string;
+        returns None if it can't be parsed
+        """
+        beach = os.path.basename(fname)
+        if self.splitchar is not None:
+            beach = beach.split(self.splitchar)[0]
+
+        try:
+            ts = dt.strptime(beach, self.dtfmt).strftime(isofmt)
+        except ValueError as err:
+            print(str(err))
+            ts = None
+
+        return ts
+
+    def pngPath(self, fname):
+        """
+        Return the full path of the plot for raw file 'fname'
+        """
+        return "%s/%s%s" % (self.pngdir, os.path.basename(fname), self.pngext)
+
+    def addRaws(self, fnames):
+        """
+        Record new raw files; ones we already know about are left alone.
+        Returns the number actually added.
+        """
+        rows = []
+        for each in fnames:
+            raw = os.path.basename(each)
+            if self.rawext is not None and not raw.endswith(self.rawext):
+                continue
+            ts = self.parseTimestamp(raw)
+            if ts is not None:
+                rows.append((raw, ts, raw + self.pngext))
+
+        cur = self.db.executemany("INSERT OR IGNORE INTO frames "
+                                  "(raw, ts, png) VALUES (?, ?, ?)", rows)
+        self.db.commit()
+
+        return cur.rowcount
+
+    def sync(self):
+        """
+        Make the manifest match what's actually in the directories; only
+        filenames we haven't seen before are parsed.  This is how it's
+        rebuilt from scratch if it went missing.
+
+        A raw file counts as being there if either it or its plot is.
+        """
+        known = set(each[0] for each in
+                    self.db.execute("SELECT raw FROM frames"))
+
+        try:
+            ondisk = set(os.listdir(self.rawdir))
+        except FileNotFoundError:
+            ondisk = set()
+
+        try:
+            pngs = set(os.listdir(self.pngdir))
+        except FileNotFoundError:
+            pngs = set()
+
+        # Raw files that were only ever in memory (see the loopers) are
+        #   still around as far as we're concerned if their plot is
+        plotted = set(each[:-len(self.pngext)] for each in pngs
+                      if each.endswith(self.pngext))
+        ondisk |= plotted
+
+        nadded = self.addRaws(ondisk - known)
+
+        gone = [(each,) for each in known - ondisk]
+        self.db.executemany("DELETE FROM frames WHERE raw = ?", gone)
+
+        # Anything whose plot is already there doesn't need doing again;
+        #   anything that was marked done but whose plot vanished does
+        rows = self.db.execute("SELECT raw, png, status FROM frames")
+        done, redo = [], []
+        for raw, png, status in rows.fetchall():
+            if png in pngs and status != 'done':
+                done.append((raw,))
+            elif png not in pngs and status == 'done':
+                redo.append((raw,))
+        self.db.executemany("UPDATE frames SET status = 'done' "
+                            "WHERE raw = ?", done)
+        self.db.executemany("UPDATE frames SET status = 'pending' "
+                            "WHERE raw = ?", redo)
+        self.db.commit()
+
+        print("Manifest synced: %d new, %d gone, %d already plotted" %
+              (nadded, len(gone), len(done)))
+
+    def pending(self, everything=False):
+        """
+        Return a list of (raw filename, png filename) that still need to be
+        plotted, oldest first; 'everything' returns all of them regardless
+        """
+        if everything is True:
+            query = "SELECT raw, png FROM frames ORDER BY ts"
+        else:
+            query = ("SELECT raw, png FROM frames "
+                     "WHERE status != 'done' ORDER BY ts")
+
+        todo = [("%s/%s" % (self.rawdir, raw), "%s/%s" % (self.pngdir, png))
+                for raw, png in self.db.execute(query)]
+
+        return todo
+
+    def markRendered(self, fname, ok=True):
+        """
+        Record whether the plot of raw file 'fname' worked ('done') or
+        not ('failed'); failed ones are still handed out by pending()
+        """
+        status = 'done' if ok is True else 'failed'
+        self.db.execute("UPDATE frames SET status = ? WHERE raw = ?",
+                        (status, os.path.basename(fname)))
+        self.db.commit()
+
+    def expire(self, now, maxage=24.):
+        """
+        Delete the raw files and plots that are more than 'maxage' hours
+        older than 'now', and forget about them.  Returns how many were
+        removed.
+        """
+        cutoff = (now - td(hours=maxage)).strftime(isofmt)
+
+        rows = self.db.execute("SELECT raw, png, ts FROM frames "
+                               "WHERE ts < ?", (cutoff,)).fetchall()
+        for raw, png, ts in rows:
+            print("Deleting %s since it's too old (%s)" % (raw, ts))
+            for fname in ["%s/%s" % (self.rawdir, raw),
+                          "%s/%s" % (self.pngdir, png)]:
+                try:
+                    os.remove(fname)
+                except FileNotFoundError:
+                    pass
+                except OSError as err:
+                    # At least see what the issue was
+                    print(str(err))
+
+        self.db.execute("DELETE FROM frames WHERE ts < ?", (cutoff,))
+        self.db.commit()
+
+        return len(rows)
+
+    def rendered(self, latest=None, withts=False):
+        """
+        Return the full paths of the plots that are done, oldest first;
+        if 'latest' is given only that many of the newest are returned.
+        If 'withts' is True, each is a (path, timestamp string) instead.
+        """
+        if latest is None:
+            rows = self.db.execute("SELECT png, ts FROM frames "
+                                   "WHERE status = 'done' ORDER BY ts")
+            rows = rows.fetchall()
+        else:
+            rows = self.db.execute("SELECT png, ts FROM frames "
+                                   "WHERE status = 'done' "
+                                   "ORDER BY ts DESC LIMIT ?", (latest,))
+            rows = rows.fetchall()[::-1]
+
+        if withts is True:
+            pngs = [("%s/%s" % (self.pngdir, png), ts) for png, ts in rows]
+        else:
+            pngs = ["%s/%s" % (self.pngdir, png) for png, _ in rows]
+
+        return pngs
+
+    def counts(self):
+        """
+        Return the number of raw files and finished plots in the manifest
+        """
+        nraw = self.db.execute("SELECT COUNT(*) FROM frames").fetchone()[0]
+        npng = self.db.execute("SELECT COUNT(*) FROM frames "
+                               "WHERE status = 'done'").fetchone()[0]
+
+        return nraw, npng
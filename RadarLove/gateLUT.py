@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Put a radar sweep onto our map raster with a precomputed lookup table.
+
+Drawing a sweep with Py-ART figures out the lat/lon of every gate of every
+ray and then draws a pcolormesh of all of them, every single frame.  But
+the radar doesn't move, and which gate lands in which pixel of the map
+only depends on the elevation, the gate spacing, how finely the rays are
+spaced in azimuth, and the map itself.  So that's worked out once (per
+site and gate layout) for every pixel of the map axes, as an azimuth bin
+and gate index, and cached on disk.
+
+Each volume then only needs to say which of its rays is closest to each
+azimuth bin, since each one starts wherever the antenna happened to be;
+after that it's one gather to get the whole map raster, which can go
+straight through a mapLayers.ColorLUT.
+
+A whole volume goes the same way, with a table per elevation; see
+volumeProducts.py.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+import hashlib
+
+import numpy as np
+
+import cartopy.crs as ccrs
+import matplotlib.pyplot as plt
+
+import mapLayers as mlayers
+
+
+# In-memory copy of anything we've already computed or loaded
+_lutCache = {}
+
+# 4/3 Earth radius (m), for the standard beam height model (same as
+#   Py-ART's antenna_to_cartesian)
+effRadius = 4./3.*6371.*1000.
+
+
+class GateLUT():
+    """
+    Class to hold the azimuth bin and gate of each pixel of the map axes
+    for one radar site, elevation and gate layout; -1 where the radar
+    doesn't reach
+    """
+    def __init__(self, binIdx, gateIdx, nbins):
+        self.binIdx = binIdx
+        self.gateIdx = gateIdx
+        self.nbins = nbins
+        self.shape = binIdx.shape
+
+
+def azimuthBins(nrays):
+    """
+    Number of azimuth bins for a sweep of 'nrays' rays; the nearest of
+    the usual 0.5 or 1 degree spacings
+    """
+    if nrays > 540:
+        return 720
+    else:
+        return 360
+
+
+def slantRange(ground, elevation):
+    """
+    Slant range (m) along a beam at 'elevation' (degrees) to the gate that's
+    'ground' (m) along the ground from the radar; see antenna_to_cartesian
+    in Py-ART for the forward version.  NaN past where the beam goes.
+    """
+    theta = np.asarray(ground)/effRadius
+    elev = np.deg2rad(elevation)
+    denom = np.cos(elev) - np.sin(elev)*np.tan(theta)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        srange = np.where(denom > 0, effRadius*np.tan(theta)/denom, np.nan)
+
+    return srange
+
+
+def groundDistance(siteLat, siteLon, crs, xs, ys):
+    """
+    Distance (m) and azimuth (degrees) along the ground from the radar to
+    each of the points 'xs', 'ys' (in 'crs' coordinates)
+    """
+    aeqd = ccrs.AzimuthalEquidistant(central_longitude=siteLon,
+                                     central_latitude=siteLat)
+    pts = aeqd.transform_points(crs, np.asarray(xs), np.asarray(ys))
+    gx, gy = pts[..., 0], pts[..., 1]
+
+    return np.hypot(gx, gy), np.rad2deg(np.arctan2(gx, gy)) % 360.
+
+
+def axesLimits(crs, extent):
+    """
+    The (x0, x1, y0, y1) limits, in 'crs' coordinates, of the map axes
+    with the lon/lat 'extent' (lonMin, lonMax, latMin, latMax); made the
+    same way as the static layers so the two line up exactly
+    """
+    fig, ax = mlayers.makeMapAxes(crs, extent, (7., 7.), 100,
+                                  extentcrs=ccrs.PlateCarree())
+    x0, x1 = ax.get_xlim()
+    y0, y1 = ax.get_ylim()
+    plt.close(fig)
+
+    return x0, x1, y0, y1
+
+
+def lutKey(site, siteLat, siteLon, elevation, first, spacing, ngates,
+           nbins, crs, extent, shape):
+    """
+    Hash everything that decides which gate goes in which pixel into a
+    short key that's suitable for use as a file name
+    """
+    ext = ",".join(["%.6f" % (each) for each in extent])
+    sig = "%s|%.4f|%.4f|%.1f|%.1f|%.1f|%d|%d|%s|%s|%dx%d" % (
+        site, siteLat, siteLon, elevation, first, spacing, ngates, nbins,
+        crs.proj4_init, ext, shape[0], shape[1])
+    key = hashlib.sha1(sig.encode("utf-8")).hexdigest()
+
+    return key
+
+
+def makeGateLUT(siteLat, siteLon, elevation, first, spacing, ngates, nbins,
+                crs, extent, shape):
+    """
+    Actually work out the azimuth bin and gate for the center of each
+    pixel of a 'shape' (ny, nx) raster covering the map axes
+    """
+    x0, x1, y0, y1 = axesLimits(crs, extent)
+    ny, nx = shape
+
+    # Pixel centers; image rows start at the top
+    xs = x0 + (np.arange(nx) + 0.5)*(x1 - x0)/nx
+    ys = y1 - (np.arange(ny) + 0.5)*(y1 - y0)/ny
+    xs, ys = np.meshgrid(xs, ys)
+
+    # Distance and direction along the ground from the radar, then back
+    #   to slant range along the beam
+    ground, azi = groundDistance(siteLat, siteLon, crs, xs, ys)
+    srange = slantRange(ground, elevation)
+
+    # Same gate/wedge edges as a pcolormesh of the gate centers
+    gateIdx = np.floor((srange - (first - spacing/2.))/spacing)
+    binIdx = np.floor(azi*nbins/360.) % nbins
+
+    bad = ~np.isfinite(gateIdx) | (gateIdx < 0) | (gateIdx >= ngates)
+    gateIdx = np.where(bad, -1, gateIdx).astype(np.int32)
+    binIdx = np.where(bad, -1, binIdx).astype(np.int32)
+
+    return GateLUT(binIdx, gateIdx, nbins)
+
+
+def saveGateLUT(cachedir, key, glut):
+    """
+    Store the lookup table as a single (2, ny, nx) array named 'key'
+    """
+    os.makedirs(cachedir, exist_ok=True)
+    fname = "%s/gatelut_%s.npy" % (cachedir, key)
+    tname = "%s.%d.tmp" % (fname, os.getpid())
+    with open(tname, 'wb') as f:
+        np.save(f, np.stack([glut.binIdx, glut.gateIdx]))
+    os.replace(tname, fname)
+
+    print("Gate lookup table saved to %s" % (fname))
+
+
+def loadGateLUT(cachedir, key, nbins):
+    """
+    Load the lookup table back in; returns None if it's not there
+    """
+    fname = "%s/gatelut_%s.npy" % (cachedir, key)
+    try:
+        arr = np.load(fname)
+    except (OSError, ValueError) as err:
+        if os.path.exists(fname):
+            print(str(err))
+        return None
+
+    return GateLUT(arr[0], arr[1], nbins)
+
+
+def getGateLUT(site, siteLat, siteLon, elevation, ranges, nrays, crs,
+               extent, shape, cachedir=None):
+    """
+    Return the GateLUT for a sweep at 'elevation' (degrees) with gates at
+    'ranges' (m) and 'nrays' rays, onto a 'shape' raster of the map axes
+    of 'crs' with the lon/lat 'extent'.  Checks in memory first, then on
+    disk (if 'cachedir' is given), and only calculates it as a last resort.
+    """
+    # The elevation wobbles a little from volume to volume, but nowhere
+    #   near enough to matter
+    elevation = np.round(float(elevation), 1)
+    first = float(ranges[0])
+    spacing = float(ranges[1] - ranges[0])
+    ngates = len(ranges)
+    nbins = azimuthBins(nrays)
+
+    key = lutKey(site, siteLat, siteLon, elevation, first, spacing, ngates,
+                 nbins, crs, extent, shape)
+
+    try:
+        return _lutCache[key]
+    except KeyError:
+        pass
+
+    glut = None
+    if cachedir is not None:
+        glut = loadGateLUT(cachedir, key, nbins)
+
+    if glut is None:
+        print("Making the gate lookup table for %s at %.1f deg..." %
+              (site, elevation))
+        glut = makeGateLUT(siteLat, siteLon, elevation, first, spacing,
+                           ngates, nbins, crs, extent, shape)
+        if cachedir is not None:
+            saveGateLUT(cachedir, key, glut)
+
+    _lutCache.update({key: glut})
+
+    return glut
+
+
+def raysForBins(azimuth, nbins):
+    """
+    Index of the ray (in 'azimuth' degrees) nearest to the center of each
+    of the 'nbins' azimuth bins; -1 for any bin with no ray within a bin
+    width of it (like a sector that's missing radials)
+    """
+    order = np.argsort(azimuth)
+    saz = np.asarray(azimuth, dtype=np.float64)[order]
+    width = 360./nbins
+    centers = (np.arange(nbins) + 0.5)*width
+
+    # Nearest is either side of where it'd go, wrapping around north
+    pos = np.searchsorted(saz, centers)
+    lo = (pos - 1) % saz.size
+    hi = pos % saz.size
+    dlo = np.abs((centers - saz[lo] + 180.) % 360. - 180.)
+    dhi = np.abs((centers - saz[hi] + 180.) % 360. - 180.)
+    nearest = np.where(dlo <= dhi, lo, hi)
+    dist = np.minimum(dlo, dhi)
+
+    return np.where(dist <= width, order[nearest], -1)
+
+
+def sweepIndex(glut, azimuth, ngates):
+    """
+    Flat index into the (rays, gates) data of a sweep whose rays point at
+    'azimuth' for each pixel of the map raster; -1 where there's nothing
+    """
+    rays = raysForBins(azimuth, glut.nbins)
+    pixRays = np.where(glut.binIdx >= 0, rays[glut.binIdx], -1)
+    good = (pixRays >= 0) & (glut.gateIdx >= 0) & (glut.gateIdx < ngates)
+
+    return np.where(good, pixRays*ngates + glut.gateIdx, -1)
+
+
+def gridSweep(glut, data, azimuth):
+    """
+    Put the (rays, gates) masked 'data' of a sweep whose rays point at
+    'azimuth' onto the map raster; returns a masked float32 array
+    """
+    nrays, ngates = data.shape
+
+    # Everything that's off the radar points at one extra NaN on the end
+    flat = np.ma.filled(np.ma.asarray(data, dtype=np.float32), np.nan)
+    flat = np.append(flat.ravel(), np.float32(np.nan))
+
+    idx = sweepIndex(glut, azimuth, ngates)
+    vals = flat[np.where(idx >= 0, idx, flat.size - 1)]
+
+    return np.ma.masked_invalid(vals)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Spatially indexed (and cached) access to the map shapefiles.
+
+Each shapefile is only read once per process, into a GeometryStore that
+has a Shapely STRtree over all of its records so radius and bounding box
+queries only ever look at the handful of records that could match.
+
+The (filtered and simplified) results of a query are also pickled to disk,
+keyed on the source file and its modification time along with the query
+itself, so the next startup doesn't even need to read the shapefile.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+import pickle
+import hashlib
+
+from shapely import geometry as sgeom
+from shapely.strtree import STRtree
+
+import cartopy.io.shapereader as cshape
+
+
+# Stores that have already been built, keyed by (shapefile, field)
+_storeRegistry = {}
+
+
+class GeometryStore():
+    """
+    Class to hold all the geometries from a shapefile along with a
+    spatial index over them
+    """
+    def __init__(self, shpfile, field=None):
+        """
+        'field' is the name of a record attribute to keep alongside each
+        geometry (like 'class' for roads), so queries can select on it.
+        """
+        self.shpfile = shpfile
+        self.field = field
+
+        self.geoms = []
+        self.values = []
+        for rec in cshape.Reader(shpfile).records():
+            # Some records (especially in Natural Earth) have no geometry
+            if rec.geometry is None:
+                continue
+            self.geoms.append(rec.geometry)
+            if field is not None:
+                self.values.append(rec.attributes[field])
+            else:
+                self.values.append(None)
+
+        self.tree = STRtree(self.geoms)
+
+        # Older versions of shapely hand back geometries from queries rather
+        #   than indices, so keep a way to get from one to the other
+        self.ids = dict((id(geom), i) for i, geom in enumerate(self.geoms))
+
+    def candidates(self, region):
+        """
+        Return the indices of all the geometries whose bounding boxes
+        intersect 'region'
+        """
+        hits = self.tree.query(region)
+        try:
+            idxs = [int(each) for each in hits]
+        except TypeError:
+            idxs = [self.ids[id(each)] for each in hits]
+
+        return idxs
+
+    def query(self, center=None, radius=7., bbox=None, values=None):
+        """
+        Return the (sorted) indices of the geometries that are within
+        'radius' of 'center' (lon, lat), or that intersect 'bbox'
+        (lonMin, latMin, lonMax, latMax).  If neither is given, all of
+        them are candidates.  If 'values' is given, only the ones whose
+        'field' attribute is in 'values' are returned.
+
+        Since the geometries are in lon/lat, 'radius' is in degrees.
+        """
+        if center is not None:
+            centerPt = sgeom.Point(center[0], center[1])
+            region = centerPt.buffer(radius)
+            idxs = [i for i in self.candidates(region)
+                    if self.geoms[i].distance(centerPt) <= radius]
+        elif bbox is not None:
+            region = sgeom.box(*bbox)
+            idxs = [i for i in self.candidates(region)
+                    if self.geoms[i].intersects(region)]
+        else:
+            idxs = range(len(self.geoms))
+
+        if values is not None:
+            idxs = [i for i in idxs if self.values[i] in values]
+
+        return sorted(idxs)
+
+
+def getStore(shpfile, field=None):
+    """
+    Return the GeometryStore for 'shpfile', only reading it if needed
+    """
+    key = (os.path.abspath(shpfile), field)
+
+    try:
+        store = _storeRegistry[key]
+    except KeyError:
+        print("Indexing %s..." % (shpfile))
+        store = GeometryStore(shpfile, field=field)
+        _storeRegistry.update({key: store})
+
+    return store
+
+
+def queryKey(shpfile, center, radius, bbox, field, values, simplify):
+    """
+    Hash everything that determines the result of a query, including the
+    modification time of the source file, into a short key
+    """
+    sig = "%s|%.3f|%s|%s|%s|%s|%s|%s" % (os.path.abspath(shpfile),
+                                         os.path.getmtime(shpfile),
+                                         center, radius, bbox, field,
+                                         sorted(values or []), simplify)
+    key = hashlib.sha1(sig.encode("utf-8")).hexdigest()
+
+    return key
+
+
+def queryShapes(shpfile, center=None, radius=7., bbox=None, field=None,
+                values=None, simplify=0.001, cachedir=None):
+    """
+    Filter the geometries in 'shpfile'; see GeometryStore.query for the
+    details.  'simplify' is the tolerance (degrees) that each geometry is
+    simplified to, or None to leave them alone.
+
+    If 'field' is None a list of geometries is returned; otherwise it's a
+    dict keyed by the values of 'field' that were actually found, with
+    lists of the corresponding geometries.
+
+    If 'cachedir' is given, the results are stored there and reused
+    as long as the query and the source file's modification time match.
+    """
+    if cachedir is not None:
+        key = queryKey(shpfile, center, radius, bbox, field, values,
+                       simplify)
+        fname = "%s/geoms_%s.pkl" % (cachedir, key)
+        try:
+            with open(fname, 'rb') as f:
+                result = pickle.load(f)
+            print("Loaded cached geometries from %s" % (fname))
+            return result
+        except FileNotFoundError:
+            pass
+        except (OSError, pickle.UnpicklingError, EOFError) as err:
+            print(str(err))
+
+    store = getStore(shpfile, field=field)
+    idxs = store.query(center=center, radius=radius, bbox=bbox,
+                       values=values)
+
+    if field is None:
+        result = []
+    else:
+        result = {}
+
+    for i in idxs:
+        geom = store.geoms[i]
+        if simplify is not None:
+            geom = geom.simplify(simplify, preserve_topology=True)
+
+        if field is None:
+            result.append(geom)
+        else:
+            try:
+                result[store.values[i]].append(geom)
+            except KeyError:
+                result.update({store.values[i]: [geom]})
+
+    if cachedir is not None:
+        os.makedirs(cachedir, exist_ok=True)
+        tname = "%s.%d.tmp" % (fname, os.getpid())
+        with open(tname, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tname, fname)
+
+    return result
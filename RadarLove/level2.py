@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Read just the lowest sweep(s) of a NEXRAD Level II volume.
+
+Py-ART's reader decompresses every record and decodes every moment of
+every tilt, but we only ever plot the reflectivity (and QC it with the
+ZDR and RhoHV) of the lowest one.  An Archive II file is a 24 byte
+volume header followed by bzip2 compressed records, each of which is a
+run of Message 31 radials (typically 120 of them) that are all from the
+same elevation cut, in the order they were scanned.  So this reads the
+records one at a time, decodes only the data blocks of the moments that
+were asked for, and stops as soon as it gets to a cut past the last one
+that's wanted; usually that's the first handful of records out of ~70.
+The products in volumeProducts.py need every tilt, but still only those
+three moments of each.
+
+The records are independent, so they can also be decompressed in
+parallel (see iterRecords); bz2 lets go of the GIL while it works, so
+threads are enough.  flattenVolume does that for a whole volume and hands
+back an uncompressed Archive II file, which Py-ART reads as-is.
+
+See the Interface Control Document for the RDA/RPG (ICD 2620002) for the
+message formats; plotNEXRAD.makeRadar wraps the result up as a Py-ART
+Radar for the plotting.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import io
+import bz2
+import gzip
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+from datetime import timedelta as td
+
+import numpy as np
+
+
+# Same field names that Py-ART gives each moment
+fieldNames = {'REF': 'reflectivity',
+              'VEL': 'velocity',
+              'SW': 'spectrum_width',
+              'ZDR': 'differential_reflectivity',
+              'PHI': 'differential_phase',
+              'RHO': 'cross_correlation_ratio',
+              'CFP': 'clutter_filter_power_removed'}
+
+# 12 byte CTM header, then the 16 byte message header
+ctmSize = 12
+msgHeader = struct.Struct('>HBBHHLHH')
+msgOffset = ctmSize + msgHeader.size
+
+# Everything but Message 31 comes in fixed size frames
+frameSize = 2432
+
+# Message 31 data header block; the block pointers follow it
+msg31Header = struct.Struct('>4sLHHfBBHBBBBfBBH')
+
+# Generic data moment block; the gates follow it
+momentHeader = struct.Struct('>c3sLHhhhhBBff')
+
+# Volume data constant block
+volHeader = struct.Struct('>c3sHBBffhHfffffH')
+
+
+class Level2Volume():
+    """
+    Class to hold the sweeps (and site info) read from a volume; each
+    sweep is a dict of 'number', 'azimuth', 'elevation', 'time' (seconds
+    since 'start') and 'range' (m, to the center of each gate) of each ray,
+    and 'moments' which has a masked float32 (rays, gates) array for each.
+    """
+    def __init__(self):
+        self.site = None
+        self.start = None
+        self.latitude = None
+        self.longitude = None
+        self.altitude = None
+        self.vcp = None
+        self.sweeps = []
+        self.nrecords = 0
+
+
+def splitRecords(f):
+    """
+    Yield the (still compressed) records of the open Archive II file 'f',
+    just past its volume header, without decompressing anything
+    """
+    while True:
+        ctrl = f.read(4)
+        if len(ctrl) < 4:
+            return
+
+        size = abs(struct.unpack('>l', ctrl)[0])
+        chunk = f.read(size)
+        if chunk[0:3] == b'BZh':
+            yield chunk
+        else:
+            # Really old (uncompressed) files don't have records at all,
+            #   it's just one long run of messages
+            yield ctrl + chunk + f.read()
+            return
+
+
+def decompress(chunk):
+    """
+    Decompress one record (if it actually is compressed)
+    """
+    if chunk[0:3] == b'BZh':
+        return bz2.decompress(chunk)
+    else:
+        return chunk
+
+
+def iterRecords(f, nthreads=1):
+    """
+    Yield the (decompressed) records of the open Archive II file 'f', just
+    past its volume header, in order; reading stops whenever the caller
+    does.  If 'nthreads' > 1 the next few records are decompressed in that
+    many threads while the current one is being used.
+    """
+    if nthreads <= 1:
+        for chunk in splitRecords(f):
+            yield decompress(chunk)
+        return
+
+    # Only keep one record per thread in flight, so stopping early (see
+    #   readLevel2) doesn't waste much
+    pool = ThreadPoolExecutor(max_workers=nthreads)
+    ahead = deque()
+    try:
+        for chunk in splitRecords(f):
+            ahead.append(pool.submit(decompress, chunk))
+            if len(ahead) >= nthreads:
+                yield ahead.popleft().result()
+        while len(ahead) > 0:
+            yield ahead.popleft().result()
+    finally:
+        for fut in ahead:
+            fut.cancel()
+        pool.shutdown(wait=True)
+
+
+def openVolume(filename, memory=None):
+    """
+    Open the Level II volume 'filename' (or its contents, 'memory') for
+    reading, taking care of any gzip on top; returns the file to read and
+    the underlying one to close when done
+    """
+    if memory is None:
+        rawf = open(filename, 'rb')
+    else:
+        rawf = io.BytesIO(memory)
+
+    # Some of the older ones are gzipped on top of everything else
+    magic = rawf.read(2)
+    rawf.seek(0)
+    if magic == b'\x1f\x8b':
+        f = gzip.GzipFile(fileobj=rawf)
+    else:
+        f = rawf
+
+    return f, rawf
+
+
+def flattenVolume(filename, memory=None, nthreads=4):
+    """
+    Decompress all of the records of 'filename' (or its contents,
+    'memory') in 'nthreads' threads, and return the volume header followed
+    by all of the messages; i.e. an uncompressed Archive II file
+    """
+    f, rawf = openVolume(filename, memory=memory)
+    try:
+        vhead = f.read(24)
+        recs = list(iterRecords(f, nthreads=nthreads))
+    finally:
+        rawf.close()
+
+    return vhead + b''.join(recs)
+
+
+def iterRadials(rec):
+    """
+    Yield the offset of the data header block of each Message 31 radial
+    in the record 'rec'
+    """
+    pos = 0
+    while pos + msgOffset <= len(rec):
+        size, _, mtype, _, _, _, _, _ = msgHeader.unpack_from(rec,
+                                                              pos + ctmSize)
+        if mtype == 31:
+            if size == 0:
+                return
+            yield pos + msgOffset
+            pos += ctmSize + 2*size
+        else:
+            pos += frameSize
+
+
+def readMoment(rec, ptr):
+    """
+    Unpack the generic data moment block at 'ptr'; returns its name, its
+    (raw) gates, and the scale, offset, first gate and gate spacing
+    """
+    (_, name, _, ngates, first, spacing, _, _, _, wsize,
+     scale, offset) = momentHeader.unpack_from(rec, ptr)
+
+    start = ptr + momentHeader.size
+    if wsize == 16:
+        gates = np.frombuffer(rec, dtype='>u2', count=ngates, offset=start)
+    else:
+        gates = np.frombuffer(rec, dtype='u1', count=ngates, offset=start)
+
+    return name.decode().strip(), gates, scale, offset, first, spacing
+
+
+def gateGrid(rays):
+    """
+    Common (first gate, spacing, number of gates) that covers all of the
+    moments of all of the 'rays' (see readMoment)
+    """
+    have = [mom[1:] for ray in rays for mom in ray['moments'].values()]
+    if have == []:
+        return 0., 1., 0
+
+    first = min(each[3] for each in have)
+    spacing = min(each[4] for each in have)
+    ngates = max(int(np.ceil((each[3] + each[0].size*each[4] - first) /
+                             spacing)) for each in have)
+
+    return first, spacing, ngates
+
+
+def stackMoment(rays, first, spacing, ngates):
+    """
+    Turn the per-ray (gates, scale, offset, first, spacing) of a moment
+    into a single masked float32 (rays, gates) array on the range grid
+    given by 'first', 'spacing' and 'ngates'; rays missing the moment and
+    raw values 0 (below threshold) and 1 (range folded) are masked, the
+    same as Py-ART
+    """
+    have = [each for each in rays if each is not None]
+    scale, offset = have[0][1], have[0][2]
+
+    raw = np.ones((len(rays), ngates), dtype=np.uint16)
+    for i, each in enumerate(rays):
+        if each is None:
+            continue
+        gates, _, _, gfirst, gspacing = each
+        if gfirst == first and gspacing == spacing:
+            raw[i, 0:gates.size] = gates
+        else:
+            # Nearest gate, for anything coarser than the rest
+            rng = first + spacing*np.arange(ngates)
+            idx = np.floor((rng - gfirst)/gspacing + 0.5).astype(np.intp)
+            ok = (idx >= 0) & (idx < gates.size)
+            raw[i, ok] = gates[idx[ok]]
+
+    data = (raw.astype(np.float32) - np.float32(offset))/np.float32(scale)
+
+    # Much quicker than masked_where, which copies it all over again
+    return np.ma.masked_array(data, mask=(raw <= 1))
+
+
+def readLevel2(filename, memory=None, sweeps=(0,),
+               moments=('REF', 'ZDR', 'RHO'), nthreads=1):
+    """
+    Read only 'moments' of 'sweeps' from the Level II volume 'filename';
+    if 'memory' is given it's the actual contents of the file (as bytes)
+    and 'filename' is just used as its name.
+
+    'sweeps' are numbered the same as Py-ART, so 0 is the first (lowest)
+    cut in the volume; None reads all of them.  'nthreads' > 1
+    decompresses the records in parallel; see iterRecords.
+    Returns a Level2Volume.
+    """
+    f, rawf = openVolume(filename, memory=memory)
+    try:
+        vol = Level2Volume()
+        vhead = f.read(24)
+        vol.site = vhead[20:24].decode()
+        jdate, msecs = struct.unpack('>LL', vhead[12:20])
+        # Whole seconds, same as Py-ART, since that's all its units show
+        vol.start = dt(1969, 12, 31) + td(days=jdate, seconds=msecs//1000)
+
+        if sweeps is None:
+            lastSweep = None
+        else:
+            lastSweep = max(sweeps)
+
+        # Elevation numbers of the cuts as they're seen; a cut's sweep
+        #   number is just its place in that list
+        cuts = []
+        radials = {}
+        done = False
+        recs = iterRecords(f, nthreads=nthreads)
+        for rec in recs:
+            vol.nrecords += 1
+            for ptr in iterRadials(rec):
+                hdr = msg31Header.unpack_from(rec, ptr)
+                elnum = hdr[10]
+                if elnum not in cuts:
+                    cuts.append(elnum)
+                sweep = cuts.index(elnum)
+                if lastSweep is not None:
+                    if sweep > lastSweep:
+                        done = True
+                        break
+                    if sweep not in sweeps:
+                        continue
+
+                nblocks = hdr[15]
+                ptrs = struct.unpack_from('>%dL' % (nblocks), rec,
+                                          ptr + msg31Header.size)
+
+                ray = {'azimuth': hdr[4], 'elevation': hdr[12],
+                       'date': hdr[2], 'msecs': hdr[1], 'moments': {}}
+                for bptr in ptrs:
+                    btype = rec[ptr + bptr:ptr + bptr + 4]
+                    if btype == b'RVOL' and vol.vcp is None:
+                        vblk = volHeader.unpack_from(rec, ptr + bptr)
+                        vol.latitude, vol.longitude = vblk[5], vblk[6]
+                        vol.altitude = vblk[7] + vblk[8]
+                        vol.vcp = vblk[14]
+                    elif btype[0:1] == b'D':
+                        name = btype[1:4].decode().strip()
+                        if name in moments:
+                            mom = readMoment(rec, ptr + bptr)
+                            ray['moments'].update({name: mom})
+
+                radials.setdefault(sweep, []).append(ray)
+            if done is True:
+                break
+        recs.close()
+    finally:
+        rawf.close()
+
+    for sweep in sorted(radials):
+        rays = radials[sweep]
+        times = [(dt(1969, 12, 31) +
+                  td(days=each['date'], milliseconds=each['msecs']) -
+                  vol.start).total_seconds() for each in rays]
+
+        first, spacing, ngates = gateGrid(rays)
+        rng = first + spacing*np.arange(ngates, dtype=np.float32)
+        moms = {}
+        for name in moments:
+            per = [each['moments'][name][1:]
+                   if name in each['moments'] else None for each in rays]
+            if any(each is not None for each in per):
+                moms.update({name: stackMoment(per, first, spacing,
+                                               ngates)})
+
+        vol.sweeps.append({'number': sweep,
+                           'azimuth': np.array([each['azimuth']
+                                                for each in rays],
+                                               dtype=np.float32),
+                           'elevation': np.array([each['elevation']
+                                                  for each in rays],
+                                                 dtype=np.float32),
+                           'time': np.array(times, dtype=np.float64),
+                           'range': rng,
+                           'moments': moms})
+
+    return vol
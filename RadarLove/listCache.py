@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Remember what we've already seen in an S3 bucket, per key prefix.
+
+Each prefix gets a high-water mark (the last key seen) so the next listing
+can use StartAfter and only get the new stuff, and prefixes that can't
+possibly get any new objects (because their hour/day is over) are marked
+complete so they're never listed again.  The state is kept in a small
+JSON file so it survives restarts.
+
+NOTE: StartAfter is lexicographic, so this only works right if new objects
+under a given prefix always sort after the old ones!  Make the prefixes
+specific enough that that's true.
+
+If that would take a bunch of different prefixes (like one per GOES scan
+mode and channel, which come before the timestamp) a single broader
+prefix can be given instead, with a 'groupkey' function that says which
+group each key is in (or None for ones we don't care about).  Each group
+gets its own high-water mark, and once all 'ngroups' of them have been
+seen each is listed on its own with StartAfter; that's a request per
+group rather than one for the whole prefix, but each only returns what's
+new.  Until then, and one last time when the prefix closes in case a
+group showed up late (like if the scan mode changed), the whole prefix
+is listed and filtered here instead.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+import json
+
+
+class ListingCache():
+    """
+    Class to hold the per-prefix listing state and do the actual listing
+    """
+    def __init__(self, statefile=None):
+        """
+        'statefile' is where the state is stored between runs; if it's None
+        it's only kept in memory.
+        """
+        self.statefile = statefile
+        self.prefixes = {}
+        self.nqueries = 0
+
+        if self.statefile is not None:
+            self.load()
+
+    def load(self):
+        """
+        Read the state back in from self.statefile, if it's there
+        """
+        try:
+            with open(self.statefile, 'r') as f:
+                self.prefixes = json.load(f)
+            print("Loaded listing state for %d prefixes" %
+                  (len(self.prefixes)))
+        except FileNotFoundError:
+            self.prefixes = {}
+        except (OSError, ValueError) as err:
+            # If it's garbage, it's cheap enough to just start over
+            print(str(err))
+            print("Listing state unreadable! Starting fresh.")
+            self.prefixes = {}
+
+    def save(self):
+        """
+        Write the state to self.statefile via a temporary file
+        """
+        if self.statefile is None:
+            return
+
+        sdir = os.path.dirname(os.path.abspath(self.statefile))
+        os.makedirs(sdir, exist_ok=True)
+
+        tname = "%s.%d.tmp" % (self.statefile, os.getpid())
+        with open(tname, 'w') as f:
+            json.dump(self.prefixes, f, indent=1, sort_keys=True)
+        os.replace(tname, self.statefile)
+
+    def getState(self, prefix):
+        """
+        Return the state dict for 'prefix', making a fresh one if needed
+        """
+        try:
+            state = self.prefixes[prefix]
+        except KeyError:
+            state = {'last': None, 'complete': False, 'pending': []}
+            self.prefixes.update({prefix: state})
+
+        return state
+
+    def listObjects(self, s3, bucket, prefix, startafter=None):
+        """
+        List everything under 'prefix', after 'startafter' if it's given
+        """
+        kwargs = {'Bucket': bucket, 'Prefix': prefix}
+        if startafter is not None:
+            kwargs.update({'StartAfter': startafter})
+
+        objs = []
+        pager = s3.get_paginator('list_objects_v2')
+        for page in pager.paginate(**kwargs):
+            self.nqueries += 1
+            objs += page.get('Contents', [])
+
+        return objs
+
+    def listNew(self, s3, bucket, prefix, closed=False, full=False,
+                groupkey=None, ngroups=None):
+        """
+        List only the objects under 'prefix' that are newer than the last
+        time we looked, along with any that were handed back via retry().
+
+        'closed' means that the time period covered by the prefix is over
+        and no new objects will show up; if the listing works, the prefix
+        is marked complete and will just return [] from now on.
+
+        'full' ignores the saved state and lists everything again.
+
+        'groupkey' is an optional function of a key that returns the group
+        it's in, and 'ngroups' how many of those there should be; see the
+        module docstring.  Each group has to be a prefix of its keys.
+
+        Returns a list of dicts that have (at least) a 'Key' entry.
+        """
+        state = self.getState(prefix)
+
+        if state['complete'] is True and full is False:
+            return []
+
+        if groupkey is None:
+            startafter = None
+            if full is False:
+                startafter = state['last']
+            newobjs = self.listObjects(s3, bucket, prefix, startafter)
+        else:
+            # Only the groups that are still wanted (since that can
+            #   change between runs)
+            lasts = state.setdefault('lasts', {})
+            known = sorted(group for group, last in lasts.items()
+                           if groupkey(last) is not None)
+            if (full is True or closed is True or ngroups is None or
+                    len(known) < ngroups):
+                objs = self.listObjects(s3, bucket, prefix)
+            else:
+                objs = []
+                for group in known:
+                    objs += self.listObjects(s3, bucket, group, lasts[group])
+
+            newobjs = []
+            for each in objs:
+                group = groupkey(each['Key'])
+                if group is None:
+                    continue
+                if full is True or each['Key'] > lasts.get(group, ''):
+                    newobjs.append(each)
+            for each in newobjs:
+                group = groupkey(each['Key'])
+                if each['Key'] > lasts.get(group, ''):
+                    lasts.update({group: each['Key']})
+
+        if newobjs != []:
+            lastkey = max([each['Key'] for each in newobjs])
+            if state['last'] is None or lastkey > state['last']:
+                state['last'] = lastkey
+
+        # Anything that didn't work out last time gets another shot
+        seen = set([each['Key'] for each in newobjs])
+        for key in state['pending']:
+            if key not in seen:
+                newobjs.append({'Key': key})
+        state['pending'] = []
+
+        if closed is True:
+            state['complete'] = True
+
+        return newobjs
+
+    def retry(self, prefix, key):
+        """
+        Hand 'key' back out again the next time 'prefix' is listed, even
+        though it's behind the high-water mark (like after a failed download)
+        """
+        state = self.getState(prefix)
+        if key not in state['pending']:
+            state['pending'].append(key)
+        state['complete'] = False
+
+    def prune(self, keep):
+        """
+        Forget about any prefixes that don't start with one of the strings
+        in 'keep', so the state doesn't grow forever
+        """
+        for prefix in list(self.prefixes.keys()):
+            if not any([prefix.startswith(each) for each in keep]):
+                del self.prefixes[prefix]
+
+
+def listPrefix(s3, bucket, prefix, listcache=None, closed=False,
+               full=False, groupkey=None, ngroups=None):
+    """
+    List everything under 'prefix', or just the new stuff if 'listcache'
+    (a ListingCache instance) is given; see ListingCache.listNew.
+    """
+    if listcache is None:
+        objs = []
+        pager = s3.get_paginator('list_objects_v2')
+        for page in pager.paginate(Bucket=bucket, Prefix=prefix):
+            objs += page.get('Contents', [])
+    else:
+        objs = listcache.listNew(s3, bucket, prefix, closed=closed,
+                                 full=full, groupkey=groupkey,
+                                 ngroups=ngroups)
+
+    return objs
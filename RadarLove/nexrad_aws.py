@@ -15,28 +15,53 @@ Requires AWS credentials in the awsCreds.conf file.
 
 from __future__ import division, print_function, absolute_import
 
+import io
+import os
 from os.path import basename
 from datetime import timedelta as td
 
 import boto3
 import botocore
+from botocore.config import Config as BotoConfig
 import numpy as np
 
 import common as com
+import listCache as lcache
 
 
-def NEXRADAWSgrab(aws_keyid, aws_secretkey, now, outdir,
-                  timedelta=6, forceDown=False):
+# AWS NEXRAD bucket location/name
+awsbucket = 'noaa-nexrad-level2'
+awszone = 'us-east-1'
+
+
+def getS3Client(aws_keyid, aws_secretkey, maxconns=10):
     """
-    AWS IAM user key
-    AWS IAM user secret key
-    Time query is relative to (usually datetime.datetime.utcnow)
-    Hours to query back from above
+    Make a single S3 client to share between all of the download threads;
+    'maxconns' should be at least the number of threads using it
     """
-    # AWS GOES bucket location/name
-    awsbucket = 'noaa-nexrad-level2'
-    awszone = 'us-east-1'
+    bcfg = BotoConfig(max_pool_connections=maxconns,
+                      retries={'max_attempts': 5})
+
+    s3 = boto3.client('s3', awszone,
+                      aws_access_key_id=aws_keyid,
+                      aws_secret_access_key=aws_secretkey,
+                      config=bcfg)
 
+    return s3
+
+
+def NEXRADAWSlist(s3, now, outdir, timedelta=6, forceDown=False,
+                  listcache=None):
+    """
+    Figure out what needs downloading, without actually downloading it.
+
+    's3' is a boto3 S3 client and the rest are the same as for
+    NEXRADAWSgrab.
+
+    Returns a list of (object dict, output filename, prefix) to go get,
+    and the list of daily prefixes that are still in the time window
+    (for ListingCache.prune).
+    """
     # Station ID that you want to download
     station = "KFSX"
 
@@ -48,8 +73,13 @@ def NEXRADAWSgrab(aws_keyid, aws_secretkey, now, outdir,
 
     # Construct the key prefixes between the oldest and the newest
     querybins = []
+    closedbins = []
     minmaxhour = []
 
+    # Seconds after the end of a day to keep looking in that day's
+    #   prefix, to account for the latency of the data showing up on AWS
+    lategrace = 900.
+
     # timedelta MUST be an int...
     timedelta = np.int(np.round(timedelta, decimals=0))
 
@@ -57,7 +87,8 @@ def NEXRADAWSgrab(aws_keyid, aws_secretkey, now, outdir,
     #   in the AWS bucket,
     for i in range(timedelta, -1, -1):
         delta = td(hours=i)
-        qdt = (now - delta).timetuple()
+        qdtime = now - delta
+        qdt = qdtime.timetuple()
 
         # Include the year so it works on 1/1 UT
         qyear = qdt.tm_year
@@ -66,33 +97,26 @@ def NEXRADAWSgrab(aws_keyid, aws_secretkey, now, outdir,
         qhour = qdt.tm_hour
 
         ckey = "%04d/%02d/%02d/%s" % (qyear, qmonth, qday, station)
+
+        # Once the day is over (plus a bit), nothing new will show up
+        dstart = qdtime.replace(hour=0, minute=0, second=0, microsecond=0)
+        closed = now > (dstart + td(days=1, seconds=lategrace))
         # Since we're hacking against the GOES version, lets just skip things
         #   if we just keep making the same string; GOES bucket was organized
         #   by hour, so that made more sense back then
         # (check against i==timedelta because we loop backwards)
         if i == timedelta:
             querybins.append(ckey)
+            closedbins.append(closed)
             minmaxhour.append(qhour)
         else:
             if ckey != querybins[-1]:
                 querybins.append(ckey)
+                closedbins.append(closed)
 
     minmaxhour.append(qhour)
 
-    s3 = boto3.resource('s3', awszone,
-                        aws_access_key_id=aws_keyid,
-                        aws_secret_access_key=aws_secretkey)
-
-    try:
-        buck = s3.Bucket(awsbucket)
-    except botocore.exceptions.ClientError as e:
-        # NOTE: Is this the correct exception?  No clue.
-        if e.response['Error']['Code'] == "404":
-            print("The object does not exist.")
-        else:
-            raise
-
-    matches = []
+    todo = []
     # Bit of a hack; for the first querybin, there's a hour limit that
     #   we won't want any data before because it'll be outside of our
     #   requested time range.  Ditto for the last bin, but it'll be
@@ -111,11 +135,15 @@ def NEXRADAWSgrab(aws_keyid, aws_secretkey, now, outdir,
 
         print("Querying:", qt)
         try:
-            todaydata = buck.objects.filter(Prefix=qt)
+            todaydata = lcache.listPrefix(s3.meta.client, awsbucket, qt,
+                                          listcache=listcache,
+                                          closed=closedbins[i],
+                                          full=forceDown)
 
             for objs in todaydata:
                 # Current filename
-                ckey = basename(objs.key)
+                okey = objs['Key']
+                ckey = basename(okey)
 
                 # print("Found %s" % (ckey))
 
@@ -160,20 +188,12 @@ def NEXRADAWSgrab(aws_keyid, aws_secretkey, now, outdir,
                     #   we already downloaded this file; if so, skip it.
                     boname = basename(oname)
                     if boname not in donelist:
-                        matches.append(objs)
-                        try:
-                            buck.download_file(objs.key, oname)
-                            print("Downloaded: %s" % (oname))
-                        except botocore.exceptions.ReadTimeoutError:
-                            print("DOWNLOAD FAILURE! ReadTimeoutError")
-                        except ConnectionError:
-                            print("DOWNLOAD FAILURE!")
-                            print("ConnectionError or subclass of it.")
+                        todo.append((objs, oname, qt))
                     else:
                         print(oname, "already downloaded!")
                         if forceDown is True:
                             print("Download forced.")
-                            buck.download_file(objs.key, oname)
+                            todo.append((objs, oname, qt))
 
         except botocore.exceptions.ClientError as e:
             if e.response['Error']['Code'] == "404":
@@ -183,4 +203,110 @@ def NEXRADAWSgrab(aws_keyid, aws_secretkey, now, outdir,
         except botocore.exceptions.EndpointConnectionError:
             print("QUERY FAILURE! EndpointConnectionError")
 
+    return todo, querybins
+
+
+def fetchObject(s3, bucket, key, oname):
+    """
+    Download a single object to 'oname', via a temporary name in the
+    same directory so nothing ever sees a partially written file.
+
+    Returns True if it worked.
+    """
+    tname = "%s.part" % (oname)
+    got = False
+    try:
+        s3.download_file(bucket, key, tname)
+        os.replace(tname, oname)
+        print("Downloaded: %s" % (oname))
+        got = True
+    except botocore.exceptions.ReadTimeoutError:
+        print("DOWNLOAD FAILURE! ReadTimeoutError")
+    except botocore.exceptions.ClientError as e:
+        print("DOWNLOAD FAILURE! %s" % (e.response['Error']['Code']))
+    except (OSError, botocore.exceptions.BotoCoreError) as err:
+        # Connection problems, and anything that went wrong part way
+        #   through the transfer (like the connection closing)
+        print("DOWNLOAD FAILURE! %s" % (str(err)))
+
+    # Don't leave turds around if it failed part way through
+    if got is False:
+        try:
+            os.remove(tname)
+        except OSError:
+            pass
+
+    return got
+
+
+def fetchBytes(s3, bucket, key):
+    """
+    Download a single object straight into memory, for when it's going to
+    be read right away and there's no need for it to go to disk first.
+
+    Returns the contents of the object, or None if it didn't work.
+    """
+    data = None
+    try:
+        buf = io.BytesIO()
+        s3.download_fileobj(bucket, key, buf)
+        data = buf.getvalue()
+        print("Downloaded: %s (to memory)" % (basename(key)))
+    except botocore.exceptions.ReadTimeoutError:
+        print("DOWNLOAD FAILURE! ReadTimeoutError")
+    except botocore.exceptions.ClientError as e:
+        print("DOWNLOAD FAILURE! %s" % (e.response['Error']['Code']))
+    except (OSError, botocore.exceptions.BotoCoreError) as err:
+        # Connection problems, and anything that went wrong part way
+        #   through the transfer (like the connection closing)
+        print("DOWNLOAD FAILURE! %s" % (str(err)))
+
+    return data
+
+
+def writeRaw(data, oname):
+    """
+    Write the (already downloaded) contents of an object to 'oname', via a
+    temporary name so nothing ever sees a partially written file
+    """
+    tname = "%s.part" % (oname)
+    with open(tname, 'wb') as f:
+        f.write(data)
+    os.replace(tname, oname)
+
+
+def NEXRADAWSgrab(aws_keyid, aws_secretkey, now, outdir,
+                  timedelta=6, forceDown=False, listcache=None):
+    """
+    AWS IAM user key
+    AWS IAM user secret key
+    Time query is relative to (usually datetime.datetime.utcnow)
+    Hours to query back from above
+
+    'listcache' is an optional listCache.ListingCache that keeps track of
+    what we've already seen, so only new objects are listed.
+
+    Returns the list of object dicts that were found; the ones that were
+    actually downloaded have a 'filename' entry too.
+    """
+    s3 = getS3Client(aws_keyid, aws_secretkey)
+
+    todo, querybins = NEXRADAWSlist(s3, now, outdir, timedelta=timedelta,
+                                    forceDown=forceDown, listcache=listcache)
+
+    matches = []
+    for objs, oname, qt in todo:
+        matches.append(objs)
+        if fetchObject(s3, awsbucket, objs['Key'], oname) is True:
+            objs.update({'filename': oname})
+        elif listcache is not None:
+            # Make sure it's tried again next time
+            listcache.retry(qt, objs['Key'])
+
+    if listcache is not None:
+        # Forget about anything that's fallen out of our time window
+        listcache.prune(querybins)
+        listcache.save()
+        print("%d listing queries made so far" % (listcache.nqueries))
+
     return matches
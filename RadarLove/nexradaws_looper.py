@@ -14,8 +14,11 @@
 from __future__ import division, print_function, absolute_import
 
 import os
-import time
+import queue
+import threading
 from datetime import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from ligmos.utils import logs
 
@@ -23,17 +26,47 @@ import nexrad_aws as naws
 import plotNEXRAD as pnrad
 
 import common as com
+import fileManifest as fman
+import listCache as lcache
+import pipeline as ppln
 import commonMapping as commap
+import siteSampler as ssamp
 
 
-def main(outdir, creds, sleep=150., keephours=24.,
-         forceDown=False, forceRegen=False):
+def main(outdir, creds, sleep=30., keephours=24.,
+         forceDown=False, forceRegen=False, nworkers=1, ndownloads=4,
+         keepRaws=True, dbconf=None, sampleRadii=(5., 25.), nunzip=2,
+         products=('composite', 'echotops')):
     """
     'outdir' is the *base* directory for outputs, stuff will be put into
     subdirectories inside of it.
 
+    'sleep' is the time (seconds) between looks at the bucket for new
+    files; everything else happens as soon as there's something to do.
+
     'keephours' is the number of hours of data to keep on hand. Old stuff
     is deleted to keep things managable
+
+    'nworkers' is the number of processes to use for making the plots,
+    and 'ndownloads' the number of simultaneous downloads.  Each of those
+    processes decompresses its file in 'nunzip' threads, which gets a
+    single volume out the door sooner when there are spare cores.
+
+    New files are downloaded straight into memory and plotted from there;
+    'keepRaws' also writes them to disk (off to the side, so it doesn't
+    hold anything up) which is needed to ever plot them again.
+
+    If 'dbconf' is given, it's the configuration file for the influx
+    database that the stats of the reflectivity around each of our sites
+    (within 'sampleRadii' km) are written to; see siteSampler.py.
+
+    'products' are the ones made from every tilt of each volume (see
+    volumeProducts.py) along with the base reflectivity; the volume is
+    only read once for all of them.  Each gets its own subdirectory of
+    plots, its own manifest, and is published as nexrad_<name>_*.png.
+
+    Runs as a pipeline (see pipeline.py) of list -> download -> render ->
+    publish stages until it gets a SIGTERM or SIGINT.
     """
     aws_keyid = creds['s3_RO']['aws_access_key_id']
     aws_secretkey = creds['s3_RO']['aws_secret_access_key']
@@ -41,6 +74,7 @@ def main(outdir, creds, sleep=150., keephours=24.,
     dout = outdir + "/raws/"
     pout = outdir + "/pngs/"
     lout = outdir + "/nows/"
+    cout = outdir + "/cache/"
     cfiles = "./shapefiles/cb_2018_us_county_5m/"
 
     # in degrees; for spatially filtering map shapefiles
@@ -53,6 +87,14 @@ def main(outdir, creds, sleep=150., keephours=24.,
     # Need this for parsing the filename into a dt obj
     dtfmt = "KFSX%Y%m%d_%H%M%S"
 
+    # Number of frames to publish under static names
+    nstaticfiles = 48
+
+    # NOTE: I'm literally adding a 'fudge' factor here because the initial
+    #   AWS/data query has a resolution of 1 hour, so there can sometimes
+    #   be fighting of downloading/deleting/redownloading/deleting ...
+    fudge = 1.
+
     # Prepare some things for plotting so we don't have to do it
     #   forever in the main loop body
     rclasses = ["Interstate", "Federal"]
@@ -64,7 +106,8 @@ def main(outdir, creds, sleep=150., keephours=24.,
 
     # roads will be a dict with keys of rclasses and values of geometries
     roads = commap.parseRoads(rclasses,
-                              center=mapcenter, centerRad=filterRadius)
+                              center=mapcenter, centerRad=filterRadius,
+                              cachedir=cout)
     for rkey in rclasses:
         print("%s: %d found within %d degrees of center" % (rkey,
                                                             len(roads[rkey]),
@@ -72,65 +115,236 @@ def main(outdir, creds, sleep=150., keephours=24.,
 
     print("Parsing county data...")
     counties = commap.parseCounties(cfiles + "cb_2018_us_county_5m.shp",
-                                    center=mapcenter, centerRad=filterRadius)
+                                    center=mapcenter, centerRad=filterRadius,
+                                    cachedir=cout)
     print("%d counties found within %d degrees of center" % (len(counties),
                                                              filterRadius))
 
     # Construct/grab the color map
     gcmap = pnrad.getCmap()
 
-    print("Starting infinite loop...")
-    while True:
-        # 'keephours' is time (in hours!) to search for new files relative
-        #   to the present.
-        #   If they exist, they'll be skipped unless forceDown is True
+    # Where the numbers go, if anywhere
+    database, dbtable = None, None
+    if dbconf is not None:
+        database, dbtable = ssamp.connectDatabase(dbconf)
+    if database is None:
+        sampleRadii = None
+
+    # Everything the render processes need; the static map layers are
+    #   cached in 'cout' so they're reused between restarts
+    setup = pnrad.renderSetup(mapcenter, roads=roads, counties=counties,
+                              cmap=gcmap, cachedir=cout, renderer='lut',
+                              sampleRadii=sampleRadii, reader='lean',
+                              nunzip=nunzip, products=products)
+
+    # Keeps track of what we've already seen in the bucket, so we only
+    #   ever list the new stuff
+    listcache = lcache.ListingCache(cout + "listing_nexrad.json")
+
+    # Keeps track of the raw files and their plots so we don't have to
+    #   keep looking through the directories to figure it out
+    manifest = fman.FileManifest(cout + "manifest_nexrad.sqlite", dout, pout,
+                                 dtfmt=dtfmt, splitchar=None)
+
+    # Same raw files, but the products' plots (see pnrad.productPath) are
+    #   each in their own subdirectory and kept track of separately
+    pmanifests = {}
+    for name in products:
+        ppout = pout + name + "/"
+        os.makedirs(ppout, exist_ok=True)
+        mname = "%smanifest_nexrad_%s.sqlite" % (cout, name)
+        pmanifests.update({name: fman.FileManifest(mname, dout, ppout,
+                                                   dtfmt=dtfmt,
+                                                   splitchar=None)})
+
+    s3 = naws.getS3Client(aws_keyid, aws_secretkey, maxconns=ndownloads)
+
+    # Failed downloads are handed back to the listing thread this way,
+    #   since it's the only one that touches the listing cache
+    retries = queue.Queue()
+
+    def listNew():
+        """
+        Source: what's new in the bucket, as (key, filename, prefix)
+        """
+        while True:
+            try:
+                prefix, key = retries.get_nowait()
+            except queue.Empty:
+                break
+            listcache.retry(prefix, key)
+
+        todo, querybins = naws.NEXRADAWSlist(s3, dt.utcnow(), dout,
+                                             timedelta=keephours,
+                                             forceDown=forceDown,
+                                             listcache=listcache)
+
+        # Forget about anything that's fallen out of our time window
+        listcache.prune(querybins)
+        listcache.save()
+
+        return [(objs['Key'], oname, qt) for objs, oname, qt in todo]
+
+    def retryLater(item):
+        retries.put((item[2], item[0]))
+
+    def retryRender(item):
+        """
+        Hand back the listing item of a render item that never got
+        rendered; if its raw was only ever in memory that's the only way
+        it'll be done
+        """
+        if item[3] is not None:
+            retryLater(item[3])
+
+    # Raw files are written out by their own thread, off to the side.
+    #   Only so many can be waiting (same as the pipeline's queues), so
+    #   if the disk can't keep up the downloads wait for it rather than
+    #   piling up in memory
+    archiver = ThreadPoolExecutor(max_workers=1)
+    archiving = threading.BoundedSemaphore(2*nworkers)
+
+    def archive(data, oname):
+        try:
+            naws.writeRaw(data, oname)
+        except OSError as err:
+            print(str(err))
+            print("WHOOPSIE! WRITE OF %s FAILED" % (oname))
+        finally:
+            archiving.release()
+
+    def archiveLater(data, oname):
+        archiving.acquire()
+        archiver.submit(archive, data, oname)
+
+    def download(item):
+        """
+        Stage: (key, filename, prefix) -> (raw filename, png filename,
+        contents of the raw file, the listing item)
+        """
+        key, oname, prefix = item
+        data = naws.fetchBytes(s3, naws.awsbucket, key)
+        if data is None:
+            retryLater(item)
+            return None
+
+        if keepRaws is True:
+            archiveLater(data, oname)
+
+        return (oname, manifest.pngPath(oname), data, item)
+
+    # The workers each get the setup once, rather than with every frame
+    pool = ProcessPoolExecutor(max_workers=nworkers,
+                               initializer=pnrad.initRenderWorker,
+                               initargs=(setup,))
+
+    def render(item):
+        """
+        Stage: (raw filename, png filename, contents or None, listing
+        item or None) -> render results dict
+        """
+        raw, png, data, _ = item
+        try:
+            res = pool.submit(pnrad.renderWorker, raw, png,
+                              memory=data).result()
+        except BrokenProcessPool as err:
+            res = {'input': raw, 'output': png, 'ok': False,
+                   'error': str(err), 'seconds': 0.}
+
+        return res
+
+    def publish(results):
+        """
+        Stage: record how the frames went, then update the web side
+        """
         when = dt.utcnow()
-        print("Looking for files!")
-        ffiles = naws.NEXRADAWSgrab(aws_keyid, aws_secretkey, when, dout,
-                                    timedelta=keephours, forceDown=forceDown)
-
-        print("Found the following files:")
-        for f in ffiles:
-            print(os.path.basename(f.key))
-
-        print("Making the plots...")
-        # TODO: Return the projection coordinates (and a timestamp of them)
-        #   so they can be reused between loop cycles.
-        nplots = pnrad.makePlots(dout, pout, mapcenter, cmap=gcmap,
-                                 roads=roads, counties=counties,
-                                 forceRegen=forceRegen)
-        print("%03d plots done!" % (nplots))
-
-        # NOTE: I'm literally adding a 'fudge' factor here because the initial
-        #   AWS/data query has a resolution of 1 hour, so there can sometimes
-        #   be fighting of downloading/deleting/redownloading/deleting ...
-        fudge = 1.
-        # BUT only do anything if we actually made a new file!
-        if nplots > 0:
-            dtfmtpng = dtfmt + '.png'
-            cpng = com.clearOldFiles(pout, "*.png", when,
-                                     maxage=keephours+fudge, dtfmt=dtfmtpng)
-            craw = com.clearOldFiles(dout, "*", when,
-                                     maxage=keephours+fudge, dtfmt=dtfmt)
-
-            print("%d, %d raw and png files remain within %.1f + %.1f hours" %
-                  (len(cpng), len(craw), keephours, fudge))
-
-            print("Copying the latest/last files to an accessible spot...")
-            # Since they're good filenames we can just sort and take the last
-            #   if there are actually any current ones left of course
-            nstaticfiles = 48
-
-            # Move our files to the set of static filenames. This will
-            #   check (cpng) to see if there are actually any files that
-            #   are new, and if so it'll shuffle the files into the correct
-            #   order of static filenames.
-            com.copyStaticFilenames(nstaticfiles, lout, staticname, cpng)
-        else:
-            print("No new files downloaded so skipping all actions.")
-
-        print("Sleeping for %03d seconds..." % (sleep))
-        time.sleep(sleep)
+
+        ngood = 0
+        manifest.addRaws([res['input'] for res in results])
+        for res in results:
+            manifest.markRendered(res['input'], ok=res['ok'])
+            if res['ok'] is True:
+                ngood += 1
+            else:
+                print("FAILED to render %s: %s" % (res['input'],
+                                                   res['error']))
+        print("%03d plots done!" % (ngood))
+
+        # The numbers go out first since they're the quickest to get to
+        #   anyone that's waiting on them; one write per frame
+        for res in results:
+            if res.get('samples') is not None:
+                ts = dt.strptime(manifest.parseTimestamp(res['input']),
+                                 fman.isofmt)
+                # Site ID is the first part of the filename
+                radar = os.path.basename(res['input'])[0:4]
+                packets = ssamp.makePackets(res['samples'],
+                                            "nexrad_reflectivity", ts,
+                                            tags={'radar': radar})
+                ssamp.writePackets(database, dbtable, packets)
+
+        # Only do anything if we actually made a new file!
+        if ngood == 0:
+            return None
+
+        manifest.expire(when, maxage=keephours+fudge)
+        nraw, npng = manifest.counts()
+        print("%d, %d raw and png files remain within %.1f + %.1f hours" %
+              (nraw, npng, keephours, fudge))
+
+        # Link the newest frames into the set of static filenames; only
+        #   the ones whose frame actually changed are swapped in, and a
+        #   JSON listing of them is written alongside for the web side.
+        print("Publishing the latest/last files to an accessible spot...")
+        cpng = manifest.rendered(latest=nstaticfiles, withts=True)
+        com.copyStaticFilenames(nstaticfiles, lout, staticname, cpng)
+
+        # The products are made along with the base frame, so they
+        #   worked if it did
+        for name, pmanifest in pmanifests.items():
+            pmanifest.addRaws([res['input'] for res in results])
+            for res in results:
+                pmanifest.markRendered(res['input'], ok=res['ok'])
+            pmanifest.expire(when, maxage=keephours+fudge)
+            cpng = pmanifest.rendered(latest=nstaticfiles, withts=True)
+            com.copyStaticFilenames(nstaticfiles, lout,
+                                    "%s_%s" % (staticname, name), cpng)
+
+        return None
+
+    pipe = ppln.Pipeline(maxqueue=2*nworkers)
+    pipe.add(ppln.Source("list", listNew, interval=sleep,
+                         onDiscard=retryLater))
+    pipe.add(ppln.Stage("download", download, nthreads=ndownloads,
+                        onDiscard=retryLater))
+    pipe.add(ppln.Stage("render", render, nthreads=nworkers,
+                        onDiscard=retryRender))
+    pipe.add(ppln.Stage("publish", publish, batch=nstaticfiles,
+                        drain=True))
+
+    # Anything that was downloaded but never plotted (like if we were
+    #   stopped part way through last time)
+    backlog = manifest.pending(everything=forceRegen)
+
+    print("Starting the pipeline...")
+    pipe.handleSignals()
+    pipe.start()
+    print("Feeding %d leftover frames..." % (len(backlog)))
+    pipe.feed("render", [(raw, png, None, None) for raw, png in backlog])
+
+    # Now it's all up to the threads until we're told to stop
+    pipe.wait()
+    pool.shutdown()
+    archiver.shutdown()
+
+    # Whatever wasn't downloaded will be listed again next time
+    while True:
+        try:
+            prefix, key = retries.get_nowait()
+        except queue.Empty:
+            break
+        listcache.retry(prefix, key)
+    listcache.save()
 
 
 if __name__ == "__main__":
@@ -138,6 +352,7 @@ if __name__ == "__main__":
     awsconf = "./awsCreds.conf"
     forceDownloads = False
     forceRegenPlot = False
+    nworkers = 4
     logname = './logs/radarlove.log'
 
     # Set up logging (using ligmos' quick 'n easy wrapper)
@@ -145,5 +360,6 @@ if __name__ == "__main__":
 
     creds = com.parseConfFile(awsconf)
 
-    main(outdir, creds, forceDown=forceDownloads, forceRegen=forceRegenPlot)
+    main(outdir, creds, forceDown=forceDownloads, forceRegen=forceRegenPlot,
+         nworkers=nworkers)
     print("Exiting!")
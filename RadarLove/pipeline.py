@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Run the loopers as a chain of stages connected by bounded queues.
+
+Instead of listing, downloading, plotting and publishing everything in
+turn and then sleeping, each stage runs in its own thread(s) and works on
+each thing as soon as it shows up from the stage before it.  A new file
+in the bucket therefore goes straight through to the web side without
+waiting on anything else.
+
+The queues between the stages are bounded, so if a stage falls behind
+(usually the rendering) the ones before it just block until it catches
+up rather than piling up an unlimited amount of work in memory.
+
+On SIGTERM (or SIGINT) the source stops listing, the stages that were in
+the middle of something finish it, and the stages marked 'drain' (like
+publishing) finish everything that's left for them.  Whatever's left
+queued in the others is handed to their 'onDiscard' so it can be redone
+the next time around.
+
+LatencyMonitor keeps an eye on how long things take to get all the way
+through, both from when they were listed and from when the data were
+actually taken, and complains loudly if we're falling behind real time.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import time
+import queue
+import signal
+import threading
+from collections import deque
+
+
+class Source():
+    """
+    Class to hold the first stage of a pipeline, which makes the items
+    """
+    def __init__(self, name, func, interval=30., onDiscard=None):
+        """
+        'func' is called every 'interval' seconds and returns a list of
+        items to send down the pipeline.  Any it didn't get to before
+        being stopped are each handed to 'onDiscard' (if it's given).
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.onDiscard = onDiscard
+
+        self.outq = None
+        self.halt = threading.Event()
+        self.threads = []
+
+    def start(self, pipe):
+        """
+        Start up the thread
+        """
+        thd = threading.Thread(target=self.run, args=(pipe,),
+                               name=self.name, daemon=True)
+        thd.start()
+        self.threads = [thd]
+
+    def run(self, pipe):
+        """
+        What's actually run in the thread
+        """
+        while not self.halt.is_set():
+            try:
+                items = self.func()
+            except Exception as err:
+                # TODO: Figure out the proper/specific exceptions to catch;
+                #   for now it's better than stopping the whole pipeline
+                print("%s FAILED: %s" % (self.name, str(err)))
+                items = []
+
+            for each in items:
+                sent = pipe.put(self.outq, each, abort=self.halt)
+                if sent is False and self.onDiscard is not None:
+                    self.onDiscard(each)
+
+            self.halt.wait(self.interval)
+
+
+class Stage():
+    """
+    Class to hold a single stage of a pipeline and its worker thread(s)
+    """
+    def __init__(self, name, func, nthreads=1, batch=None, drain=False,
+                 onDiscard=None, fanout=False):
+        """
+        'func' is called on each item, and whatever it returns (if it's
+        not None) is sent on to the next stage.  If 'batch' is given,
+        'func' is called on a list of up to that many items instead;
+        everything that's queued up by the time it gets to it.  If
+        'fanout' is True, 'func' returns a list of items instead, which
+        are each sent on.
+
+        'drain' means everything still queued is finished when stopping.
+        Otherwise they're each handed to 'onDiscard' (if it's given), as
+        is any item that 'func' raises on.
+        """
+        self.name = name
+        self.func = func
+        self.nthreads = nthreads
+        self.batch = batch
+        self.drain = drain
+        self.onDiscard = onDiscard
+        self.fanout = fanout
+
+        self.inq = None
+        self.outq = None
+        self.halt = threading.Event()
+        self.upstreamDone = threading.Event()
+        self.threads = []
+
+    def start(self, pipe):
+        """
+        Start up the worker thread(s)
+        """
+        self.threads = []
+        for i in range(self.nthreads):
+            thd = threading.Thread(target=self.run, args=(pipe,),
+                                   name="%s-%d" % (self.name, i),
+                                   daemon=True)
+            thd.start()
+            self.threads.append(thd)
+
+    def nextItems(self):
+        """
+        Wait (a little while) for the next item(s); returns [] if there
+        weren't any
+        """
+        try:
+            items = [self.inq.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        if self.batch is not None:
+            while len(items) < self.batch:
+                try:
+                    items.append(self.inq.get_nowait())
+                except queue.Empty:
+                    break
+
+        return items
+
+    def run(self, pipe):
+        """
+        What's actually run in the worker thread(s)
+        """
+        while not self.halt.is_set():
+            items = self.nextItems()
+            if items == []:
+                if self.upstreamDone.is_set():
+                    break
+                continue
+
+            if self.batch is not None:
+                todo = [items]
+            else:
+                todo = items
+
+            for each in todo:
+                try:
+                    result = self.func(each)
+                except Exception as err:
+                    # TODO: Figure out the proper/specific exceptions;
+                    #   for now it's better than stopping the pipeline
+                    print("%s FAILED: %s" % (self.name, str(err)))
+                    result = None
+
+                    # Hand it back so it isn't just lost (like a download
+                    #   that'll never be listed again)
+                    if self.onDiscard is not None:
+                        self.onDiscard(each)
+
+                if result is None or self.outq is None:
+                    continue
+
+                if self.fanout is True:
+                    for out in result:
+                        pipe.put(self.outq, out)
+                else:
+                    pipe.put(self.outq, result)
+
+    def stop(self):
+        """
+        Stop the worker thread(s) once upstream is done; see the module
+        docstring for what happens to anything that's still queued
+        """
+        if self.drain is True:
+            self.upstreamDone.set()
+        else:
+            self.halt.set()
+
+        for thd in self.threads:
+            thd.join()
+
+        ndiscard = 0
+        while True:
+            try:
+                each = self.inq.get_nowait()
+            except queue.Empty:
+                break
+            ndiscard += 1
+            if self.onDiscard is not None:
+                self.onDiscard(each)
+
+        if ndiscard > 0:
+            print("%s: %d queued items left for next time" % (self.name,
+                                                              ndiscard))
+
+
+class Pipeline():
+    """
+    Class to hold the whole chain of stages
+    """
+    def __init__(self, maxqueue=8):
+        """
+        'maxqueue' is the size of each of the queues between the stages
+        """
+        self.maxqueue = maxqueue
+        self.stages = []
+        self.stopping = threading.Event()
+
+    def add(self, stage):
+        """
+        Tack 'stage' (a Source first, then Stages) onto the end
+        """
+        if self.stages != []:
+            stage.inq = queue.Queue(maxsize=self.maxqueue)
+            self.stages[-1].outq = stage.inq
+        self.stages.append(stage)
+
+        return stage
+
+    def put(self, q, item, abort=None):
+        """
+        Put 'item' onto 'q', waiting for room if it's full.  If 'abort'
+        (a threading.Event) gets set while waiting, it gives up.
+
+        Returns True if it made it onto the queue.
+        """
+        while abort is None or not abort.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def feed(self, name, items):
+        """
+        Put 'items' straight onto the queue of the stage called 'name',
+        like the backlog from before we started.  Gives up if we're asked
+        to stop in the meantime, and returns how many made it.
+        """
+        stage = [each for each in self.stages if each.name == name][0]
+
+        nfed = 0
+        for each in items:
+            if self.put(stage.inq, each, abort=self.stopping) is False:
+                break
+            nfed += 1
+
+        return nfed
+
+    def requestStop(self, signum=None, frame=None):
+        """
+        Ask for everything to stop; also the signal handler
+        """
+        if signum is not None:
+            print("Caught signal %d; shutting down..." % (signum))
+        self.stopping.set()
+
+    def handleSignals(self):
+        """
+        Stop cleanly on SIGTERM (like from docker stop) or SIGINT
+        """
+        signal.signal(signal.SIGTERM, self.requestStop)
+        signal.signal(signal.SIGINT, self.requestStop)
+
+    def start(self):
+        """
+        Start all of the stages, last first so everything's ready and
+        waiting by the time the source starts handing things out
+        """
+        for stage in self.stages[::-1]:
+            stage.start(self)
+
+    def wait(self):
+        """
+        Block until we're asked to stop, then stop
+        """
+        while not self.stopping.is_set():
+            self.stopping.wait(1.)
+
+        self.stop()
+
+    def stop(self):
+        """
+        Stop the stages in order, source first, so the ones downstream
+        can still take whatever the ones upstream are finishing up
+        """
+        self.stopping.set()
+
+        source = self.stages[0]
+        source.halt.set()
+        for thd in source.threads:
+            thd.join()
+
+        for stage in self.stages[1:]:
+            stage.stop()
+
+        print("Pipeline stopped.")
+
+
+class LatencyMonitor():
+    """
+    Class to keep track of the end-to-end latency of each frame, and
+    raise the alarm if it's consistently more than we can live with
+    """
+    def __init__(self, maxLatency=300., nbehind=3, nkeep=60):
+        """
+        'maxLatency' is the most (seconds) that a frame can take from when
+        its data were taken to when it's published; if 'nbehind' frames
+        in a row take longer than that, we've fallen behind.  The stats
+        are for the last 'nkeep' frames of each product.
+        """
+        self.maxLatency = maxLatency
+        self.nbehind = nbehind
+        self.nkeep = nkeep
+
+        # When each item was listed, by its key
+        self.listed = {}
+
+        # Per product: recent (pipeline, total) latencies, and how many
+        #   in a row have been too slow
+        self.recent = {}
+        self.nlate = {}
+
+        self.lock = threading.Lock()
+
+    def seen(self, key, when=None):
+        """
+        Record that 'key' just showed up (at time.time(), or 'when')
+        """
+        if when is None:
+            when = time.time()
+
+        with self.lock:
+            self.listed.update({key: when})
+
+            # Anything that's been around for a day never made it
+            old = [k for k, t in self.listed.items() if when - t > 86400.]
+            for k in old:
+                del self.listed[k]
+
+    def done(self, product, key, tobs, when=None):
+        """
+        Record that 'key' was just published (at time.time(), or 'when')
+        as part of 'product'; 'tobs' is when its data were taken (as a
+        unix time).  Returns the total latency in seconds.
+        """
+        if when is None:
+            when = time.time()
+
+        total = when - tobs
+        with self.lock:
+            tlisted = self.listed.get(key)
+            if tlisted is not None:
+                ours = when - tlisted
+            else:
+                # Leftovers from before we started don't really count
+                ours = None
+
+            self.recent.setdefault(product, deque(maxlen=self.nkeep))
+            self.recent[product].append((ours, total))
+
+            if total > self.maxLatency and ours is not None:
+                self.nlate[product] = self.nlate.get(product, 0) + 1
+            else:
+                if self.nlate.get(product, 0) >= self.nbehind:
+                    print("%s: caught back up to real time" % (product))
+                self.nlate[product] = 0
+
+            nlate = self.nlate[product]
+
+        if ours is not None:
+            print("%s: %s published %.1f s after the data were taken,"
+                  " %.1f s after it was listed" % (product, key, total, ours))
+
+        if nlate == self.nbehind:
+            print("ALARM! %s has fallen behind real time: %d frames in a"
+                  " row took more than %.0f s" % (product, nlate,
+                                                  self.maxLatency))
+        elif nlate > self.nbehind:
+            print("ALARM! %s is still behind real time (%d frames)" %
+                  (product, nlate))
+
+        return total
+
+    def report(self):
+        """
+        Print the median and max latencies of the recent frames
+        """
+        with self.lock:
+            recent = dict((k, list(v)) for k, v in self.recent.items())
+
+        for product, lats in sorted(recent.items()):
+            totals = sorted(each[1] for each in lats)
+            ours = sorted(each[0] for each in lats if each[0] is not None)
+            msg = ("%s: latency over the last %d frames: median %.1f s,"
+                   " max %.1f s" % (product, len(totals),
+                                    totals[len(totals)//2], totals[-1]))
+            if ours != []:
+                msg += ("; ours median %.1f s, max %.1f s" %
+                        (ours[len(ours)//2], ours[-1]))
+            print(msg)
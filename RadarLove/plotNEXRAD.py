@@ -13,10 +13,14 @@
 
 from __future__ import division, print_function, absolute_import
 
+import io
 import glob
 
 import os
+import time
+import signal
 from datetime import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 
@@ -27,21 +31,153 @@ import matplotlib.patches as mpatches
 import cartopy.crs as ccrs
 
 from pyart.io import read_nexrad_archive
+from pyart.core import Radar
+from pyart.config import get_metadata
 from pyart.graph import RadarMapDisplay
 
+import level2
+import gateLUT as glut
+import volumeProducts as vprod
 import commonMapping as commap
+import mapLayers as mlayers
+import siteSampler as ssamp
 
 
-def readNEXRAD(filename):
+# Filled in by initRenderWorker() in each of the rendering processes
+_workerSetup = {}
+
+
+def readNEXRAD(filename, memory=None, lean=False, nthreads=1):
     """
+    If 'memory' is given it's the actual contents of the file (as bytes),
+    and 'filename' is just used as its name.
+
+    'lean' only reads what literallyDeBug needs (the lowest sweep's
+    reflectivity, ZDR and RhoHV) rather than the whole volume; see
+    level2.py.  Either way it's a Py-ART Radar.
+
+    'nthreads' > 1 decompresses the volume's records in that many threads
+    rather than one after the other.
     """
-    print("Reading: %s" % (filename))
-    dat = read_nexrad_archive(filename, linear_interp=False)
+    if lean is True:
+        print("Reading: %s (lowest sweep only)" % (filename))
+        vol = level2.readLevel2(filename, memory=memory, sweeps=(0,),
+                                moments=('REF', 'ZDR', 'RHO'),
+                                nthreads=nthreads)
+        print("Done reading! (%d records)" % (vol.nrecords))
+        return makeRadar(vol)
+
+    if nthreads > 1:
+        # Py-ART happily reads an already decompressed volume
+        print("Reading: %s (%d threads)" % (filename, nthreads))
+        flat = level2.flattenVolume(filename, memory=memory,
+                                    nthreads=nthreads)
+        dat = read_nexrad_archive(io.BytesIO(flat), linear_interp=False)
+    elif memory is None:
+        print("Reading: %s" % (filename))
+        dat = read_nexrad_archive(filename, linear_interp=False)
+    else:
+        print("Reading: %s (from memory)" % (filename))
+        dat = read_nexrad_archive(io.BytesIO(memory), linear_interp=False)
     print("Done reading!")
 
     return dat
 
 
+def readVolume(filename, memory=None, nthreads=1):
+    """
+    Read every sweep of the volume (but still only what literallyDeBug
+    needs of each) for the products in volumeProducts.py; returns a
+    level2.Level2Volume.  See readNEXRAD for the arguments.
+    """
+    print("Reading: %s (all sweeps)" % (filename))
+    vol = level2.readLevel2(filename, memory=memory, sweeps=None,
+                            moments=vprod.qcMoments, nthreads=nthreads)
+    print("Done reading! (%d records)" % (vol.nrecords))
+
+    return vol
+
+
+def makeRadar(vol, sweeps=None):
+    """
+    Wrap the sweeps of a level2.Level2Volume up as a Py-ART Radar, with
+    the same names and metadata that read_nexrad_archive would give it;
+    'sweeps' are the indices of just the ones to use
+    """
+    if sweeps is None:
+        sweeps = vol.sweeps
+    else:
+        sweeps = [vol.sweeps[i] for i in sweeps if i < len(vol.sweeps)]
+    if sweeps == []:
+        raise ValueError("No sweeps were read!")
+
+    # Py-ART wants one range for the whole volume
+    ngates = max(each['range'].size for each in sweeps)
+    longest = [each['range'] for each in sweeps
+               if each['range'].size == ngates][0]
+
+    def field(key):
+        dic = get_metadata(key)
+        dic['data'] = np.concatenate([each[key] for each in sweeps])
+        return dic
+
+    time = field('time')
+    time['units'] = vol.start.strftime("seconds since %Y-%m-%dT%H:%M:%SZ")
+    azimuth = field('azimuth')
+    elevation = field('elevation')
+
+    _range = get_metadata('range')
+    _range['data'] = longest
+    _range['meters_to_center_of_first_gate'] = float(longest[0])
+    _range['meters_between_gates'] = float(longest[1] - longest[0])
+
+    fields = {}
+    for moment in set(m for each in sweeps for m in each['moments']):
+        name = level2.fieldNames[moment]
+        parts = []
+        for each in sweeps:
+            nrays = each['azimuth'].size
+            part = np.ma.masked_all((nrays, ngates), dtype=np.float32)
+            if moment in each['moments']:
+                data = each['moments'][moment]
+                part[:, 0:data.shape[1]] = data
+            parts.append(part)
+        dic = get_metadata(name)
+        dic['data'] = np.ma.concatenate(parts)
+        fields.update({name: dic})
+
+    metadata = get_metadata('metadata')
+    metadata['original_container'] = "NEXRAD Level II"
+    metadata['instrument_name'] = vol.site
+    metadata['vcp_pattern'] = vol.vcp
+
+    def single(key, val, dtype):
+        dic = get_metadata(key)
+        dic['data'] = np.array(val, dtype=dtype)
+        return dic
+
+    nrays = [each['azimuth'].size for each in sweeps]
+    ends = np.cumsum(nrays) - 1
+
+    # No VCP table (Message 5) is read, so the fixed angle is just what
+    #   the rays actually were
+    angles = [np.median(each['elevation']) for each in sweeps]
+
+    return Radar(time, _range, fields, metadata, 'ppi',
+                 single('latitude', [vol.latitude], 'float64'),
+                 single('longitude', [vol.longitude], 'float64'),
+                 single('altitude', [vol.altitude], 'float64'),
+                 single('sweep_number', [each['number'] for each in sweeps],
+                        'int32'),
+                 single('sweep_mode',
+                        len(sweeps)*['azimuth_surveillance'], 'S'),
+                 single('fixed_angle', angles, 'float32'),
+                 single('sweep_start_ray_index', ends - np.array(nrays) + 1,
+                        'int32'),
+                 single('sweep_end_ray_index', ends, 'int32'),
+                 azimuth, elevation)
+
+
 def getCmap():
     # Pulled by hand from the NWS NEXRAD plots
     ct = ["#ccffff", "#cc99cc", "#996699", "#663366", "#cccc99", "#999966",
@@ -55,6 +191,40 @@ def getCmap():
     return nwsref
 
 
+def getEchoTopCmap():
+    # Close to the NWS enhanced echo tops, in kft
+    ct = ["#767676", "#00e0ff", "#0090ff", "#0000ff", "#00ff00", "#00c000",
+          "#008000", "#ffff00", "#e0c000", "#ff9000", "#ff0000", "#d00000",
+          "#b00000", "#ff00ff", "#ffffff"]
+    cl = range(0, 75, 5)
+    nwstops = mcolors.from_levels_and_colors(cl, ct, extend='max')
+    nwstops[0].name = "NWSEchoTops"
+
+    return nwstops
+
+
+def productLUT(name, cmap=None):
+    """
+    The mapLayers.ColorLUT for one of the products in volumeProducts.py;
+    the composite uses the same colors ('cmap') as the base reflectivity
+    """
+    if name == 'echotops':
+        cmap = getEchoTopCmap()
+    elif cmap is None:
+        cmap = getCmap()
+
+    return mlayers.ColorLUT(cmap[0], norm=cmap[1])
+
+
+def productPath(outpname, name):
+    """
+    Where the 'name' product of the frame 'outpname' goes; same filename,
+    but in a subdirectory named for the product
+    """
+    return "%s/%s/%s" % (os.path.dirname(outpname), name,
+                         os.path.basename(outpname))
+
+
 def literallyDeBug(radar, vcpmode):
     """
     Apply rudimentary quality control, as done in the example by
@@ -90,31 +260,9 @@ def literallyDeBug(radar, vcpmode):
     rhohv_grid = radar.get_field(0, 'cross_correlation_ratio')
     zdr_grid = radar.get_field(0, 'differential_reflectivity')
 
-    # Reflectivity values less than some cutoff point
-    #   value originally was 20
-    # The logic below attempts to account for the radar scan operating
-    #   in "Clear Air Mode" which can result in valid values < 0.  If that's
-    #   the scan type, we set a super low bar for reflectivity filtering
-    #   otherwise we choose a low-ish value to try to eliminate fuzziness
-    if vcpmode in [31, 32, 35]:
-        refCutVal = -40
-    else:
-        refCutVal = 5
-    refLow = np.less(refl_grid, refCutVal)
-
-    # Differential reflectivity greater than some cutoff point
-    #   Note that this is doing abs() first, so it's filtering out both ends
-    #   value originally was 2.3
-    zdrCut = np.greater(np.abs(zdr_grid), 2.0)
-
-    # Cross correlation values below a threshold
-    #   value originally was 0.95
-    rhohvLow = np.less(rhohv_grid, 0.90)
-
-    # Combine all of the above into a master mask array. Flag values where:
-    #   Reflectivity < cutoff OR (DifferentialReflectivity is high OR
-    #                             CrossCorrelationRatio is low)
-    notweather = np.logical_or(refLow, np.logical_or(zdrCut, rhohvLow))
+    # The cuts themselves are shared with the products made from all of
+    #   the tilts (see volumeProducts.py) so they always match
+    notweather = vprod.notWeather(refl_grid, zdr_grid, rhohv_grid, vcpmode)
 
     # Generate the masked array from the above
     qcrefl_grid = np.ma.masked_where(notweather, refl_grid)
@@ -126,179 +274,540 @@ def literallyDeBug(radar, vcpmode):
 
 
 def makePlots(inloc, outloc, mapCenter, roads=None, counties=None,
-              cmap=None, forceRegen=False):
+              cmap=None, forceRegen=False, nworkers=1, cachedir=None,
+              renderer='mpl', manifest=None, reader='pyart', nunzip=1,
+              products=()):
+    """
+    'nworkers' > 1 renders the frames in that many separate processes
+
+    'renderer' is either 'mpl', which draws every frame from scratch in
+    matplotlib, or 'layers' which only draws the radar data and composites
+    it with the static map layers (see mapLayers.py), which are stored
+    in 'cachedir' between runs if it's given.  'lut' is the same but never
+    touches matplotlib per frame; the gates are put on the map with a
+    lookup table (see gateLUT.py, also cached in 'cachedir') and colored
+    with a mapLayers.ColorLUT.
+
+    'manifest' is an optional fileManifest.FileManifest; if it's given,
+    it decides what needs plotting (rather than looking in 'inloc' and
+    'outloc') and is told how each frame went.
+
+    'reader' is either 'pyart', which reads the whole volume, or 'lean'
+    which only reads the lowest sweep and the moments that are actually
+    used; see readNEXRAD.  'nunzip' is the number of threads each frame
+    uses to decompress its file.
+
+    'products' are any of the ones in volumeProducts.py (like 'composite'
+    and 'echotops') to also make from each volume; each goes in its own
+    subdirectory of 'outloc' (see productPath).  They need every sweep,
+    so the whole volume is read (once) with level2.py whatever 'reader'
+    is.
+    """
     # Warning, you may explode
     #  https://matplotlib.org/api/pyplot_api.html#matplotlib.pyplot.switch_backend
     plt.switch_backend("Agg")
 
+    setup = renderSetup(mapCenter, roads=roads, counties=counties,
+                        cmap=cmap, cachedir=cachedir, renderer=renderer,
+                        reader=reader, nunzip=nunzip, products=products)
+
+    for name in products:
+        os.makedirs("%s/%s" % (outloc, name), exist_ok=True)
+
+    # Figure out what actually needs doing
+    if manifest is not None:
+        # It already knows what's been plotted, so no need to look
+        pending = manifest.pending(everything=forceRegen)
+    else:
+        flist = sorted(glob.glob(inloc + "/*"))
+        pending = []
+        for each in flist:
+            outpname = "%s/%s.png" % (outloc, os.path.basename(each))
+
+            # Logic to skip stuff already completed, or just redo everything
+            if forceRegen is True:
+                save = True
+            else:
+                # Check to see if we're already done with this image
+                found = os.path.isfile(outpname)
+
+                if found is True:
+                    save = False
+                    print("File %s exists! Skipping." % (outpname))
+                else:
+                    save = True
+
+            if save is True:
+                pending.append((each, outpname))
+
+    if nworkers > 1 and len(pending) > 1:
+        print("Rendering %d frames with %d workers..." % (len(pending),
+                                                          nworkers))
+        results = []
+        with ProcessPoolExecutor(max_workers=nworkers,
+                                 initializer=initRenderWorker,
+                                 initargs=(setup,)) as pool:
+            futs = [pool.submit(renderWorker, each, outpname)
+                    for each, outpname in pending]
+            for fut in as_completed(futs):
+                results.append(fut.result())
+    else:
+        results = [renderOne(each, outpname, setup)
+                   for each, outpname in pending]
+
+    if manifest is not None:
+        for res in results:
+            manifest.markRendered(res['input'], ok=res['ok'])
+
+    # i is the number-of-images processed counter
+    i = 0
+    for res in results:
+        if res['ok'] is True:
+            i += 1
+            print("%d plots complete" % (i))
+        else:
+            print("FAILED to render %s: %s" % (res['input'], res['error']))
+
+    return i
+
+
+def renderSetup(mapCenter, roads=None, counties=None, cmap=None,
+                cachedir=None, renderer='mpl', sampleRadii=None,
+                reader='pyart', nunzip=1, products=()):
+    """
+    Put together everything renderFrame needs (other than the filenames)
+    that's the same for every frame; see makePlots for what it all means.
+
+    If 'sampleRadii' (km) is given, the stats of the reflectivity within
+    those radii of each of our sites are handed back too; see sampleRadar.
+    """
     cLon = mapCenter[0]
     cLat = mapCenter[1]
 
-    flist = sorted(glob.glob(inloc + "/*"))
-
     if cmap is None:
         cmap = getCmap()
 
-    # i is the number-of-images processed counter
-    i = 0
-    for each in flist:
-        outpname = "%s/%s.png" % (outloc, os.path.basename(each))
+    lut = None
+    if renderer == 'lut':
+        lut = mlayers.ColorLUT(cmap[0], norm=cmap[1])
+
+    productLUTs = {}
+    for name in products:
+        productLUTs.update({name: productLUT(name, cmap=cmap)})
+
+    setup = {'cLat': cLat, 'cLon': cLon, 'cmap': cmap, 'lut': lut,
+             'roads': roads, 'counties': counties,
+             'cachedir': cachedir, 'renderer': renderer,
+             'sampleRadii': sampleRadii, 'reader': reader,
+             'nunzip': nunzip, 'products': tuple(products),
+             'productLUTs': productLUTs}
+
+    return setup
+
+
+def initRenderWorker(setup):
+    """
+    Runs once in each worker process, so the roads/counties/colormap are
+    only sent over once rather than along with every single frame
+    """
+    # Warning, you may explode
+    #  https://matplotlib.org/api/pyplot_api.html#matplotlib.pyplot.switch_backend
+    plt.switch_backend("Agg")
+
+    # Ctrl-C goes to the whole process group, but it's up to the parent
+    #   to decide how to shut down (see pipeline.py) so ignore it here
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    _workerSetup.update(setup)
+
+
+def renderWorker(infile, outpname, memory=None):
+    """
+    What's actually run by the worker processes; see initRenderWorker
+    """
+    return renderOne(infile, outpname, _workerSetup, memory=memory)
+
+
+def renderOne(infile, outpname, setup, memory=None):
+    """
+    Render a single frame, catching and returning any errors rather than
+    letting them take out the whole loop.  'memory' is the contents of
+    'infile' if it was never actually written to disk.
+
+    Returns a dict of the results; 'ok' is True if it worked.
+    """
+    res = {'input': infile, 'output': outpname, 'ok': False,
+           'error': None, 'seconds': 0., 'samples': None}
+
+    t0 = time.time()
+    try:
+        res['ok'], res['samples'] = renderFrame(infile, outpname,
+                                                memory=memory, **setup)
+        if res['ok'] is False:
+            res['error'] = "Unplotable file"
+    except Exception as err:
+        # TODO: Figure out the proper/specific exceptions to catch;
+        #   for now it's better than losing the rest of the frames
+        res['error'] = str(err)
+        plt.close('all')
+    res['seconds'] = time.time() - t0
+
+    return res
+
+
+def getStaticLayers(crs, extent, site, siteLat, siteLon, roads=None,
+                    counties=None, cachedir=None):
+    """
+    Grab the prerendered map features and markers for the radar map;
+    'extent' is (lonMin, lonMax, latMin, latMax)
+    """
+    def drawStatic(ax):
+        commap.add_map_features(ax, counties=counties, roads=roads)
+        commap.add_AZObs(ax)
+
+        # Same as display.plot_point, which needs the radar data
+        ax.plot(siteLon, siteLat, '^', color='orange',
+                transform=ccrs.PlateCarree())
+
+    tag = "%s|%.4f|%.4f|%s" % (site, siteLat, siteLon,
+                               mlayers.featureTag(roads=roads,
+                                                  counties=counties))
+    layers = mlayers.getStaticLayers(crs, extent, (7., 7.), dpi=100,
+                                     drawFunc=drawStatic,
+                                     extentcrs=ccrs.PlateCarree(),
+                                     figcolor='black', bgcolor='#262629',
+                                     cachedir=cachedir, tag=tag)
+
+    return layers
 
-        # Logic to skip stuff already completed, or just redo everything
-        if forceRegen is True:
-            save = True
+
+def renderRadarLayer(display, crs, extent, cmap, siteLat, siteLon):
+    """
+    Draw just the radar data on a transparent map that matches the static
+    layers, and return it as a full frame RGBA array
+    """
+    fig, ax = mlayers.makeMapAxes(crs, extent, (7., 7.), 100,
+                                  extentcrs=ccrs.PlateCarree())
+    fig.patch.set_alpha(0.)
+    ax.background_patch.set_visible(False)
+    ax.outline_patch.set_visible(False)
+
+    display.plot_ppi_map('reflectivity_masked',
+                         mask_outside=True,
+                         min_lon=extent[0], max_lon=extent[1],
+                         min_lat=extent[2], max_lat=extent[3],
+                         projection=crs,
+                         fig=fig,
+                         ax=ax,
+                         cmap=cmap[0],
+                         norm=cmap[1],
+                         lat_0=siteLat,
+                         lon_0=siteLon,
+                         embelish=False,
+                         colorbar_flag=False,
+                         title_flag=False,
+                         ticklabs=[],
+                         ticks=[],
+                         lat_lines=[],
+                         lon_lines=[],
+                         raster=True)
+
+    rgba = mlayers.grabRGBA(fig)
+    plt.close(fig)
+
+    return rgba
+
+
+def gridRadar(radar, crs, extent, layers, field='reflectivity_masked',
+              cachedir=None):
+    """
+    Put 'field' of the (single, lowest) sweep of 'radar' onto the map axes
+    raster of 'layers' using the cached gate lookup table (see gateLUT.py)
+    """
+    rslice, cslice = layers.axesSlices()
+    shape = (rslice.stop - rslice.start, cslice.stop - cslice.start)
+
+    lookup = glut.getGateLUT(radar.metadata['instrument_name'],
+                             radar.latitude['data'][0],
+                             radar.longitude['data'][0],
+                             radar.fixed_angle['data'][0],
+                             radar.range['data'], radar.nrays, crs, extent,
+                             shape, cachedir=cachedir)
+
+    return glut.gridSweep(lookup, radar.fields[field]['data'],
+                          radar.azimuth['data'])
+
+
+def renderProducts(vol, products, outpname, crs, extent, layers, prefix,
+                   line2, productLUTs=None, cachedir=None):
+    """
+    Make each of 'products' from all of the tilts of the volume 'vol' and
+    save them next to 'outpname' (see productPath); the rest is the same
+    as the 'lut' renderer, and 'prefix' and 'line2' are for the title bar
+    """
+    rslice, cslice = layers.axesSlices()
+    shape = (rslice.stop - rslice.start, cslice.stop - cslice.start)
+
+    print("Gridding all tilts...")
+    grids = vprod.makeProducts(vol, crs, extent, shape, products=products,
+                               cachedir=cachedir)
+
+    for name, grid in grids.items():
+        if productLUTs is not None and name in productLUTs:
+            lut = productLUTs[name]
         else:
-            # Check to see if we're already done with this image
-            found = os.path.isfile(outpname)
+            lut = productLUT(name)
 
-            if found is True:
-                save = False
-                print("File %s exists! Skipping." % (outpname))
-            else:
-                save = True
+        line1 = ("%s  %s" % (prefix, vprod.productNames[name])).upper()
+        frame = mlayers.compositeFrame(layers,
+                                       data=lut.lookup(lut.index(grid)))
+        img = mlayers.drawTitleBar(frame, layers, line1, line2)
+        mlayers.savePNG(img, productPath(outpname, name))
 
-        if save is True:
-            radar = readNEXRAD(each)
-
-            # Pull out the identifiers
-            plotable = False
-            try:
-                site = radar.metadata['instrument_name']
-                siteLat = radar.latitude['data'][0]
-                siteLon = radar.longitude['data'][0]
-
-                dprod = radar.metadata['original_container']
-
-                # Get the VCP mode (specific radar scan mode); see also:
-                # https://www.weather.gov/jetstream/vcp_max
-                vcpmode = radar.metadata['vcp_pattern']
-                plotable = True
-            except KeyError as ke:
-                # This usually means a bad file
-                print(str(ke))
-                plotable = False
-
-            if plotable is True:
-                # Pull out the time stamp; skip the site name
-                fullts = os.path.basename(each)[4:]
-                tend = dt.strptime(fullts, "%Y%m%d_%H%M%S")
-
-                # Filter out crud that is probably bugs and stuff,
-                #   good enough for what we're doing
-                print("Debugging...")
-                qcradar = literallyDeBug(radar, vcpmode)
-                print("Debugging complete!")
-                display = RadarMapDisplay(qcradar, )
-
-                latMin, latMax, lonMin, lonMax = commap.set_plot_extent(cLat,
-                                                                        cLon)
-
-                # Get the projection info for the plot axes
-                crs = ccrs.LambertConformal(central_latitude=siteLat,
-                                            central_longitude=siteLon)
-
-                # Get the proper plot extents so we have no whitespace
-                prlon = (crs.x_limits[1] - crs.x_limits[0])
-                prlat = (crs.y_limits[1] - crs.y_limits[0])
-                # Ultimate image width/height
-                paspect = prlon/prlat
-
-                # Leaving this hacked in for now
-                figsize = (7., 7.)
-
-                print(prlon, prlat, paspect)
-                print(figsize)
-
-                # Figure creation
-                fig = plt.figure(figsize=figsize, dpi=100)
-
-                # Needed to remove any whitespace/padding around the imshow()
-                plt.subplots_adjust(left=0., right=1., top=1., bottom=0.)
-
-                # Tell matplotlib we're using a map projection so cartopy
-                #   takes over and overloades Axes() with GeoAxes()
-                ax = plt.axes(projection=crs)
-
-                ax.background_patch.set_facecolor('#262629')
-
-                # Some custom stuff
-                ax = commap.add_map_features(ax, counties=counties,
-                                             roads=roads)
-                ax = commap.add_AZObs(ax)
-
-                # Clear out the crap on the edges
-                ax.set_xlabel("")
-                ax.set_ylabel("")
-                ax.set_xticklabels([])
-                ax.set_yticklabels([])
-
-                print("Plotting radar data...")
-                display.plot_ppi_map('reflectivity_masked',
-                                     mask_outside=True,
-                                     min_lon=lonMin, max_lon=lonMax,
-                                     min_lat=latMin, max_lat=latMax,
-                                     projection=crs,
-                                     fig=fig,
-                                     cmap=cmap[0],
-                                     norm=cmap[1],
-                                     lat_0=siteLat,
-                                     lon_0=siteLon,
-                                     embelish=False,
-                                     colorbar_flag=False,
-                                     title_flag=False,
-                                     ticklabs=[],
-                                     ticks=[],
-                                     lat_lines=[],
-                                     lon_lines=[],
-                                     raster=True)
-
-                display.plot_point(siteLon, siteLat, symbol='^',
-                                   color='orange')
-                print("Plotting complete! Finishing up...")
-
-                # plt.colorbar()
-
-                # Add the informational bar at the top, using info directly
-                #   from the original datafiles that we opened at the top
-                line1 = "%s  %s  Filtered Reflectivity" % (site, dprod)
-                line1 = line1.upper()
-
-                # We don't need microseconds shown on this plot
-                tendstr = tend.strftime("%Y-%m-%d  %H:%M:%SZ")
-                line2 = "VCP MODE %03d  %s" % (vcpmode, tendstr)
-                line2 = line2.upper()
-
-                # Black background for top label text
-                #   NOTE: Z order is important! Text must be higher than trect
-                trect = mpatches.Rectangle((0.0, 0.955),
-                                           width=1.0, height=0.045,
-                                           edgecolor=None, facecolor='black',
-                                           fill=True, alpha=1.0, zorder=100,
-                                           transform=ax.transAxes)
-                ax.add_patch(trect)
-
-                # Line 1
-                plt.annotate(line1, (0.5, 0.985), xycoords='axes fraction',
-                            fontfamily='monospace',
-                            horizontalalignment='center',
-                            verticalalignment='center',
-                            color='white', fontweight='bold', zorder=200)
-                # Line 2
-                plt.annotate(line2, (0.5, 0.965), xycoords='axes fraction',
-                            fontfamily='monospace',
-                            horizontalalignment='center',
-                            verticalalignment='center',
-                            color='white', fontweight='bold', zorder=200)
-
-                # Useful for testing getCmap changes
-                # plt.colorbar()
-
-                print("Saving...")
-                plt.savefig(outpname, dpi=100, facecolor='black', frameon=True)
-                print("Saved as %s." % (outpname))
-                plt.close()
-
-                i += 1
-                print("%d plots complete" % (i))
 
-    return i
+def sampleRadar(radar, sampleRadii, field='reflectivity_masked'):
+    """
+    Stats of 'field' on the (single, lowest) sweep of 'radar' within each
+    of 'sampleRadii' (km) of our sites; see siteSampler
+    """
+    site = radar.metadata['instrument_name']
+    rng = radar.range['data']
+    azi = radar.azimuth['data']
+
+    # Each volume starts wherever the antenna happened to be pointing, so
+    #   the rays are put in azimuth order; then the gates near each site
+    #   are (to within a ray) the same ones every time the ray and gate
+    #   counts match, and they only have to be found once
+    order = np.argsort(azi)
+    key = ('nexrad', site, azi.size, rng.size, float(rng[0]),
+           float(rng[1] - rng[0]))
+
+    def gateCoords():
+        lats, lons, _ = radar.get_gate_lat_lon_alt(0)
+        return lons[order], lats[order]
+
+    sampler = ssamp.getSampler(key, gateCoords, radii=sampleRadii)
+
+    return sampler.sample(radar.fields[field]['data'][order])
+
+
+def renderFrame(infile, outpname, cLat=34.7443, cLon=-111.4223, cmap=None,
+                roads=None, counties=None, cachedir=None, renderer='mpl',
+                memory=None, sampleRadii=None, reader='pyart', nunzip=1,
+                lut=None, products=(), productLUTs=None):
+    """
+    Actually read, QC, and plot a single file.  'memory' is the contents
+    of 'infile' if it's not actually on disk.  See makePlots for 'reader',
+    'nunzip' and 'products'.  'lut' is the mapLayers.ColorLUT for the
+    'lut' renderer, and will be made from 'cmap' if it's not given; same
+    for 'productLUTs' (keyed by product) and the products.
+
+    Returns True if the plot was made (False if the file wasn't plotable)
+    and the site samples if 'sampleRadii' was given (otherwise None).
+    """
+    if products != ():
+        # Everything comes from the one read; the base reflectivity is
+        #   just the lowest sweep of it
+        vol = readVolume(infile, memory=memory, nthreads=nunzip)
+        radar = makeRadar(vol, sweeps=[0])
+    else:
+        vol = None
+        radar = readNEXRAD(infile, memory=memory, lean=(reader == 'lean'),
+                           nthreads=nunzip)
+
+    # Pull out the identifiers
+    plotable = False
+    samples = None
+    try:
+        site = radar.metadata['instrument_name']
+        siteLat = radar.latitude['data'][0]
+        siteLon = radar.longitude['data'][0]
+
+        dprod = radar.metadata['original_container']
+
+        # Get the VCP mode (specific radar scan mode); see also:
+        # https://www.weather.gov/jetstream/vcp_max
+        vcpmode = radar.metadata['vcp_pattern']
+        plotable = True
+    except KeyError as ke:
+        # This usually means a bad file
+        print(str(ke))
+        plotable = False
+
+    if plotable is True:
+        # Pull out the time stamp; skip the site name
+        fullts = os.path.basename(infile)[4:]
+        tend = dt.strptime(fullts, "%Y%m%d_%H%M%S")
+
+        # Filter out crud that is probably bugs and stuff,
+        #   good enough for what we're doing
+        print("Debugging...")
+        qcradar = literallyDeBug(radar, vcpmode)
+        print("Debugging complete!")
+
+        # Straight from the gates, before anything's drawn
+        if sampleRadii is not None:
+            samples = sampleRadar(qcradar, sampleRadii)
+
+        latMin, latMax, lonMin, lonMax = commap.set_plot_extent(cLat,
+                                                                cLon)
+
+        # Get the projection info for the plot axes
+        crs = ccrs.LambertConformal(central_latitude=siteLat,
+                                    central_longitude=siteLon)
+
+        # Add the informational bar at the top, using info directly
+        #   from the original datafiles that we opened at the top
+        line1 = "%s  %s  Filtered Reflectivity" % (site, dprod)
+        line1 = line1.upper()
+
+        # We don't need microseconds shown on this plot
+        tendstr = tend.strftime("%Y-%m-%d  %H:%M:%SZ")
+        line2 = "VCP MODE %03d  %s" % (vcpmode, tendstr)
+        line2 = line2.upper()
+
+        extent = (lonMin, lonMax, latMin, latMax)
+        layers = None
+        if vol is not None:
+            # These go first, so if the base frame is there so are they
+            layers = getStaticLayers(crs, extent, site, siteLat, siteLon,
+                                     roads=roads, counties=counties,
+                                     cachedir=cachedir)
+            renderProducts(vol, products, outpname, crs, extent, layers,
+                           "%s  %s" % (site, dprod), line2,
+                           productLUTs=productLUTs, cachedir=cachedir)
+
+        if renderer == 'lut':
+            # Gates go straight onto the map raster through the cached
+            #   lookup table, and no matplotlib at all
+            if layers is None:
+                layers = getStaticLayers(crs, extent, site, siteLat,
+                                         siteLon, roads=roads,
+                                         counties=counties,
+                                         cachedir=cachedir)
+            if lut is None:
+                lut = mlayers.ColorLUT(cmap[0], norm=cmap[1])
+
+            print("Gridding radar data...")
+            rgrid = gridRadar(qcradar, crs, extent, layers, cachedir=cachedir)
+            frame = mlayers.compositeFrame(layers,
+                                           data=lut.lookup(lut.index(rgrid)))
+            img = mlayers.drawTitleBar(frame, layers, line1, line2)
+            mlayers.savePNG(img, outpname)
+            return plotable, samples
+
+        display = RadarMapDisplay(qcradar, )
+
+        if renderer == 'layers':
+            # Only the radar data and the title bar are drawn from scratch
+            if layers is None:
+                layers = getStaticLayers(crs, extent, site, siteLat,
+                                         siteLon, roads=roads,
+                                         counties=counties,
+                                         cachedir=cachedir)
+
+            print("Plotting radar data...")
+            rgba = renderRadarLayer(display, crs, extent, cmap,
+                                    siteLat, siteLon)
+            title = mlayers.renderTitleBar(layers, line1, line2)
+            frame = mlayers.compositeFrame(layers, data=rgba, title=title,
+                                           dataInAxes=False)
+            mlayers.saveFrame(frame, outpname)
+            return plotable, samples
+
+        # Get the proper plot extents so we have no whitespace
+        prlon = (crs.x_limits[1] - crs.x_limits[0])
+        prlat = (crs.y_limits[1] - crs.y_limits[0])
+        # Ultimate image width/height
+        paspect = prlon/prlat
+
+        # Leaving this hacked in for now
+        figsize = (7., 7.)
+
+        print(prlon, prlat, paspect)
+        print(figsize)
+
+        # Figure creation
+        fig = plt.figure(figsize=figsize, dpi=100)
+
+        # Needed to remove any whitespace/padding around the imshow()
+        plt.subplots_adjust(left=0., right=1., top=1., bottom=0.)
+
+        # Tell matplotlib we're using a map projection so cartopy
+        #   takes over and overloades Axes() with GeoAxes()
+        ax = plt.axes(projection=crs)
+
+        ax.background_patch.set_facecolor('#262629')
+
+        # Some custom stuff
+        ax = commap.add_map_features(ax, counties=counties,
+                                     roads=roads)
+        ax = commap.add_AZObs(ax)
+
+        # Clear out the crap on the edges
+        ax.set_xlabel("")
+        ax.set_ylabel("")
+        ax.set_xticklabels([])
+        ax.set_yticklabels([])
+
+        print("Plotting radar data...")
+        display.plot_ppi_map('reflectivity_masked',
+                             mask_outside=True,
+                             min_lon=lonMin, max_lon=lonMax,
+                             min_lat=latMin, max_lat=latMax,
+                             projection=crs,
+                             fig=fig,
+                             cmap=cmap[0],
+                             norm=cmap[1],
+                             lat_0=siteLat,
+                             lon_0=siteLon,
+                             embelish=False,
+                             colorbar_flag=False,
+                             title_flag=False,
+                             ticklabs=[],
+                             ticks=[],
+                             lat_lines=[],
+                             lon_lines=[],
+                             raster=True)
+
+        display.plot_point(siteLon, siteLat, symbol='^',
+                           color='orange')
+        print("Plotting complete! Finishing up...")
+
+        # plt.colorbar()
+
+        # Black background for top label text
+        #   NOTE: Z order is important! Text must be higher than trect
+        trect = mpatches.Rectangle((0.0, 0.955),
+                                   width=1.0, height=0.045,
+                                   edgecolor=None, facecolor='black',
+                                   fill=True, alpha=1.0, zorder=100,
+                                   transform=ax.transAxes)
+        ax.add_patch(trect)
+
+        # Line 1
+        plt.annotate(line1, (0.5, 0.985), xycoords='axes fraction',
+                    fontfamily='monospace',
+                    horizontalalignment='center',
+                    verticalalignment='center',
+                    color='white', fontweight='bold', zorder=200)
+        # Line 2
+        plt.annotate(line2, (0.5, 0.965), xycoords='axes fraction',
+                    fontfamily='monospace',
+                    horizontalalignment='center',
+                    verticalalignment='center',
+                    color='white', fontweight='bold', zorder=200)
+
+        # Useful for testing getCmap changes
+        # plt.colorbar()
+
+        print("Saving...")
+        # Swapped into place since the published copies are hard links to it
+        tname = "%s.%d.tmp" % (outpname, os.getpid())
+        plt.savefig(tname, dpi=100, facecolor='black', frameon=True,
+                    format='png')
+        os.replace(tname, outpname)
+        print("Saved as %s." % (outpname))
+        plt.close()
+
+    return plotable, samples
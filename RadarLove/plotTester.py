@@ -22,6 +22,7 @@ import commonMapping as commap
 if __name__ == "__main__":
     inloc = "./inputs/"
     outloc = "./outputs/pngs/"
+    cout = "./outputs/cache/"
     cfiles = "./shapefiles/cb_2018_us_county_5m/"
 
     # in degrees
@@ -33,14 +34,16 @@ if __name__ == "__main__":
 
     print("Reading road data...")
     roads = commap.parseRoads(rclasses,
-                              center=mapcenter, centerRad=filterRadius)
+                              center=mapcenter, centerRad=filterRadius,
+                              cachedir=cout)
     for rkey in rclasses:
         print("%s: %d found within %d degrees of center" % (rkey,
                                                             len(roads[rkey]),
                                                             filterRadius))
 
     counties = commap.parseCounties(cfiles + "cb_2018_us_county_5m.shp",
-                                    center=mapcenter, centerRad=filterRadius)
+                                    center=mapcenter, centerRad=filterRadius,
+                                    cachedir=cout)
     print("%d counties found within %d degrees of center" % (len(counties),
                                                              filterRadius))
     pn.makePlots(inloc, outloc, mapcenter, cmap=cmap,
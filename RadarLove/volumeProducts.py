@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+#  Created on 18 Oct 2026
+#
+#  @author: rhamilton
+
+"""Products that use every tilt of a NEXRAD volume, not just the lowest.
+
+The base reflectivity only shows what the lowest (0.5 degree) sweep saw,
+so a storm that's still a ways off, with its core up above the beam,
+looks a lot weaker than it is.  So from the same volume we also make:
+    - composite reflectivity; the most that any tilt saw above each pixel
+    - echo tops; how high (kft above sea level) the beam of the highest
+      tilt that saw at least 18 dBZ was, above each pixel
+
+Both come from one read of the volume (level2.readLevel2 with every
+sweep), and one pass over it:
+    - the gates of all of the tilts are QC'd together, with the same cuts
+      as literallyDeBug uses on the lowest sweep (see notWeather)
+    - each tilt has its own cached gate lookup table (see gateLUT.py), and
+      all of them are gathered onto the map raster in one go, which gives
+      a (tilt, y, x) stack of reflectivity and of beam height
+    - both products are then just a max down the stack
+
+Only the tilts with ZDR and RhoHV can be QC'd that way, so the Doppler
+halves of the split cuts are skipped; the surveillance half at the same
+elevation has the reflectivity anyway, and farther out.  When a tilt is
+repeated (SAILS) only the newest one is used.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+
+import gateLUT as glut
+
+
+# Moments needed to QC a tilt
+qcMoments = ('REF', 'ZDR', 'RHO')
+
+# Same threshold as the NWS enhanced echo tops product
+echoTopDBZ = 18.
+
+# For the titles
+productNames = {'composite': "Composite Reflectivity",
+                'echotops': "Echo Tops (kft)"}
+
+
+def notWeather(refl, zdr, rhohv, vcpmode):
+    """
+    Mask of the gates that are probably bugs and stuff rather than
+    weather; see literallyDeBug for what each of the cuts means.  The
+    arrays can be any shape as long as they match.
+    """
+    # Reflectivity values less than some cutoff point
+    #   value originally was 20
+    # The logic below attempts to account for the radar scan operating
+    #   in "Clear Air Mode" which can result in valid values < 0.  If that's
+    #   the scan type, we set a super low bar for reflectivity filtering
+    #   otherwise we choose a low-ish value to try to eliminate fuzziness
+    if vcpmode in [31, 32, 35]:
+        refCutVal = -40
+    else:
+        refCutVal = 5
+    refLow = np.less(refl, refCutVal)
+
+    # Differential reflectivity greater than some cutoff point
+    #   Note that this is doing abs() first, so it's filtering out both ends
+    #   value originally was 2.3
+    zdrCut = np.greater(np.abs(zdr), 2.0)
+
+    # Cross correlation values below a threshold
+    #   value originally was 0.95
+    rhohvLow = np.less(rhohv, 0.90)
+
+    # Combine all of the above into a master mask array. Flag values where:
+    #   Reflectivity < cutoff OR (DifferentialReflectivity is high OR
+    #                             CrossCorrelationRatio is low)
+    notweather = np.logical_or(refLow, np.logical_or(zdrCut, rhohvLow))
+
+    return notweather
+
+
+def pickTilts(vol):
+    """
+    Indices (into vol.sweeps) of the tilts to use, lowest first; only
+    ones that can be QC'd, and only the newest of each elevation
+    """
+    newest = {}
+    for i, sweep in enumerate(vol.sweeps):
+        if all(each in sweep['moments'] for each in qcMoments):
+            elev = np.round(float(np.median(sweep['elevation'])), 1)
+            newest.update({elev: i})
+
+    return [newest[each] for each in sorted(newest)]
+
+
+def beamHeight(ranges, elevation, altitude):
+    """
+    Height (m above sea level) of the center of the beam at 'elevation'
+    (degrees) at each of the slant 'ranges' (m) from a radar at 'altitude'
+    (m); the same 4/3 Earth radius model as gateLUT
+    """
+    rng = np.asarray(ranges, dtype=np.float64)
+    elev = np.deg2rad(elevation)
+    z = np.sqrt(rng**2 + glut.effRadius**2 +
+                2.*rng*glut.effRadius*np.sin(elev)) - glut.effRadius
+
+    return z + altitude
+
+
+def stackVolume(vol, crs, extent, shape, cachedir=None):
+    """
+    QC every usable tilt of the level2.Level2Volume 'vol' and put it on a
+    'shape' (ny, nx) raster of the map axes of 'crs' with the lon/lat
+    'extent'.  Returns (tilt, y, x) float32 arrays of the reflectivity
+    (NaN where there's nothing) and of the beam height there.
+    """
+    refls, zdrs, rhohvs, heights = [], [], [], []
+    gateIdx, heightIdx = [], []
+    ngood, nheight = 0, 0
+    for i in pickTilts(vol):
+        sweep = vol.sweeps[i]
+        elev = float(np.median(sweep['elevation']))
+        nrays = sweep['azimuth'].size
+        rng = sweep['range']
+        ngates = rng.size
+        lookup = glut.getGateLUT(vol.site, vol.latitude, vol.longitude,
+                                 elev, rng, nrays, crs, extent, shape,
+                                 cachedir=cachedir)
+
+        moms = sweep['moments']
+        refls.append(moms['REF'].ravel())
+        zdrs.append(moms['ZDR'].ravel())
+        rhohvs.append(moms['RHO'].ravel())
+        heights.append(beamHeight(rng, elev, vol.altitude))
+
+        # Where each pixel lands in all of the tilts strung together;
+        #   the height only depends on the gate
+        idx = glut.sweepIndex(lookup, sweep['azimuth'], ngates)
+        gateIdx.append(np.where(idx >= 0, ngood + idx, -1))
+        heightIdx.append(np.where(idx >= 0, nheight + lookup.gateIdx, -1))
+        ngood += nrays*ngates
+        nheight += ngates
+
+    if refls == []:
+        empty = np.full((0,) + tuple(shape), np.nan, dtype=np.float32)
+        return empty, empty
+
+    # All of the gates of all of the tilts are QC'd in one go
+    refl = np.ma.concatenate(refls)
+    bad = notWeather(refl, np.ma.concatenate(zdrs),
+                     np.ma.concatenate(rhohvs), vol.vcp)
+    flat = np.ma.filled(np.ma.masked_where(bad, refl), np.nan)
+
+    # ...and put on the map in one go too; everything that's off the
+    #   radar points at one extra NaN on the end
+    flat = np.append(flat.astype(np.float32), np.float32(np.nan))
+    gateIdx = np.stack(gateIdx)
+    rgrid = flat[np.where(gateIdx >= 0, gateIdx, flat.size - 1)]
+
+    hflat = np.append(np.concatenate(heights), np.nan).astype(np.float32)
+    heightIdx = np.stack(heightIdx)
+    hgrid = hflat[np.where(heightIdx >= 0, heightIdx, hflat.size - 1)]
+
+    return rgrid, hgrid
+
+
+def compositeReflectivity(rgrid):
+    """
+    Max reflectivity down the (tilt, y, x) stack 'rgrid'; returns a masked
+    float32 array
+    """
+    if rgrid.shape[0] == 0:
+        return np.ma.masked_all(rgrid.shape[1:], dtype=np.float32)
+
+    # fmax skips over NaNs (unless that's all there is)
+    return np.ma.masked_invalid(np.fmax.reduce(rgrid, axis=0))
+
+
+def echoTops(rgrid, hgrid, threshold=echoTopDBZ):
+    """
+    Highest beam height (kft) in the (tilt, y, x) stack 'hgrid' where the
+    reflectivity in 'rgrid' is at least 'threshold' (dBZ); returns a
+    masked float32 array
+    """
+    if rgrid.shape[0] == 0:
+        return np.ma.masked_all(rgrid.shape[1:], dtype=np.float32)
+
+    with np.errstate(invalid='ignore'):
+        above = rgrid >= threshold
+    tops = np.fmax.reduce(np.where(above, hgrid, np.nan), axis=0)
+
+    return np.ma.masked_invalid(tops/304.8)
+
+
+def makeProducts(vol, crs, extent, shape, products=('composite', 'echotops'),
+                 cachedir=None):
+    """
+    Make each of 'products' (see productNames) from the volume 'vol' on
+    a 'shape' raster of the map axes of 'crs' with the lon/lat 'extent';
+    returns a dict of the masked arrays keyed by product name
+    """
+    rgrid, hgrid = stackVolume(vol, crs, extent, shape, cachedir=cachedir)
+
+    grids = {}
+    for name in products:
+        if name == 'composite':
+            grids.update({name: compositeReflectivity(rgrid)})
+        elif name == 'echotops':
+            grids.update({name: echoTops(rgrid, hgrid)})
+        else:
+            print("Unknown volume product %s!" % (name))
+
+    return grids